@@ -0,0 +1,88 @@
+""" Benchmark Cache.linkDeps() on a synthetic repository """
+
+import tempfile
+import shutil
+import sys
+import time
+
+from smart import init
+
+datadir = tempfile.mkdtemp()
+init(datadir=datadir)
+
+from smart.backends.deb.base import DebPackage, DebProvides, DebNameProvides
+from smart.backends.deb.base import DebRequires, DebOrRequires, DebUpgrades
+from smart.backends.deb.base import DebConflicts
+from smart.cache import Cache, Loader
+
+PACKAGES = 100000
+VIRTUALS = 1000
+
+class SyntheticLoader(Loader):
+
+    def __init__(self, packages):
+        Loader.__init__(self)
+        self._count = packages
+
+    def load(self):
+        for i in range(self._count):
+            name = "pkg%d" % i
+            version = "%d.%d-%d" % (i%7, i%13, i%3)
+            prvargs = [(DebNameProvides, name, version)]
+            reqargs = [(DebRequires, "libc", ">=", "2.%d" % (i%40)),
+                       (DebRequires, "pkg%d" % (i//2), ">=", "0.%d" % (i%5))]
+            if i%10 == 0:
+                # Popular virtual names, provided by many versions.
+                virtual = "virtual%d" % (i%VIRTUALS)
+                prvargs.append((DebProvides, virtual, "%d.0" % (i%50)))
+                prvargs.append((DebProvides, "perl-api", "5.%d" % (i%200)))
+            if i%3 == 0:
+                reqargs.append((DebRequires, "perl-api", ">=",
+                                "5.%d" % (i%150)))
+                reqargs.append((DebOrRequires,
+                                (("virtual%d" % (i%VIRTUALS), ">=",
+                                  "%d.0" % (i%30)),
+                                 ("pkg%d" % (i+1), None, None))))
+            if i < 40:
+                prvargs.append((DebNameProvides, "libc", "2.%d" % i))
+            self.buildPackage((DebPackage, name, version), prvargs, reqargs,
+                              [(DebUpgrades, name, "<", version)],
+                              [(DebConflicts, "pkg%d" % (i+3), "<<", "1.0")])
+
+def main():
+    packages = PACKAGES
+    if len(sys.argv) > 1:
+        packages = int(sys.argv[1])
+    cache = Cache()
+    cache.addLoader(SyntheticLoader(packages))
+    start = time.time()
+    cache.load()
+    print "load:\t\t%fs" % (time.time()-start)
+    print "packages:\t%d" % len(cache.getPackages())
+    print "provides:\t%d" % len(cache.getProvides())
+    print "requires:\t%d" % len(cache.getRequires())
+    best = None
+    for i in range(3):
+        for prv in cache.getProvides():
+            prv.requiredby = prv.upgradedby = prv.conflictedby = ()
+            prv.recommendedby = ()
+        for lst in (cache.getRequires(), cache.getRecommends(),
+                    cache.getUpgrades(), cache.getConflicts()):
+            for dep in lst:
+                dep.providedby = ()
+        start = time.time()
+        cache.linkDeps()
+        elapsed = time.time()-start
+        if best is None or elapsed < best:
+            best = elapsed
+    print "linkDeps:\t%fs" % best
+    links = 0
+    for req in cache.getRequires():
+        links += len(req.providedby)
+    print "links:\t\t%d" % links
+
+if __name__ == "__main__":
+    try:
+        main()
+    finally:
+        shutil.rmtree(datadir)
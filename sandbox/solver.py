@@ -0,0 +1,107 @@
+""" Benchmark Transaction.run() upgrading a synthetic system
+
+Usage: solver.py [packages [budget [full]]]
+
+With "full", weights are computed over the whole changeset for every
+alternative, instead of incrementally.
+"""
+
+import tempfile
+import shutil
+import sys
+import time
+
+from smart import init, sysconf
+
+datadir = tempfile.mkdtemp()
+init(datadir=datadir)
+
+from smart.backends.deb.base import DebPackage, DebProvides, DebNameProvides
+from smart.backends.deb.base import DebRequires, DebUpgrades, DebConflicts
+from smart.transaction import Transaction, PolicyUpgrade, UPGRADE
+from smart.channel import PackageChannel
+from smart.cache import Cache, Loader
+
+PACKAGES = 3000
+SERVICES = 50
+PROVIDERS = 4
+BACKENDS = 10
+
+class FullWeightPolicyUpgrade(PolicyUpgrade):
+
+    def getIncrementalWeight(self):
+        return None
+
+class SyntheticLoader(Loader):
+
+    def __init__(self, packages, installed):
+        Loader.__init__(self)
+        self._count = packages
+        self._installed = installed
+        self._version = installed and "1.0" or "2.0"
+
+    def getChannel(self):
+        return PackageChannel("synthetic", str(self._installed))
+
+    def load(self):
+        version = self._version
+        for i in range(self._count):
+            name = "pkg%d" % i
+            reqargs = [(DebRequires, "pkg%d" % (i//2), ">=", "1.0")]
+            if not self._installed and i%5 == 0:
+                # Requirements with several possible providers.
+                reqargs.append((DebRequires, "service%d" % (i%SERVICES),
+                                None, None))
+            self.buildPackage((DebPackage, name, version),
+                              [(DebNameProvides, name, version)], reqargs,
+                              [(DebUpgrades, name, "<<", version)],
+                              [(DebConflicts, name, "<<", version)])
+        if self._installed:
+            return
+        for i in range(SERVICES):
+            for j in range(PROVIDERS):
+                name = "service%d-provider%d" % (i, j)
+                reqargs = [(DebRequires, "backend%d" % (i%BACKENDS),
+                            None, None)]
+                if j == 0:
+                    # Never installable.
+                    reqargs.append((DebRequires, "missing", None, None))
+                self.buildPackage((DebPackage, name, "1.0"),
+                                  [(DebNameProvides, name, "1.0"),
+                                   (DebProvides, "service%d" % i, None)],
+                                  reqargs, [], [])
+        for i in range(BACKENDS):
+            for j in range(PROVIDERS):
+                name = "backend%d-provider%d" % (i, j)
+                self.buildPackage((DebPackage, name, "1.0"),
+                                  [(DebNameProvides, name, "1.0"),
+                                   (DebProvides, "backend%d" % i, None)],
+                                  [], [], [])
+
+def main():
+    packages = PACKAGES
+    if len(sys.argv) > 1:
+        packages = int(sys.argv[1])
+    if len(sys.argv) > 2:
+        sysconf.set("solver-budget", int(sys.argv[2]))
+    policy = PolicyUpgrade
+    if len(sys.argv) > 3 and sys.argv[3] == "full":
+        policy = FullWeightPolicyUpgrade
+    cache = Cache()
+    cache.addLoader(SyntheticLoader(packages, True))
+    cache.addLoader(SyntheticLoader(packages, False))
+    cache.load()
+    trans = Transaction(cache, policy)
+    for pkg in cache.getPackages():
+        if pkg.installed:
+            trans.enqueue(pkg, UPGRADE)
+    start = time.time()
+    trans.run()
+    print "run:\t\t%fs" % (time.time()-start)
+    print "changes:\t%d" % len(trans.getChangeSet())
+
+if __name__ == "__main__":
+    try:
+        main()
+    finally:
+        shutil.rmtree(datadir)
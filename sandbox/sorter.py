@@ -0,0 +1,85 @@
+""" Benchmark ChangeSetSorter ordering a synthetic dist-upgrade
+
+Usage: sorter.py [packages [loopsize]]
+
+Every package is upgraded, and each group of loopsize packages is a
+loop of pre-requirements, with an extra requirement back into the
+previous group.
+"""
+
+import tempfile
+import shutil
+import sys
+import time
+
+from smart import init
+
+datadir = tempfile.mkdtemp()
+init(datadir=datadir)
+
+from smart.backends.deb.base import DebPackage, DebNameProvides
+from smart.backends.deb.base import DebRequires, DebPreRequires, DebUpgrades
+from smart.transaction import ChangeSet, INSTALL, REMOVE
+from smart.sorter import ChangeSetSorter
+from smart.channel import PackageChannel
+from smart.cache import Cache, Loader
+
+PACKAGES = 3000
+LOOPSIZE = 10
+
+class SyntheticLoader(Loader):
+
+    def __init__(self, packages, loopsize, installed):
+        Loader.__init__(self)
+        self._count = packages
+        self._loopsize = loopsize
+        self._installed = installed
+        self._version = installed and "1.0" or "2.0"
+
+    def getChannel(self):
+        return PackageChannel("synthetic", str(self._installed))
+
+    def load(self):
+        version = self._version
+        loopsize = self._loopsize
+        for i in range(self._count):
+            name = "pkg%d" % i
+            group = i-i%loopsize
+            next = group+(i+1)%loopsize
+            reqargs = [(DebPreRequires, "pkg%d" % next, None, None)]
+            if group:
+                reqargs.append((DebRequires, "pkg%d" % (group-1), None, None))
+            self.buildPackage((DebPackage, name, version),
+                              [(DebNameProvides, name, version)], reqargs,
+                              [(DebUpgrades, name, "<<", version)], [])
+
+def main():
+    packages = PACKAGES
+    loopsize = LOOPSIZE
+    if len(sys.argv) > 1:
+        packages = int(sys.argv[1])
+    if len(sys.argv) > 2:
+        loopsize = int(sys.argv[2])
+    cache = Cache()
+    cache.addLoader(SyntheticLoader(packages, loopsize, True))
+    cache.addLoader(SyntheticLoader(packages, loopsize, False))
+    cache.load()
+    changeset = ChangeSet(cache)
+    for pkg in cache.getPackages():
+        if pkg.installed:
+            changeset.set(pkg, REMOVE)
+        else:
+            changeset.set(pkg, INSTALL)
+    start = time.time()
+    sorter = ChangeSetSorter(changeset)
+    print "relations:\t%fs" % (time.time()-start)
+    start = time.time()
+    sorted = sorter.getSorted()
+    print "sort:\t\t%fs" % (time.time()-start)
+    print "elements:\t%d" % len(sorted)
+
+if __name__ == "__main__":
+    try:
+        main()
+    finally:
+        shutil.rmtree(datadir)
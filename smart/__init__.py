@@ -178,20 +178,26 @@ def initDistro(ctrl):
 
 def initPlugins():
     # Import every plugin, and let they do whatever they want. Backends
-    # are also considered plugins for that matter.
+    # are also considered plugins for that matter. Plugins and backends
+    # which tell what they need are only imported when it's needed.
     from smart.const import PLUGINSDIR
     from smart import plugins
     from smart import backends
     pluginsdir = os.path.dirname(plugins.__file__)
     for entry in os.listdir(pluginsdir):
         if entry != "__init__.py" and entry.endswith(".py"):
-            __import__("smart.plugins."+entry[:-3])
+            name = entry[:-3]
         else:
             entrypath = os.path.join(pluginsdir, entry)
-            if os.path.isdir(entrypath):
-                initpath = os.path.join(entrypath, "__init__.py")
-                if os.path.isfile(initpath):
-                    __import__("smart.plugins."+entry)
+            initpath = os.path.join(entrypath, "__init__.py")
+            if not os.path.isfile(initpath):
+                continue
+            name = entry
+        if name in plugins.OPTIONS:
+            option, default = plugins.OPTIONS[name]
+            if not sysconf.get(option, default):
+                continue
+        __import__("smart.plugins."+name)
     if os.path.isdir(PLUGINSDIR):
         for entry in os.listdir(PLUGINSDIR):
             entrypath = os.path.join(PLUGINSDIR, entry)
@@ -201,7 +207,10 @@ def initPlugins():
         entrypath = os.path.join(backendsdir, entry)
         if os.path.isdir(entrypath):
             initpath = os.path.join(entrypath, "__init__.py")
-            if os.path.isfile(initpath):
+            if entry in backends.HOOKS:
+                for hookname in backends.HOOKS[entry]:
+                    hooks.registerModule(hookname, "smart.backends."+entry)
+            elif os.path.isfile(initpath):
                 __import__("smart.backends."+entry)
 
 def initPycurl():
@@ -20,3 +20,13 @@
 # Foundation, Inc., 59 Temple Place, Suite 330, Boston, MA  02111-1307  USA
 #
 
+# Hooks registered by backend packages when imported. Packages listed
+# here are only imported once one of their hooks is called, while any
+# other backend is imported when plugins are initialized.
+HOOKS = {
+    "arch":  ["check-package-file"],
+    "deb":   ["check-package-file"],
+    "rpm":   ["check-package-file"],
+    "slack": ["check-package-file"],
+}
+
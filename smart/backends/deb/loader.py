@@ -22,7 +22,7 @@
 #
 from smart.cache import Loader, PackageInfo
 from smart.util.strtools import globdistance
-from smart.util.tagfile import TagFile
+from smart.util.tagfile import TagFile, TagFileIndex
 from smart.channel import FileChannel
 from smart.backends.deb.debver import parserelation, parserelations
 from smart.backends.deb.base import *
@@ -251,14 +251,14 @@ class DebTagLoader(Loader):
             self._sections[pkg] = intern(section.get("section", ""))
 
     def search(self, searcher):
-        offsets = {}
-        for pkg in self._packages:
-            offsets[pkg.loaders[self]] = pkg
+        if searcher.summary or searcher.description:
+            descriptions = self.getDescriptions()
+        elif searcher.group:
+            descriptions = [(pkg, "") for pkg in self._packages]
+        else:
+            return
 
-        for section, offset in self.getSections(Progress()):
-            pkg = offsets.get(offset)
-            if not pkg:
-                continue
+        for pkg, toks in descriptions:
 
             ratio = 0
             if searcher.group:
@@ -272,7 +272,7 @@ class DebTagLoader(Loader):
                 continue
 
             if searcher.summary or searcher.description:
-                toks = section.get("description", "").split("\n", 1)
+                toks = toks.split("\n", 1)
                 if len(toks) == 2:
                     summary, description = toks
                 else:
@@ -294,6 +294,16 @@ class DebTagLoader(Loader):
             if ratio:
                 searcher.addResult(pkg, ratio)
 
+    def getDescriptions(self):
+        offsets = {}
+        for pkg in self._packages:
+            offsets[pkg.loaders[self]] = pkg
+
+        for section, offset in self.getSections(Progress()):
+            pkg = offsets.get(offset)
+            if pkg:
+                yield pkg, section.get("description", "")
+
     def getSections(self, prog):
         raise TypeError, "Subclasses of DebTagLoader must " \
                          "implement the getSections() method"
@@ -323,6 +333,7 @@ class DebTagFileLoader(DebTagLoader):
     # instances which don't have these attributes still work fine.
     _filelistsname = None
     _changelogname = None
+    _index = None
 
     def __init__(self, filename, baseurl=None, filelistsname="", changelogname=""):
         DebTagLoader.__init__(self, baseurl)
@@ -334,6 +345,23 @@ class DebTagFileLoader(DebTagLoader):
     def getLoadSteps(self):
         return os.path.getsize(self._filename)/800
 
+    def load(self):
+        DebTagLoader.load(self)
+        # Saved with the loader, so that searching doesn't have to
+        # parse the whole file again.
+        self._index = TagFileIndex(self._filename, ("description",))
+        self._index.build()
+
+    def getDescriptions(self):
+        index = self._index
+        if not index or not index.isValid():
+            for item in DebTagLoader.getDescriptions(self):
+                yield item
+            return
+        getValue = index.getValue
+        for pkg in self._packages:
+            yield pkg, getValue(pkg.loaders[self], "description", "")
+
     def getSections(self, prog):
         tf = self._tagfile
         tf.setOffset(0)
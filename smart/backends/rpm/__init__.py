@@ -25,5 +25,11 @@ import os
 def checkPackageFile(filename):
     return os.path.isfile(filename) and filename.endswith(".rpm")
 
+def rpm_join_dbpath(root, dbpath):
+    if dbpath.startswith('/') and root:
+        return os.path.join(root, dbpath[1:])
+    else:
+        return os.path.join(root, dbpath)
+
 hooks.register("check-package-file", checkPackageFile)
 
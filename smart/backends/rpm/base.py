@@ -25,6 +25,7 @@
 import zlib
 
 from rpmver import checkdep, checkver, vercmp, splitarch, splitrelease
+from smart.backends.rpm import rpm_join_dbpath
 from smart.util.strtools import isGlob
 from smart.cache import *
 from smart import *
@@ -46,12 +47,6 @@ __all__ = ["RPMPackage", "RPMProvides", "RPMNameProvides", "RPMPreRequires",
            "rpm", "getTS", "getArchScore", "getArchColor", "system_provides",
            "collapse_libc_requires"]
 
-def rpm_join_dbpath(root, dbpath):
-    if dbpath.startswith('/') and root:
-        return os.path.join(root, dbpath[1:])
-    else:
-        return os.path.join(root, dbpath)
-
 def getTS(new=False):
     if sysconf.get("rpm-extra-macros"):
         for key, value in sysconf.get("rpm-extra-macros").items():
@@ -21,8 +21,9 @@
 # Foundation, Inc., 59 Temple Place, Suite 330, Boston, MA  02111-1307  USA
 #
 from smart.backends.rpm.rpmver import checkver
-from smart.cache import PackageInfo, Loader
+from smart.cache import PackageInfo, PackageDelta, Loader
 from smart.backends.rpm.base import *
+from smart.uncompress import Uncompressor
 
 try:
     from xml.etree import cElementTree        
@@ -34,14 +35,22 @@ except ImportError:
 
 from smart import *
 import posixpath
+import commands
 import locale
 import os
+try:
+    import subprocess
+except ImportError:
+    subprocess = None
 
 NS_COMMON    = "http://linux.duke.edu/metadata/common"
 NS_RPM       = "http://linux.duke.edu/metadata/rpm"
 NS_FILELISTS = "http://linux.duke.edu/metadata/filelists"
 
+APPLYDELTARPM = "/usr/bin/applydeltarpm"
+
 BYTESPERPKG = 3000
+COMPRESSEDBYTESPERPKG = 300
 
 def nstag(ns, tag):
     return "{%s}%s" % (ns, tag)
@@ -77,6 +86,18 @@ class RPMMetaDataPackageInfo(PackageInfo):
     def getSHA256(self, url):
         return self._info.get("sha256")
 
+    def getDeltas(self, url):
+        deltas = []
+        for oldversion, location, size, sequence, digests \
+                in self._info.get("deltas", ()):
+            deltaurl = posixpath.join(self._loader._baseurl, location)
+            deltas.append(RPMMetaDataDelta(self._package, oldversion,
+                                           sequence, deltaurl, size,
+                                           digests.get("md5"),
+                                           digests.get("sha"),
+                                           digests.get("sha256")))
+        return deltas
+
     def getDescription(self):
         return self._info.get("description", "")
 
@@ -98,15 +119,58 @@ class RPMMetaDataPackageInfo(PackageInfo):
     def getLicense(self):
         return self._info.get("license", "")
 
+class RPMMetaDataDelta(PackageDelta):
+
+    def __init__(self, package, oldversion, sequence, *args):
+        PackageDelta.__init__(self, *args)
+        self._package = package
+        self._oldversion = oldversion
+        self._sequence = sequence
+
+    def isApplicable(self):
+        if not os.path.isfile(APPLYDELTARPM):
+            return False
+        pkg = self._package
+        for loader in pkg.loaders:
+            cache = loader.getCache()
+            break
+        else:
+            return False
+        for oldpkg in cache.getPackages(pkg.name):
+            if (oldpkg.installed and oldpkg.version == self._oldversion and
+                isinstance(oldpkg, RPMPackage)):
+                return True
+        return False
+
+    def apply(self, localpath, targetpath):
+        arch = self._package.version.split("@")[1]
+        # Paths come from repository metadata, so they must not be
+        # parsed by a shell.
+        args = [APPLYDELTARPM, "-a", arch, localpath, targetpath]
+        if subprocess:
+            process = subprocess.Popen(args, stdout=subprocess.PIPE,
+                                       stderr=subprocess.STDOUT)
+            output = process.communicate()[0]
+            status = process.returncode
+        else:
+            status, output = commands.getstatusoutput(
+                args[0]+"".join([commands.mkarg(x) for x in args[1:]]))
+        if status != 0:
+            if os.path.isfile(targetpath):
+                os.unlink(targetpath)
+            raise Error, _("Can't build %s from delta: %s") % \
+                         (self._package, output.strip())
+
 
 class RPMMetaDataLoader(Loader):
 
-    __stateversion__ = Loader.__stateversion__+3
+    __stateversion__ = Loader.__stateversion__+4
  
-    def __init__(self, filename, filelistsname, baseurl):
+    def __init__(self, filename, filelistsname, baseurl, deltasname=None):
         Loader.__init__(self)
         self._filename = filename
         self._filelistsname = filelistsname
+        self._deltasname = deltasname
         self._baseurl = baseurl
         self._fileprovides = {}
         self._parsedflist = False
@@ -121,8 +185,13 @@ class RPMMetaDataLoader(Loader):
     def getInfo(self, pkg):
         return RPMMetaDataPackageInfo(pkg, self, pkg.loaders[self])
 
+    def getBytesPerPkg(self):
+        if Uncompressor.getHandler(self._filename):
+            return COMPRESSEDBYTESPERPKG
+        return BYTESPERPKG
+
     def getLoadSteps(self):
-        return os.path.getsize(self._filename)/BYTESPERPKG
+        return os.path.getsize(self._filename)/self.getBytesPerPkg()
 
     def load(self):
         METADATA    = nstag(NS_COMMON, "metadata")
@@ -156,6 +225,7 @@ class RPMMetaDataLoader(Loader):
         # Prepare progress reporting.
         lastoffset = 0
         mod = 0
+        bytesperpkg = self.getBytesPerPkg()
         progress = iface.getProgress(self._cache)
 
         # Prepare package information.
@@ -175,13 +245,18 @@ class RPMMetaDataLoader(Loader):
         # Prepare data useful for the iteration
         skip = None
         queue = []
+        root = None
 
-        file = open(self._filename)
+        # Compressed files are parsed as they're uncompressed.
+        file = Uncompressor().open(self._filename)
         for event, elem in cElementTree.iterparse(file, ("start", "end")):
             tag = elem.tag
 
             if event == "start":
 
+                if root is None:
+                    root = elem
+
                 if not skip and tag == PACKAGE:
                     if elem.get("type") != "rpm":
                         skip = PACKAGE
@@ -386,9 +461,13 @@ class RPMMetaDataLoader(Loader):
                     # Do not clear it. pkg.loaders has a reference.
                     info = {}
 
+                    # Drop the parsed packages from the tree, so that
+                    # memory usage doesn't grow with the file size.
+                    root.clear()
+
                     # Update progress
                     offset = file.tell()
-                    div, mod = divmod(offset-lastoffset+mod, BYTESPERPKG)
+                    div, mod = divmod(offset-lastoffset+mod, bytesperpkg)
                     lastoffset = offset
                     progress.add(div)
                     progress.show()
@@ -397,6 +476,74 @@ class RPMMetaDataLoader(Loader):
 
         file.close()
 
+        if self._deltasname:
+            self.loadDeltas()
+
+    def loadDeltas(self):
+        """
+        Attach the deltas found in the prestodelta file to the packages
+        they build.
+        """
+        NEWPACKAGE = "newpackage"
+        DELTA      = "delta"
+        FILENAME   = "filename"
+        SEQUENCE   = "sequence"
+        SIZE       = "size"
+        CHECKSUM   = "checksum"
+
+        packages = {}
+        for pkg in self._packages:
+            packages[pkg.name, pkg.version] = pkg
+
+        pkg = None
+        delta = None
+        root = None
+        try:
+            file = Uncompressor().open(self._deltasname)
+            for event, elem in cElementTree.iterparse(file,
+                                                      ("start", "end")):
+                tag = elem.tag
+                if event == "start":
+                    if root is None:
+                        root = elem
+                    elif tag == NEWPACKAGE:
+                        pkg = packages.get((elem.get("name"),
+                                            getVersion(elem, "")+"@"+
+                                            elem.get("arch")))
+                    elif tag == DELTA and pkg:
+                        arch = pkg.version.split("@")[1]
+                        delta = {"oldversion": getVersion(elem, "old")+
+                                               "@"+arch}
+                    continue
+                if delta is not None:
+                    if tag == FILENAME:
+                        delta["location"] = elem.text
+                    elif tag == SEQUENCE:
+                        delta["sequence"] = elem.text
+                    elif tag == SIZE:
+                        delta["size"] = int(elem.text)
+                    elif tag == CHECKSUM:
+                        delta[elem.get("type")] = elem.text
+                    elif tag == DELTA:
+                        if delta.get("location"):
+                            digests = {}
+                            for kind in ("md5", "sha", "sha256"):
+                                if kind in delta:
+                                    digests[kind] = delta[kind]
+                            pkg.loaders[self].setdefault("deltas", []).append(
+                                (delta["oldversion"], delta["location"],
+                                 delta.get("size"), delta.get("sequence"),
+                                 digests))
+                        delta = None
+                if tag == NEWPACKAGE:
+                    pkg = None
+                    root.clear()
+                elem.clear()
+            file.close()
+        except (IOError, SyntaxError, Error), e:
+            iface.warning(_("Can't load package deltas from %s: %s") %
+                          (self._deltasname, e))
+
     def loadFileProvides(self, fndict):
         bfp = self.buildFileProvides
         parsed = self._parsedflist
@@ -428,9 +575,12 @@ class RPMMetaDataLoader(Loader):
 
         pkg = None
         skip = None
-        file = open(self._filelistsname)
+        root = None
+        file = Uncompressor().open(self._filelistsname)
         for event, elem in cElementTree.iterparse(file, ("start", "end")):
             if event == "start":
+                if root is None:
+                    root = elem
                 if not skip and elem.tag == PACKAGE:
                     if elem.get("arch") == "src":
                         skip = PACKAGE
@@ -448,9 +598,19 @@ class RPMMetaDataLoader(Loader):
                         fileprovides[elem.text] = [pkg]
                     else:
                         pkgs.append(pkg)
+                elif elem.tag == PACKAGE:
+                    root.clear()
                 elem.clear()
         file.close()
 
+def getVersion(elem, prefix):
+    epoch = elem.get(prefix+"epoch")
+    version = "%s-%s" % (elem.get(prefix+"version"),
+                         elem.get(prefix+"release"))
+    if epoch and epoch != "0":
+        version = "%s:%s" % (epoch, version)
+    return version
+
 def enablePsyco(psyco):
     psyco.bind(RPMMetaDataLoader.load)
     psyco.bind(RPMMetaDataLoader.loadFileProvides)
@@ -199,6 +199,9 @@ class PackageInfo(object):
     def getSHA256(self, url):
         return None
 
+    def getDeltas(self, url):
+        return []
+
     def validate(self, url, localpath, withreason=False):
         try:
             if not os.path.isfile(localpath):
@@ -360,6 +363,45 @@ class Requires(Depends): pass
 class Upgrades(Depends): pass
 class Conflicts(Depends): pass
 
+class PackageDelta(object):
+    """
+    Difference between an installed package and the package found in
+    some URL, which may be downloaded instead of the whole package when
+    it's applicable.
+    """
+
+    def __init__(self, url, size=None, md5=None, sha=None, sha256=None):
+        self._url = url
+        self._size = size
+        self._md5 = md5
+        self._sha = sha
+        self._sha256 = sha256
+
+    def getURL(self):
+        return self._url
+
+    def getSize(self):
+        return self._size
+
+    def getMD5(self):
+        return self._md5
+
+    def getSHA(self):
+        return self._sha
+
+    def getSHA256(self):
+        return self._sha256
+
+    def isApplicable(self):
+        return False
+
+    def apply(self, localpath, targetpath):
+        """
+        Build the whole package in targetpath from the downloaded delta
+        in localpath, raising Error if it's not possible.
+        """
+        raise Error, _("Unsupported package delta")
+
 class Loader(object):
 
     def __init__(self):
@@ -593,6 +635,7 @@ class Cache(object):
         self._upgrades = []
         self._conflicts = []
         self._objmap = {}
+        self._upgraderelations = None
 
     def reset(self):
         for prv in self._provides:
@@ -707,6 +750,8 @@ class Cache(object):
                 total += loader.getLoadSteps()
         prog.set(0, total)
         prog.show()
+        from smart.loadpool import loadLoaders
+        loadLoaders(self, prog)
         for loader in self._loaders:
             if not loader._packages:
                 loader.load()
@@ -734,87 +779,39 @@ class Cache(object):
             loader.loadFileProvides(fndict)
 
     def linkDeps(self):
-        reqnames = {}
-        for req in self._requires:
-            for name in req.getMatchNames():
-                lst = reqnames.get(name)
-                if lst:
-                    lst.append(req)
-                else:
-                    reqnames[name] = [req]
-        recnames = {}
-        for rec in self._recommends:
-            for name in rec.getMatchNames():
-                lst = recnames.get(name)
-                if lst:
-                    lst.append(rec)
-                else:
-                    recnames[name] = [rec]
-        upgnames = {}
-        for upg in self._upgrades:
-            for name in upg.getMatchNames():
-                lst = upgnames.get(name)
-                if lst:
-                    lst.append(upg)
-                else:
-                    upgnames[name] = [upg]
-        cnfnames = {}
-        for cnf in self._conflicts:
-            for name in cnf.getMatchNames():
-                lst = cnfnames.get(name)
-                if lst:
-                    lst.append(cnf)
-                else:
-                    cnfnames[name] = [cnf]
+        prvnames = {}
         for prv in self._provides:
-            lst = reqnames.get(prv.name)
-            if lst:
-                for req in lst:
-                    if req.matches(prv):
-                        if req.providedby:
-                            req.providedby.append(prv)
-                        else:
-                            req.providedby = [prv]
-                        if prv.requiredby:
-                            prv.requiredby.append(req)
-                        else:
-                            prv.requiredby = [req]
-            lst = recnames.get(prv.name)
+            lst = prvnames.get(prv.name)
             if lst:
-                for rec in lst:
-                    if rec.matches(prv):
-                        if rec.providedby:
-                            rec.providedby.append(prv)
-                        else:
-                            rec.providedby = [prv]
-                        if prv.recommendedby:
-                            prv.recommendedby.append(rec)
-                        else:
-                            prv.recommendedby = [rec]
-            lst = upgnames.get(prv.name)
-            if lst:
-                for upg in lst:
-                    if upg.matches(prv):
-                        if upg.providedby:
-                            upg.providedby.append(prv)
-                        else:
-                            upg.providedby = [prv]
-                        if prv.upgradedby:
-                            prv.upgradedby.append(upg)
-                        else:
-                            prv.upgradedby = [upg]
-            lst = cnfnames.get(prv.name)
-            if lst:
-                for cnf in lst:
-                    if cnf.matches(prv):
-                        if cnf.providedby:
-                            cnf.providedby.append(prv)
-                        else:
-                            cnf.providedby = [prv]
-                        if prv.conflictedby:
-                            prv.conflictedby.append(cnf)
-                        else:
-                            prv.conflictedby = [cnf]
+                lst.append(prv)
+            else:
+                prvnames[prv.name] = [prv]
+        for deps, attr in ((self._requires, "requiredby"),
+                           (self._recommends, "recommendedby"),
+                           (self._upgrades, "upgradedby"),
+                           (self._conflicts, "conflictedby")):
+            for dep in deps:
+                for name in dep.getMatchNames():
+                    for prv in prvnames.get(name, ()):
+                        if dep.matches(prv):
+                            if dep.providedby:
+                                dep.providedby.append(prv)
+                            else:
+                                dep.providedby = [prv]
+                            lst = getattr(prv, attr)
+                            if lst:
+                                lst.append(dep)
+                            else:
+                                setattr(prv, attr, [dep])
+
+    def getLoaders(self):
+        return self._loaders
+
+    def getUpgradeRelations(self):
+        return self._upgraderelations
+
+    def setUpgradeRelations(self, relations):
+        self._upgraderelations = relations
 
     def getPackages(self, name=None):
         if not name:
@@ -853,12 +850,9 @@ class Cache(object):
             return [x for x in self._conflicts if x.name == name]
 
     def search(self, searcher):
-        if searcher.nameversion:
-            for pkg in self._packages:
-                pkg.search(searcher)
-        if searcher.provides:
-            for prv in self._provides:
-                prv.search(searcher)
+        if searcher.nameversion or searcher.provides:
+            from smart.searchindex import searchNames
+            searchNames(self, searcher)
         if searcher.requires:
             for prv in searcher.requires:
                 prvname = prv.name
@@ -884,8 +878,8 @@ class Cache(object):
                     if prvname in cnf.getMatchNames() and cnf.matches(prv):
                         searcher.addResult(cnf)
         if searcher.needsPackageInfo():
-            for loader in self._loaders:
-                loader.search(searcher)
+            from smart.searchindex import searchLoaders
+            searchLoaders(self, searcher)
 
     __stateversion__ = 1
 
@@ -901,6 +895,7 @@ class Cache(object):
             raise StateVersionError
         self._loaders = state["_loaders"]
         self._packages = state["_packages"]
+        self._upgraderelations = None
         provides = {}
         requires = {}
         recommends = {}
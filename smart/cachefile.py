@@ -0,0 +1,431 @@
+#
+# Copyright (c) 2004 Conectiva, Inc.
+#
+# Written by Gustavo Niemeyer <niemeyer@conectiva.com>
+#
+# This file is part of Smart Package Manager.
+#
+# Smart Package Manager is free software; you can redistribute it and/or
+# modify it under the terms of the GNU General Public License as published
+# by the Free Software Foundation; either version 2 of the License, or (at
+# your option) any later version.
+#
+# Smart Package Manager is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the GNU
+# General Public License for more details.
+#
+# You should have received a copy of the GNU General Public License
+# along with Smart Package Manager; if not, write to the Free Software
+# Foundation, Inc., 59 Temple Place, Suite 330, Boston, MA  02111-1307  USA
+#
+from smart.cache import StateVersionError
+from smart import *
+from cStringIO import StringIO
+import cPickle
+import struct
+import array
+import mmap
+import sys
+
+#
+# On disk layout of a cache file:
+#
+#   MAGIC
+#   header     FORMATVERSION, int size, byte order, and section offsets
+#   strings    NUL separated string table
+#   relations  per class tables with one column per argument
+#   packages   per class tables with name/version/flags/priority and
+#              relation count columns, followed by the relation indexes
+#   pickle     everything else, with packages and relations replaced
+#              by persistent ids
+#
+# External objects are not stored at all. They're replaced by persistent
+# ids as well, and must be provided again when the file is loaded. That
+# allows saving part of a larger object graph, such as the loaders of a
+# single channel referencing the cache they were loaded into.
+#
+# Columns are int arrays indexing the string table or the object list,
+# so objects are built with map() straight from the mapped data, rather
+# than one by one as the unpickler would do. The string index -1 stands
+# for None.
+#
+
+MAGIC = "SMARTCF\0"
+FORMATVERSION = 1
+
+HEADER = "<8I"
+HEADERSIZE = struct.calcsize(HEADER)
+
+INSTALLED = 1<<0
+ESSENTIAL = 1<<1
+LISTFIELD = 1<<2 # Shifted by the field position.
+
+PKGFIELDS = 5 # provides, requires, recommends, upgrades, conflicts
+
+INTMIN = -(1<<31)
+INTMAX = (1<<31)-1
+
+class CacheFileWriter(object):
+
+    def __init__(self, externals=(), loaders=None):
+        self._externals = externals
+        self._loaders = loaders # Loaders to keep in pkg.loaders.
+        self._strings = []
+        self._stringmap = {}
+        self._relgroups = {}  # (cls, nargs) -> [rel, ...]
+        self._relmap = {}     # id(rel) -> True
+        self._extrarels = []  # Relations which go in the pickle.
+        self._pkggroups = {}  # cls -> [(pkg, state), ...]
+        self._pkgmap = {}     # id(pkg) -> True
+
+    def _addString(self, s):
+        idx = self._stringmap.get(s)
+        if idx is None:
+            idx = self._stringmap[s] = len(self._strings)
+            self._strings.append(s)
+        return idx
+
+    def _isSimple(self, value):
+        return (value is None or
+                type(value) is str and "\0" not in value)
+
+    def _addRelation(self, rel):
+        if id(rel) in self._relmap:
+            return
+        self._relmap[id(rel)] = True
+        try:
+            cls, args = rel.__reduce__()[:2]
+        except (TypeError, ValueError):
+            pass
+        else:
+            if cls is rel.__class__ and type(args) is tuple:
+                for arg in args:
+                    if not self._isSimple(arg):
+                        break
+                else:
+                    key = (cls, len(args))
+                    self._relgroups.setdefault(key, []).append(rel)
+                    return
+        self._extrarels.append(rel)
+
+    def addPackage(self, pkg):
+        if id(pkg) in self._pkgmap:
+            return
+        state = pkg.__getstate__()
+        if type(state) is not tuple or len(state) != 11:
+            return
+        if not (self._isSimple(state[0]) and self._isSimple(state[1])):
+            return
+        priority = state[9]
+        if type(priority) is not int or not INTMIN <= priority <= INTMAX:
+            return
+        for field in state[2:7]:
+            if type(field) not in (list, tuple):
+                return
+        for field in state[2:7]:
+            for rel in field:
+                self._addRelation(rel)
+        self._pkggroups.setdefault(pkg.__class__, []).append((pkg, state))
+        self._pkgmap[id(pkg)] = True
+
+    def _writeRelations(self, file, classes, objects, objindex):
+        addstr = self._addString
+        relgroups = self._relgroups.items()
+        relgroups.sort()
+        header = [len(relgroups)]
+        data = StringIO()
+        for (cls, nargs), rels in relgroups:
+            header.extend([len(classes), nargs, len(rels)])
+            classes.append(cls)
+            columns = [array.array("i") for i in range(nargs)]
+            for rel in rels:
+                objindex[id(rel)] = len(objects)
+                objects.append(rel)
+                for column, arg in zip(columns, rel.__reduce__()[1]):
+                    if arg is None:
+                        column.append(-1)
+                    else:
+                        column.append(addstr(arg))
+            for column in columns:
+                data.write(column.tostring())
+        file.write(array.array("i", header).tostring())
+        file.write(data.getvalue())
+
+    def _writePackages(self, file, classes, objects, objindex):
+        addstr = self._addString
+        pkggroups = self._pkggroups.items()
+        pkggroups.sort()
+        header = [len(pkggroups)]
+        data = StringIO()
+        for cls, pkgstates in pkggroups:
+            columns = [array.array("i") for i in range(4+PKGFIELDS)]
+            relidxs = array.array("i")
+            for pkg, state in pkgstates:
+                objindex[id(pkg)] = len(objects)
+                objects.append(pkg)
+                (name, version, provides, requires, recommends, upgrades,
+                 conflicts, installed, essential, priority, _) = state
+                flags = 0
+                if installed:
+                    flags |= INSTALLED
+                if essential:
+                    flags |= ESSENTIAL
+                for i, field in enumerate((provides, requires, recommends,
+                                           upgrades, conflicts)):
+                    if type(field) is list:
+                        flags |= LISTFIELD<<i
+                    columns[4+i].append(len(field))
+                    for rel in field:
+                        relidxs.append(objindex[id(rel)])
+                for i, value in enumerate((name, version)):
+                    if value is None:
+                        columns[i].append(-1)
+                    else:
+                        columns[i].append(addstr(value))
+                columns[2].append(flags)
+                columns[3].append(priority)
+            header.extend([len(classes), len(pkgstates), len(relidxs)])
+            classes.append(cls)
+            for column in columns:
+                data.write(column.tostring())
+            data.write(relidxs.tostring())
+        file.write(array.array("i", header).tostring())
+        file.write(data.getvalue())
+
+    def write(self, file, state):
+        classes = []
+        objects = list(self._externals)
+        objindex = dict([(id(x), i) for i, x in enumerate(objects)])
+
+        relsection = StringIO()
+        self._writeRelations(relsection, classes, objects, objindex)
+
+        # Extra relations are appended to the object list once loaded.
+        extrarels = self._extrarels
+        for rel in extrarels:
+            objindex[id(rel)] = len(objects)
+            objects.append(rel)
+
+        first = len(objects)
+        pkgsection = StringIO()
+        self._writePackages(pkgsection, classes, objects, objindex)
+
+        def persistentId(obj):
+            # The index is keyed by id(), which is safe since all the
+            # objects are kept alive by the list while we're pickling.
+            return objindex.get(id(obj))
+
+        # Classes and extra relations are pickled before persistent ids
+        # are in place, so that they may be loaded before the tables.
+        # Package loaders are pickled apart, since they reference loader
+        # objects which are only available once the state is loaded.
+        pickle = StringIO()
+        pickler = cPickle.Pickler(pickle, 2)
+        pickler.dump((["%s:%s" % (x.__module__, x.__name__)
+                       for x in classes], extrarels))
+        pickler.persistent_id = persistentId
+        loaders = self._loaders
+        if loaders is None:
+            pkgloaders = [pkg.loaders for pkg in objects[first:]]
+        else:
+            pkgloaders = []
+            for pkg in objects[first:]:
+                pkgloaders.append(dict([(loader, info) for loader, info
+                                        in pkg.loaders.iteritems()
+                                        if loader in loaders]))
+        pickler.dump((state, pkgloaders))
+
+        sections = ["\0".join(self._strings), relsection.getvalue(),
+                    pkgsection.getvalue(), pickle.getvalue()]
+        offsets = []
+        offset = len(MAGIC)+HEADERSIZE
+        for section in sections:
+            offset += len(section)
+            offsets.append(offset)
+        file.write(MAGIC)
+        file.write(struct.pack(HEADER, FORMATVERSION,
+                               array.array("i").itemsize,
+                               sys.byteorder == "little",
+                               len(self._externals), *offsets))
+        for section in sections:
+            file.write(section)
+
+class CacheFileReader(object):
+
+    def __init__(self, file):
+        try:
+            self._map = mmap.mmap(file.fileno(), 0, access=mmap.ACCESS_READ)
+        except (mmap.error, ValueError, EnvironmentError):
+            # Empty files can't be mapped, and some filesystems don't
+            # support mapping at all.
+            file.seek(0)
+            self._map = file.read()
+        map = self._map
+        start = len(MAGIC)
+        if map[:start] != MAGIC or len(map) < start+HEADERSIZE:
+            raise StateVersionError
+        (version, itemsize, little, externals,
+         relstart, pkgstart, picklestart, end) = \
+            struct.unpack(HEADER, map[start:start+HEADERSIZE])
+        if (version != FORMATVERSION or
+            itemsize != array.array("i").itemsize or
+            bool(little) != (sys.byteorder == "little") or
+            end != len(map)):
+            raise StateVersionError
+        self._externals = externals
+        self._strstart = start+HEADERSIZE
+        self._relstart = relstart
+        self._pkgstart = pkgstart
+        self._picklestart = picklestart
+
+    def _getClass(self, name):
+        modname, name = name.split(":")
+        try:
+            __import__(modname)
+            return getattr(sys.modules[modname], name)
+        except (ImportError, AttributeError):
+            raise StateVersionError
+
+    def _ints(self, pos, n):
+        a = array.array("i")
+        end = pos+n*a.itemsize
+        a.fromstring(self._map[pos:end])
+        return a, end
+
+    def _readRelations(self, classes, objects, strings, objmap):
+        ints = self._ints
+        getstr = strings.__getitem__
+        (ngroups,), pos = ints(self._relstart, 1)
+        header, pos = ints(pos, ngroups*3)
+        for i in range(0, ngroups*3, 3):
+            cls, nargs, n = classes[header[i]], header[i+1], header[i+2]
+            columns = []
+            for j in range(nargs):
+                column, pos = ints(pos, n)
+                columns.append(map(getstr, column))
+            if nargs:
+                rels = map(cls, *columns)
+            else:
+                rels = [cls() for j in range(n)]
+            if objmap is not None:
+                # Same keys as getInitArgs(), as used by buildPackage().
+                keys = zip([cls]*n, *columns)
+                rels = map(objmap.setdefault, keys, rels)
+            objects.extend(rels)
+
+    def _readPackages(self, classes, objects, strings, objmap):
+        ints = self._ints
+        getstr = strings.__getitem__
+        (ngroups,), pos = ints(self._pkgstart, 1)
+        header, pos = ints(pos, ngroups*3)
+        for i in range(0, ngroups*3, 3):
+            cls, n, nrels = classes[header[i]], header[i+1], header[i+2]
+            names, pos = ints(pos, n)
+            versions, pos = ints(pos, n)
+            flagslist, pos = ints(pos, n)
+            priorities, pos = ints(pos, n)
+            counts = []
+            for k in range(PKGFIELDS):
+                column, pos = ints(pos, n)
+                counts.append(column)
+            relidxs, pos = ints(pos, nrels)
+            rels = map(objects.__getitem__, relidxs)
+            names = map(getstr, names)
+            versions = map(getstr, versions)
+            relpos = 0
+            for j in range(n):
+                flags = flagslist[j]
+                fields = []
+                for k in range(PKGFIELDS):
+                    count = counts[k][j]
+                    field = rels[relpos:relpos+count]
+                    relpos += count
+                    if not flags&(LISTFIELD<<k):
+                        field = tuple(field)
+                    fields.append(field)
+                pkg = cls.__new__(cls)
+                pkg.__setstate__((names[j], versions[j],
+                                  fields[0], fields[1], fields[2],
+                                  fields[3], fields[4],
+                                  bool(flags&INSTALLED),
+                                  bool(flags&ESSENTIAL),
+                                  priorities[j], {}))
+                if objmap is not None:
+                    lst = objmap.get((cls, pkg.name, pkg.version))
+                    if lst is None:
+                        objmap[(cls, pkg.name, pkg.version)] = [pkg]
+                    else:
+                        for lstpkg in lst:
+                            if pkg.equals(lstpkg):
+                                pkg = lstpkg
+                                break
+                        else:
+                            lst.append(pkg)
+                objects.append(pkg)
+
+    def read(self, externals=(), objmap=None):
+        """
+        Load the state from the file. Objects given as externals
+        replace the ones given when the file was dumped. If objmap is
+        provided, packages and relations found in it are reused rather
+        than created, and the new ones are registered, so that files
+        loaded with the same objmap share their objects, the same way
+        buildPackage() would have done.
+        """
+        if len(externals) != self._externals:
+            raise StateVersionError
+        map = self._map
+        strings = map[self._strstart:self._relstart].split("\0")
+        strings.append(None)
+
+        unpickler = cPickle.Unpickler(StringIO(map[self._picklestart:]))
+        classes, extrarels = unpickler.load()
+        classes = [self._getClass(x) for x in classes]
+
+        if objmap is not None:
+            extrarels = [objmap.setdefault(rel.getInitArgs(), rel)
+                         for rel in extrarels]
+
+        objects = list(externals)
+        try:
+            self._readRelations(classes, objects, strings, objmap)
+            objects.extend(extrarels)
+            first = len(objects)
+            self._readPackages(classes, objects, strings, objmap)
+        except (IndexError, TypeError):
+            raise StateVersionError
+
+        unpickler.persistent_load = objects.__getitem__
+        state, pkgloaders = unpickler.load()
+        for pkg, loaders in zip(objects[first:], pkgloaders):
+            pkg.loaders.update(loaders)
+        return state
+
+    def close(self):
+        if type(self._map) is not str:
+            self._map.close()
+        self._map = None
+
+def dumpCacheFile(path, state, packages, externals=(), loaders=None):
+    writer = CacheFileWriter(externals, loaders)
+    for pkg in packages:
+        writer.addPackage(pkg)
+    file = open(path, "w")
+    try:
+        writer.write(file, state)
+    finally:
+        file.close()
+
+def loadCacheFile(path, externals=(), objmap=None):
+    file = open(path)
+    try:
+        reader = CacheFileReader(file)
+        try:
+            return reader.read(externals, objmap)
+        finally:
+            reader.close()
+    finally:
+        file.close()
+
+# vim:ts=4:sw=4:et
@@ -129,6 +129,7 @@ typedef struct {
     PyObject *_upgrades;
     PyObject *_conflicts;
     PyObject *_objmap;
+    PyObject *_upgraderelations;
 } CacheObject;
 
 static PyObject *
@@ -2507,6 +2508,8 @@ Cache_init(CacheObject *self, PyObject *args)
     self->_upgrades = PyList_New(0);
     self->_conflicts = PyList_New(0);
     self->_objmap = PyDict_New();
+    Py_INCREF(Py_None);
+    self->_upgraderelations = Py_None;
     return 0;
 }
 
@@ -2521,6 +2524,7 @@ Cache_traverse(CacheObject *self, visitproc visit, void *arg)
     Py_VISIT(self->_upgrades);
     Py_VISIT(self->_conflicts);
     Py_VISIT(self->_objmap);
+    Py_VISIT(self->_upgraderelations);
     return 0;
 }
 
@@ -2535,6 +2539,7 @@ Cache_clear(CacheObject *self)
     Py_CLEAR(self->_upgrades);
     Py_CLEAR(self->_conflicts);
     Py_CLEAR(self->_objmap);
+    Py_CLEAR(self->_upgraderelations);
     return 0;
 }
 
@@ -2549,6 +2554,7 @@ Cache_dealloc(CacheObject *self)
     Py_XDECREF(self->_upgrades);
     Py_XDECREF(self->_conflicts);
     Py_XDECREF(self->_objmap);
+    Py_XDECREF(self->_upgraderelations);
     self->ob_type->tp_free((PyObject *)self);
 }
 
@@ -2928,6 +2934,7 @@ Cache_load(CacheObject *self, PyObject *args)
     int total = 1;
     PyObject *hooks;
     PyObject *prog;
+    PyObject *loadpool;
     PyObject *ret;
 
     ret = Cache__reload(self, NULL);
@@ -2956,6 +2963,20 @@ Cache_load(CacheObject *self, PyObject *args)
     }
     CALLMETHOD(prog, "set", "ii", 0, total);
     CALLMETHOD(prog, "show", NULL);
+    /* from smart.loadpool import loadLoaders
+       loadLoaders(self, prog) */
+    loadpool = PyImport_ImportModule("smart.loadpool");
+    if (!loadpool) {
+        Py_DECREF(prog);
+        return NULL;
+    }
+    ret = PyObject_CallMethod(loadpool, "loadLoaders", "OO", self, prog);
+    Py_DECREF(loadpool);
+    if (!ret) {
+        Py_DECREF(prog);
+        return NULL;
+    }
+    Py_DECREF(ret);
     len = PyList_GET_SIZE(self->_loaders);
     for (i = 0; i != len; i++) {
         PyObject *loader = PyList_GET_ITEM(self->_loaders, i);
@@ -3008,392 +3029,193 @@ Cache_loadFileProvides(CacheObject *self, PyObject *args)
     Py_RETURN_NONE;
 }
 
-PyObject *
-Cache_linkDeps(CacheObject *self, PyObject *args)
+static int
+Cache_linkDepsList(PyObject *deps, PyObject *prvnames, int byoffset)
 {
-    int i, j, len;
-    PyObject *reqnames, *recnames, *upgnames, *cnfnames;
-    PyObject *lst;
-
-    /* reqnames = {} */
-    reqnames = PyDict_New();
-    /* for req in self._requires: */
-    len = PyList_GET_SIZE(self->_requires);
-    for (i = 0; i != len; i++) {
-        PyObject *req = PyList_GET_ITEM(self->_requires, i);
-
-        /* for name in req.getMatchNames(): */
-        PyObject *names = PyObject_CallMethod(req, "getMatchNames", NULL);
-        PyObject *seq = PySequence_Fast(names, "getMatchNames() returned "
-                                               "non-sequence object");
-        int nameslen;
-        if (!seq) return NULL;
-        nameslen = PySequence_Fast_GET_SIZE(seq);
-        for (j = 0; j != nameslen; j++) {
-            PyObject *name = PySequence_Fast_GET_ITEM(seq, j);
-            
-            /* lst = reqnames.get(name) */
-            lst = PyDict_GetItem(reqnames, name);
-
-            /* 
-               if lst:
-                   lst.append(req)
-               else:
-                   reqnames[name] = [req]
-            */
-            if (lst) {
-                PyList_Append(lst, req);
-            } else {
-                lst = PyList_New(1);
-                Py_INCREF(req);
-                PyList_SET_ITEM(lst, 0, req);
-                PyDict_SetItem(reqnames, name, lst);
-                Py_DECREF(lst);
-            }
-        }
+    static PyObject *matchnamesstr = NULL;
+    static PyObject *matchesstr = NULL;
+    PyObject *basematchnames;
+    int i, j, k, len;
 
-        Py_DECREF(names);
-        Py_DECREF(seq);
+    if (!matchnamesstr) {
+        matchnamesstr = PyString_InternFromString("getMatchNames");
+        matchesstr = PyString_InternFromString("matches");
+        if (!matchnamesstr || !matchesstr)
+            return -1;
     }
+    basematchnames = _PyType_Lookup(&Depends_Type, matchnamesstr);
 
-    /* recnames = {} */
-    recnames = PyDict_New();
-    /* for rec in self._recommends: */
-    len = PyList_GET_SIZE(self->_recommends);
+    /* for dep in deps: */
+    len = PyList_GET_SIZE(deps);
     for (i = 0; i != len; i++) {
-        PyObject *rec = PyList_GET_ITEM(self->_recommends, i);
-
-        /* for name in rec.getMatchNames(): */
-        PyObject *names = PyObject_CallMethod(rec, "getMatchNames", NULL);
-        PyObject *seq = PySequence_Fast(names, "getMatchNames() returned "
-                                               "non-sequence object");
+        DependsObject *dep = (DependsObject *)PyList_GET_ITEM(deps, i);
+        PyObject *names, *seq;
         int nameslen;
-        if (!seq) return NULL;
-        nameslen = PySequence_Fast_GET_SIZE(seq);
-        for (j = 0; j != nameslen; j++) {
-            PyObject *name = PySequence_Fast_GET_ITEM(seq, j);
-            
-            /* lst = recnames.get(name) */
-            lst = PyDict_GetItem(recnames, name);
-
-            /* 
-               if lst:
-                   lst.append(rec)
-               else:
-                   recnames[name] = [rec]
-            */
-            if (lst) {
-                PyList_Append(lst, rec);
-            } else {
-                lst = PyList_New(1);
-                Py_INCREF(rec);
-                PyList_SET_ITEM(lst, 0, rec);
-                PyDict_SetItem(recnames, name, lst);
-                Py_DECREF(lst);
-            }
-        }
 
+        /* for name in dep.getMatchNames(): */
+        if (_PyType_Lookup(dep->ob_type, matchnamesstr) == basematchnames) {
+            /* Not overloaded, so it's just the name. */
+            names = PyTuple_New(1);
+            Py_INCREF(dep->name);
+            PyTuple_SET_ITEM(names, 0, dep->name);
+        } else {
+            names = PyObject_CallMethodObjArgs((PyObject *)dep,
+                                               matchnamesstr, NULL);
+            if (!names) return -1;
+        }
+        seq = PySequence_Fast(names, "getMatchNames() returned "
+                                     "non-sequence object");
         Py_DECREF(names);
-        Py_DECREF(seq);
-    }
-
-    /* upgnames = {} */
-    upgnames = PyDict_New();
-    /* for upg in self._upgrades: */
-    len = PyList_GET_SIZE(self->_upgrades);
-    for (i = 0; i != len; i++) {
-        PyObject *upg = PyList_GET_ITEM(self->_upgrades, i);
-
-        /* for name in upg.getMatchNames(): */
-        PyObject *names = PyObject_CallMethod(upg, "getMatchNames", NULL);
-        PyObject *seq = PySequence_Fast(names, "getMatchNames() returned "
-                                               "non-sequence object");
-        int nameslen;
-        if (!seq) return NULL;
+        if (!seq) return -1;
         nameslen = PySequence_Fast_GET_SIZE(seq);
         for (j = 0; j != nameslen; j++) {
             PyObject *name = PySequence_Fast_GET_ITEM(seq, j);
-            
-            /* lst = upgnames.get(name) */
-            lst = PyDict_GetItem(upgnames, name);
-
-            /* 
-               if lst:
-                   lst.append(upg)
-               else:
-                   upgnames[name] = [upg]
-            */
-            if (lst) {
-                PyList_Append(lst, upg);
-            } else {
-                lst = PyList_New(1);
-                Py_INCREF(upg);
-                PyList_SET_ITEM(lst, 0, upg);
-                PyDict_SetItem(upgnames, name, lst);
-                Py_DECREF(lst);
-            }
-        }
+            PyObject *prvs;
+            int prvslen;
 
-        Py_DECREF(names);
-        Py_DECREF(seq);
-    }
+            /* for prv in prvnames.get(name, ()): */
+            prvs = PyDict_GetItem(prvnames, name);
+            if (!prvs)
+                continue;
+            prvslen = PyList_GET_SIZE(prvs);
+            for (k = 0; k != prvslen; k++) {
+                PyObject *prv = PyList_GET_ITEM(prvs, k);
+                PyObject **by;
+                PyObject *ret;
+                int istrue;
+
+                /* if dep.matches(prv): */
+                ret = PyObject_CallMethodObjArgs((PyObject *)dep, matchesstr,
+                                                 prv, NULL);
+                if (!ret) {
+                    Py_DECREF(seq);
+                    return -1;
+                }
+                istrue = PyObject_IsTrue(ret);
+                Py_DECREF(ret);
+                if (!istrue)
+                    continue;
 
-    /* cnfnames = {} */
-    cnfnames = PyDict_New();
-    /* for cnf in self._conflicts: */
-    len = PyList_GET_SIZE(self->_conflicts);
-    for (i = 0; i != len; i++) {
-        PyObject *cnf = PyList_GET_ITEM(self->_conflicts, i);
+                /*
+                   if dep.providedby:
+                       dep.providedby.append(prv)
+                   else:
+                       dep.providedby = [prv]
+                */
+                if (PyList_Check(dep->providedby)) {
+                    PyList_Append(dep->providedby, prv);
+                } else {
+                    PyObject *_lst = PyList_New(1);
+                    Py_INCREF(prv);
+                    PyList_SET_ITEM(_lst, 0, prv);
+                    Py_DECREF(dep->providedby);
+                    dep->providedby = _lst;
+                }
 
-        /* for name in cnf.getMatchNames(): */
-        PyObject *names = PyObject_CallMethod(cnf, "getMatchNames", NULL);
-        PyObject *seq = PySequence_Fast(names, "getMatchNames() returned "
-                                               "non-sequence object");
-        int nameslen;
-        if (!seq) return NULL;
-        nameslen = PySequence_Fast_GET_SIZE(seq);
-        for (j = 0; j != nameslen; j++) {
-            PyObject *name = PySequence_Fast_GET_ITEM(seq, j);
-            
-            /* lst = cnfnames.get(name) */
-            lst = PyDict_GetItem(cnfnames, name);
-
-            /* 
-               if lst:
-                   lst.append(cnf)
-               else:
-                   cnfnames[name] = [cnf]
-            */
-            if (lst) {
-                PyList_Append(lst, cnf);
-            } else {
-                lst = PyList_New(1);
-                Py_INCREF(cnf);
-                PyList_SET_ITEM(lst, 0, cnf);
-                PyDict_SetItem(cnfnames, name, lst);
-                Py_DECREF(lst);
+                /*
+                   if prv.<by>:
+                       prv.<by>.append(dep)
+                   else:
+                       prv.<by> = [dep]
+                */
+                by = (PyObject **)((char *)prv + byoffset);
+                if (PyList_Check(*by)) {
+                    PyList_Append(*by, (PyObject *)dep);
+                } else {
+                    PyObject *_lst = PyList_New(1);
+                    Py_INCREF(dep);
+                    PyList_SET_ITEM(_lst, 0, (PyObject *)dep);
+                    Py_DECREF(*by);
+                    *by = _lst;
+                }
             }
         }
-
-        Py_DECREF(names);
         Py_DECREF(seq);
     }
+    return 0;
+}
+
+PyObject *
+Cache_linkDeps(CacheObject *self, PyObject *args)
+{
+    PyObject *prvnames;
+    int i, len, rc;
+
+    /* prvnames = {} */
+    prvnames = PyDict_New();
+    if (!prvnames) return NULL;
 
     /* for prv in self._provides: */
     len = PyList_GET_SIZE(self->_provides);
     for (i = 0; i != len; i++) {
         ProvidesObject *prv;
+        PyObject *lst;
 
         prv = (ProvidesObject *)PyList_GET_ITEM(self->_provides, i);
 
-        /* lst = reqnames.get(prv.name) */
-        lst = PyDict_GetItem(reqnames, prv->name);
-
-        /* if lst: */
-        if (lst) {
-            /* for req in lst: */
-            int reqlen = PyList_GET_SIZE(lst);
-            for (j = 0; j != reqlen; j++) {
-                DependsObject *req = (DependsObject *)PyList_GET_ITEM(lst, j);
-                /* if req.matches(prv): */
-                PyObject *ret = PyObject_CallMethod((PyObject *)req, "matches",
-                                                    "O", (PyObject *)prv);
-                if (!ret) return NULL;
-                if (PyObject_IsTrue(ret)) {
-                    /*
-                       if req.providedby:
-                           req.providedby.append(prv)
-                       else:
-                           req.providedby = [prv]
-                    */
-                    if (PyList_Check(req->providedby)) {
-                        PyList_Append(req->providedby, (PyObject *)prv);
-                    } else {
-                        PyObject *_lst = PyList_New(1);
-                        Py_INCREF(prv);
-                        PyList_SET_ITEM(_lst, 0, (PyObject *)prv);
-                        Py_DECREF(req->providedby);
-                        req->providedby = _lst;
-                    }
-
-                    /*
-                       if prv.requiredby:
-                           prv.requiredby.append(prv)
-                       else:
-                           prv.requiredby = [prv]
-                    */
-                    if (PyList_Check(prv->requiredby)) {
-                        PyList_Append(prv->requiredby, (PyObject *)req);
-                    } else {
-                        PyObject *_lst = PyList_New(1);
-                        Py_INCREF(req);
-                        PyList_SET_ITEM(_lst, 0, (PyObject *)req);
-                        Py_DECREF(prv->requiredby);
-                        prv->requiredby = _lst;
-                    }
-                }
-                Py_DECREF(ret);
-            }
-        }
+        /* lst = prvnames.get(prv.name) */
+        lst = PyDict_GetItem(prvnames, prv->name);
 
-        /* lst = recnames.get(prv.name) */
-        lst = PyDict_GetItem(recnames, prv->name);
-
-        /* if lst: */
+        /*
+           if lst:
+               lst.append(prv)
+           else:
+               prvnames[prv.name] = [prv]
+        */
         if (lst) {
-            /* for rec in lst: */
-            int reclen = PyList_GET_SIZE(lst);
-            for (j = 0; j != reclen; j++) {
-                DependsObject *rec = (DependsObject *)PyList_GET_ITEM(lst, j);
-                /* if rec.matches(prv): */
-                PyObject *ret = PyObject_CallMethod((PyObject *)rec, "matches",
-                                                    "O", (PyObject *)prv);
-                if (!ret) return NULL;
-                if (PyObject_IsTrue(ret)) {
-                    /*
-                       if rec.providedby:
-                           rec.providedby.append(prv)
-                       else:
-                           rec.providedby = [prv]
-                    */
-                    if (PyList_Check(rec->providedby)) {
-                        PyList_Append(rec->providedby, (PyObject *)prv);
-                    } else {
-                        PyObject *_lst = PyList_New(1);
-                        Py_INCREF(prv);
-                        PyList_SET_ITEM(_lst, 0, (PyObject *)prv);
-                        Py_DECREF(rec->providedby);
-                        rec->providedby = _lst;
-                    }
-
-                    /*
-                       if prv.recommendedby:
-                           prv.recommendedby.append(prv)
-                       else:
-                           prv.recommendedby = [prv]
-                    */
-                    if (PyList_Check(prv->recommendedby)) {
-                        PyList_Append(prv->recommendedby, (PyObject *)rec);
-                    } else {
-                        PyObject *_lst = PyList_New(1);
-                        Py_INCREF(rec);
-                        PyList_SET_ITEM(_lst, 0, (PyObject *)rec);
-                        Py_DECREF(prv->recommendedby);
-                        prv->recommendedby = _lst;
-                    }
-                }
-                Py_DECREF(ret);
-            }
+            PyList_Append(lst, (PyObject *)prv);
+        } else {
+            lst = PyList_New(1);
+            Py_INCREF(prv);
+            PyList_SET_ITEM(lst, 0, (PyObject *)prv);
+            PyDict_SetItem(prvnames, prv->name, lst);
+            Py_DECREF(lst);
         }
+    }
 
-        /* lst = upgnames.get(prv.name) */
-        lst = PyDict_GetItem(upgnames, prv->name);
-
-        /* if lst: */
-        if (lst) {
-
-            /* for upg in lst: */
-            int upglen = PyList_GET_SIZE(lst);
-            for (j = 0; j != upglen; j++) {
-                DependsObject *upg = (DependsObject *)PyList_GET_ITEM(lst, j);
-                /* if upg.matches(prv): */
-                PyObject *ret = PyObject_CallMethod((PyObject *)upg, "matches",
-                                                    "O", (PyObject *)prv);
-                if (!ret) return NULL;
-                if (PyObject_IsTrue(ret)) {
-                    /*
-                       if upg.providedby:
-                           upg.providedby.append(prv)
-                       else:
-                           upg.providedby = [prv]
-                    */
-                    if (PyList_Check(upg->providedby)) {
-                        PyList_Append(upg->providedby, (PyObject *)prv);
-                    } else {
-                        PyObject *_lst = PyList_New(1);
-                        Py_INCREF(prv);
-                        PyList_SET_ITEM(_lst, 0, (PyObject *)prv);
-                        Py_DECREF(upg->providedby);
-                        upg->providedby = _lst;
-                    }
-
-                    /*
-                       if prv.upgradedby:
-                           prv.upgradedby.append(prv)
-                       else:
-                           prv.upgradedby = [prv]
-                    */
-                    if (PyList_Check(prv->upgradedby)) {
-                        PyList_Append(prv->upgradedby, (PyObject *)upg);
-                    } else {
-                        PyObject *_lst = PyList_New(1);
-                        Py_INCREF(upg);
-                        PyList_SET_ITEM(_lst, 0, (PyObject *)upg);
-                        Py_DECREF(prv->upgradedby);
-                        prv->upgradedby = _lst;
-                    }
-                }
-                Py_DECREF(ret);
-            }
-        }
+    rc = Cache_linkDepsList(self->_requires, prvnames,
+                            offsetof(ProvidesObject, requiredby));
+    if (rc == 0)
+        rc = Cache_linkDepsList(self->_recommends, prvnames,
+                                offsetof(ProvidesObject, recommendedby));
+    if (rc == 0)
+        rc = Cache_linkDepsList(self->_upgrades, prvnames,
+                                offsetof(ProvidesObject, upgradedby));
+    if (rc == 0)
+        rc = Cache_linkDepsList(self->_conflicts, prvnames,
+                                offsetof(ProvidesObject, conflictedby));
 
-        /* lst = cnfnames.get(prv.name) */
-        lst = PyDict_GetItem(cnfnames, prv->name);
+    Py_DECREF(prvnames);
 
-        /* if lst: */
-        if (lst) {
+    if (rc != 0)
+        return NULL;
 
-            /* for cnf in lst: */
-            int cnflen = PyList_GET_SIZE(lst);
-            for (j = 0; j != cnflen; j++) {
-                DependsObject *cnf = (DependsObject *)PyList_GET_ITEM(lst, j);
-                /* if cnf.matches(prv): */
-                PyObject *ret = PyObject_CallMethod((PyObject *)cnf, "matches",
-                                                    "O", (PyObject *)prv);
-                if (!ret) return NULL;
-                if (PyObject_IsTrue(ret)) {
-                    /*
-                       if cnf.providedby:
-                           cnf.providedby.append(prv)
-                       else:
-                           cnf.providedby = [prv]
-                    */
-                    if (PyList_Check(cnf->providedby)) {
-                        PyList_Append(cnf->providedby, (PyObject *)prv);
-                    } else {
-                        PyObject *_lst = PyList_New(1);
-                        Py_INCREF(prv);
-                        PyList_SET_ITEM(_lst, 0, (PyObject *)prv);
-                        Py_DECREF(cnf->providedby);
-                        cnf->providedby = _lst;
-                    }
+    Py_RETURN_NONE;
+}
 
-                    /*
-                       if prv.conflictedby:
-                           prv.conflictedby.append(prv)
-                       else:
-                           prv.conflictedby = [prv]
-                    */
-                    if (PyList_Check(prv->conflictedby)) {
-                        PyList_Append(prv->conflictedby, (PyObject *)cnf);
-                    } else {
-                        PyObject *_lst = PyList_New(1);
-                        Py_INCREF(cnf);
-                        PyList_SET_ITEM(_lst, 0, (PyObject *)cnf);
-                        Py_DECREF(prv->conflictedby);
-                        prv->conflictedby = _lst;
-                    }
-                }
-                Py_DECREF(ret);
-            }
-        }
-    }
+PyObject *
+Cache_getLoaders(CacheObject *self, PyObject *args)
+{
+    Py_INCREF(self->_loaders);
+    return self->_loaders;
+}
 
-    Py_DECREF(reqnames);
-    Py_DECREF(recnames);
-    Py_DECREF(upgnames);
-    Py_DECREF(cnfnames);
+PyObject *
+Cache_getUpgradeRelations(CacheObject *self, PyObject *args)
+{
+    PyObject *relations = self->_upgraderelations;
+    if (relations == NULL)
+        relations = Py_None;
+    Py_INCREF(relations);
+    return relations;
+}
 
+PyObject *
+Cache_setUpgradeRelations(CacheObject *self, PyObject *relations)
+{
+    Py_INCREF(relations);
+    Py_XDECREF(self->_upgraderelations);
+    self->_upgraderelations = relations;
     Py_RETURN_NONE;
 }
 
@@ -3540,18 +3362,14 @@ Cache_search(CacheObject *self, PyObject *searcher)
 {
     PyObject *lst, *res;
     int i, j, k;
+    int names = 0;
 
     lst = PyObject_GetAttrString(searcher, "nameversion");
     if (lst == NULL || !PyList_Check(lst)) {
-        PyErr_SetString(PyExc_TypeError, "Invalid provides attribute");
+        PyErr_SetString(PyExc_TypeError, "Invalid nameversion attribute");
         return NULL;
     }
-    if (PyList_GET_SIZE(lst) != 0) {
-        for (i = 0; i != PyList_GET_SIZE(self->_packages); i++) {
-            PyObject *pkg = PyList_GET_ITEM(self->_packages, i);
-            CALLMETHOD(pkg, "search", "O", searcher);
-        }
-    }
+    names |= PyList_GET_SIZE(lst) != 0;
     Py_DECREF(lst);
 
     lst = PyObject_GetAttrString(searcher, "provides");
@@ -3559,14 +3377,17 @@ Cache_search(CacheObject *self, PyObject *searcher)
         PyErr_SetString(PyExc_TypeError, "Invalid provides attribute");
         return NULL;
     }
-    if (PyList_GET_SIZE(lst) != 0) {
-        for (i = 0; i != PyList_GET_SIZE(self->_provides); i++) {
-            PyObject *prv = PyList_GET_ITEM(self->_provides, i);
-            CALLMETHOD(prv, "search", "O", searcher);
-        }
-    }
+    names |= PyList_GET_SIZE(lst) != 0;
     Py_DECREF(lst);
 
+    if (names) {
+        PyObject *searchindex = PyImport_ImportModule("smart.searchindex");
+        if (searchindex == NULL)
+            return NULL;
+        CALLMETHOD(searchindex, "searchNames", "OO", self, searcher);
+        Py_DECREF(searchindex);
+    }
+
     lst = PyObject_GetAttrString(searcher, "requires");
     if (lst == NULL || !PyList_Check(lst)) {
         PyErr_SetString(PyExc_TypeError, "Invalid requires attribute");
@@ -3699,9 +3520,13 @@ Cache_search(CacheObject *self, PyObject *searcher)
     if (res == NULL)
         return NULL;
     if (PyObject_IsTrue(res)) {    
-        for (i = 0; i != PyList_GET_SIZE(self->_loaders); i++)
-            CALLMETHOD(PyList_GET_ITEM(self->_loaders, i),
-                       "search", "O", searcher);
+        PyObject *searchindex = PyImport_ImportModule("smart.searchindex");
+        if (searchindex == NULL) {
+            Py_DECREF(res);
+            return NULL;
+        }
+        CALLMETHOD(searchindex, "searchLoaders", "OO", self, searcher);
+        Py_DECREF(searchindex);
     }
     Py_DECREF(res);
 
@@ -3888,6 +3713,9 @@ static PyMethodDef Cache_methods[] = {
     {"unload", (PyCFunction)Cache_unload, METH_NOARGS, NULL},
     {"loadFileProvides", (PyCFunction)Cache_loadFileProvides, METH_NOARGS, NULL},
     {"linkDeps", (PyCFunction)Cache_linkDeps, METH_VARARGS, NULL},
+    {"getLoaders", (PyCFunction)Cache_getLoaders, METH_NOARGS, NULL},
+    {"getUpgradeRelations", (PyCFunction)Cache_getUpgradeRelations, METH_NOARGS, NULL},
+    {"setUpgradeRelations", (PyCFunction)Cache_setUpgradeRelations, METH_O, NULL},
     {"getPackages", (PyCFunction)Cache_getPackages, METH_VARARGS, NULL},
     {"getProvides", (PyCFunction)Cache_getProvides, METH_VARARGS, NULL},
     {"getRequires", (PyCFunction)Cache_getRequires, METH_VARARGS, NULL},
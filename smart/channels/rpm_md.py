@@ -260,6 +260,13 @@ class RPMMetaDataChannel(PackageChannel, MirrorsChannel):
         else:
             filelists = info["filelists"]
 
+        # Keep compressed files as they are, if the loader is able
+        # to read them directly.
+        uncompressor = fetcher.getUncompressor()
+        def mustUncompress(url):
+            handler = uncompressor.getHandler(url)
+            return bool(handler and not handler.getDecompressor())
+
         fetcher.reset()
         item = fetcher.enqueue(primary["url"],
                                md5=primary.get("md5"),
@@ -268,7 +275,7 @@ class RPMMetaDataChannel(PackageChannel, MirrorsChannel):
                                uncomp_sha=primary.get("uncomp_sha"),
                                sha256=primary.get("sha256"),
                                uncomp_sha256=primary.get("uncomp_sha256"),
-                               uncomp=True)
+                               uncomp=mustUncompress(primary["url"]))
         flitem = fetcher.enqueue(filelists["url"],
                                  md5=filelists.get("md5"),
                                  uncomp_md5=filelists.get("uncomp_md5"),
@@ -276,7 +283,20 @@ class RPMMetaDataChannel(PackageChannel, MirrorsChannel):
                                  uncomp_sha=filelists.get("uncomp_sha"),
                                  sha256=filelists.get("sha256"),
                                  uncomp_sha256=filelists.get("uncomp_sha256"),
-                                 uncomp=True)
+                                 uncomp=mustUncompress(filelists["url"]))
+        deltas = info.get("prestodelta") or info.get("deltainfo")
+        if deltas and sysconf.get("use-deltas", True):
+            deltaitem = fetcher.enqueue(deltas["url"],
+                                        md5=deltas.get("md5"),
+                                        uncomp_md5=deltas.get("uncomp_md5"),
+                                        sha=deltas.get("sha"),
+                                        uncomp_sha=deltas.get("uncomp_sha"),
+                                        sha256=deltas.get("sha256"),
+                                        uncomp_sha256=
+                                            deltas.get("uncomp_sha256"),
+                                        uncomp=mustUncompress(deltas["url"]))
+        else:
+            deltaitem = None
         if "updateinfo" in info:
             uiitem = fetcher.enqueue(info["updateinfo"]["url"],
                                    md5=info["updateinfo"].get("md5"),
@@ -289,8 +309,16 @@ class RPMMetaDataChannel(PackageChannel, MirrorsChannel):
         if item.getStatus() == SUCCEEDED and flitem.getStatus() == SUCCEEDED:
             localpath = item.getTargetPath()
             filelistspath = flitem.getTargetPath()
+            deltaspath = None
+            if deltaitem:
+                if deltaitem.getStatus() == SUCCEEDED:
+                    deltaspath = deltaitem.getTargetPath()
+                else:
+                    iface.debug(_("Failed to download package deltas.\n"
+                                  "%s: %s") % (deltaitem.getURL(),
+                                  deltaitem.getFailedReason()))
             loader = RPMMetaDataLoader(localpath, filelistspath,
-                                       self._baseurl)
+                                       self._baseurl, deltaspath)
             loader.setChannel(self)
             self._loaders.append(loader)
             if "updateinfo" in info:
@@ -323,14 +351,13 @@ class RPMMetaDataChannel(PackageChannel, MirrorsChannel):
         else:
             return False
 
-        uncompressor = fetcher.getUncompressor()
-
         # delete any old files, if the new ones have new names
         for type in ["primary", "filelists", "other", 
-                     "primary_lzma", "filelists_lzma", "other_lzma"]:
+                     "primary_lzma", "filelists_lzma", "other_lzma",
+                     "prestodelta", "deltainfo"]:
             if type in oldinfo:
                 url = oldinfo[type]["url"]
-                if url and info[type]["url"] != oldinfo[type]["url"]:
+                if url and info.get(type, {}).get("url") != url:
                     path = self.getLocalPath(fetcher, url)
                     if os.path.exists(path):
                        os.unlink(path)
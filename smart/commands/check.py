@@ -25,6 +25,7 @@ from smart.cache import Package
 from smart import *
 import string
 import re
+import os
 
 USAGE=_("smart check [options] [package] ...")
 
@@ -45,6 +46,7 @@ smart check '*kgna*'
 smart check pkgname-1.0
 smart check pkgname-1.0-1
 smart check pkgname1 pkgname2
+smart check --changed
 """)
 
 def option_parser():
@@ -62,6 +64,10 @@ def option_parser():
     parser.add_option("--channels", action="store", metavar="ALIASES",
                       help=_("check packages which are inside the "
                              "given channels (comma separated aliases)"))
+    parser.add_option("--changed", action="store_true",
+                      help=_("check only packages changed since the last "
+                             "successful check, as recorded in the "
+                             "commit log"))
     return parser
 
 def parse_options(argv):
@@ -70,11 +76,43 @@ def parse_options(argv):
     opts.args = args
     return opts
 
+def getChangedPackages(cache, changes):
+    """Return the packages which may be affected by the given changes.
+
+    Changes are (package, operation) pairs as read from the commit log.
+    None is returned if a removed package isn't known anymore, since
+    then what depended on it can't be told.
+    """
+    strpkgs = {}
+    for pkg in cache.getPackages():
+        strpkgs.setdefault(str(pkg), []).append(pkg)
+    changed = {}
+    for name, op in changes:
+        pkgs = strpkgs.get(name)
+        if op == "INSTALL":
+            for pkg in pkgs or ():
+                changed[pkg] = True
+                for prv in pkg.provides:
+                    for cnf in prv.conflictedby:
+                        changed.update(dict.fromkeys(cnf.packages, True))
+        elif op == "REMOVE":
+            if not pkgs:
+                return None
+            for pkg in pkgs:
+                for prv in pkg.provides:
+                    for req in prv.requiredby:
+                        changed.update(dict.fromkeys(req.packages, True))
+    return changed
+
 def main(ctrl, opts, reloadchannels=True):
 
     # Argument check
     opts.check_args_of_option("channels", 1)
 
+    if opts.changed and not ctrl.getCommitLogPath():
+        raise Error, _("The commit-log option must be set to "
+                       "check changed packages")
+
     if sysconf.get("auto-update"):
         from smart.commands import update
         updateopts = update.parse_options([])
@@ -85,6 +123,7 @@ def main(ctrl, opts, reloadchannels=True):
 
     cache = ctrl.getCache()
 
+    checkinstalled = opts.all
     if opts.all:
         relateset = dict.fromkeys(cache.getPackages(), True)
     else:
@@ -121,6 +160,7 @@ def main(ctrl, opts, reloadchannels=True):
                         break
 
         if opts.installed or not opts.channels and not opts.available:
+            checkinstalled = True
             for pkg in cache.getPackages():
                 if pkg.installed:
                     relateset[pkg] = True
@@ -154,6 +194,25 @@ def main(ctrl, opts, reloadchannels=True):
     else:
         checkset = relateset
 
-    return not checkPackages(cache, checkset, relateset, report=True)
+    logpath = ctrl.getCommitLogPath()
+    logoffset = None
+    if opts.changed:
+        changes, logoffset = \
+            ctrl.readCommitLog(sysconf.get("check-commit-log-offset", 0))
+        changed = getChangedPackages(cache, changes)
+        if changed is not None:
+            checkset = [pkg for pkg in checkset if pkg in changed]
+    elif logpath and os.path.isfile(logpath):
+        logoffset = os.path.getsize(logpath)
+
+    result = checkPackages(cache, checkset, relateset, report=True)
+
+    # Installed packages are now known to be fine up to this point
+    # of the commit log.
+    if (result and checkinstalled and not opts.args and
+        logoffset is not None and not sysconf.getReadOnly()):
+        sysconf.set("check-commit-log-offset", logoffset)
+
+    return not result
 
 # vim:ts=4:sw=4:et
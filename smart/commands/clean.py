@@ -20,6 +20,7 @@
 # along with Smart Package Manager; if not, write to the Free Software
 # Foundation, Inc., 59 Temple Place, Suite 330, Boston, MA  02111-1307  USA
 #
+from smart.contentstore import ContentStore
 from smart.option import OptionParser
 from smart import *
 import os
@@ -29,7 +30,8 @@ USAGE=_("smart clean [options]")
 DESCRIPTION=_("""
 This command cleans the package cache. You can use it to
 delete old unused files that were left behind because of
-an incomplete transaction.
+an incomplete transaction. Files in the content store are
+only removed when the --store or --store-size options are used.
 """)
 
 def option_parser():
@@ -37,6 +39,13 @@ def option_parser():
                           description=DESCRIPTION)
     parser.add_option("--auto", action="store_true",
                       help=_("remove packages not in other channels"))
+    parser.add_option("--store", action="store_true",
+                      help=_("remove all files in the content store"))
+    parser.add_option("--store-size", action="store", type="int",
+                      metavar="MB",
+                      help=_("remove the least recently used files in the "
+                             "content store until it's not larger than the "
+                             "given size"))
     return parser
 
 def parse_options(argv):
@@ -47,6 +56,12 @@ def parse_options(argv):
 
 def main(ctrl, opts):
 
+    if opts.store or opts.store_size is not None:
+        iface.info(_("Removing files in the content store..."))
+        store = ContentStore(os.path.join(sysconf.get("data-dir"), "store"))
+        store.prune((opts.store_size or 0)*1024*1024)
+        return
+
     packagesdir = os.path.join(sysconf.get("data-dir"), "packages/")
 
     if not os.path.isdir(packagesdir):
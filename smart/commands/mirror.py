@@ -203,11 +203,11 @@ def main(ctrl, opts):
 
     if opts.clear_history is not None:
         if opts.clear_history:
-            history = sysconf.get("mirrors-history", [])
-            history[:] = [x for x in history if x[0] not in opts.clear_history]
-            sysconf.set("mirrors-history", history)
+            for mirror in opts.clear_history:
+                sysconf.remove(("mirrors-scores", mirror))
         else:
-            history = sysconf.remove("mirrors-history")
+            sysconf.remove("mirrors-scores")
+        sysconf.remove("mirrors-history")
 
     if opts.show:
         mirrors = sysconf.get("mirrors", ())
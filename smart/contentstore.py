@@ -0,0 +1,170 @@
+#
+# Copyright (c) 2005 Canonical
+#
+# Written by Gustavo Niemeyer <niemeyer@conectiva.com>
+#
+# This file is part of Smart Package Manager.
+#
+# Smart Package Manager is free software; you can redistribute it and/or
+# modify it under the terms of the GNU General Public License as published
+# by the Free Software Foundation; either version 2 of the License, or (at
+# your option) any later version.
+#
+# Smart Package Manager is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the GNU
+# General Public License for more details.
+#
+# You should have received a copy of the GNU General Public License
+# along with Smart Package Manager; if not, write to the Free Software
+# Foundation, Inc., 59 Temple Place, Suite 330, Boston, MA  02111-1307  USA
+#
+from smart import *
+import shutil
+import time
+import os
+
+#
+# The content store keeps downloaded files under the digest of their
+# contents, in data-dir/store/<kind>/<xx>/<digest>, so that the same
+# file found in several channels or mirrors is fetched only once.
+# Files are hardlinked between the store and the places where they're
+# used when possible. The access time of files is updated when they're
+# used, and the least recently used ones are removed once the store
+# grows over its maximum size.
+#
+
+STOREKINDS = ("sha256", "sha", "md5")
+
+class ContentStore(object):
+
+    def __init__(self, path, maxsize=0):
+        self._path = path
+        self._maxsize = maxsize
+        self._added = False
+
+    def getPath(self, kind, digest):
+        return os.path.join(self._path, kind, digest[:2], digest)
+
+    def find(self, digests, size=None):
+        """
+        Return the path of a file in the store with any of the given
+        (kind, digest) tuples, or None if there's none.
+        """
+        for kind, digest in digests:
+            path = self.getPath(kind, digest)
+            try:
+                st = os.stat(path)
+            except OSError:
+                continue
+            if size and st.st_size != size:
+                continue
+            try:
+                os.utime(path, (time.time(), st.st_mtime))
+            except OSError:
+                pass
+            return path
+        return None
+
+    def add(self, path, kind, digest):
+        """
+        Put the file in the given path, whose contents must have been
+        checked against the given digest, into the store.
+        """
+        storepath = self.getPath(kind, digest)
+        if os.path.exists(storepath):
+            return
+        try:
+            dirname = os.path.dirname(storepath)
+            if not os.path.isdir(dirname):
+                os.makedirs(dirname)
+            linkFile(path, storepath)
+        except (IOError, OSError), e:
+            iface.debug(_("Can't add %s to the content store: %s") %
+                        (path, e))
+        else:
+            self._added = True
+
+    def link(self, storepath, path):
+        """
+        Make the file in the given path have the contents of the file
+        in storepath, returning whether it succeeded.
+        """
+        try:
+            if not (os.path.exists(path) and
+                    os.path.samefile(storepath, path)):
+                linkFile(storepath, path)
+        except (IOError, OSError), e:
+            iface.debug(_("Can't use %s from the content store: %s") %
+                        (storepath, e))
+            return False
+        return True
+
+    def getFiles(self):
+        """
+        Return (atime, size, path) tuples for the files in the store,
+        ordered from the least recently used one.
+        """
+        files = []
+        for root, dirs, names in os.walk(self._path):
+            for name in names:
+                path = os.path.join(root, name)
+                try:
+                    st = os.stat(path)
+                except OSError:
+                    continue
+                files.append((st.st_atime, st.st_size, path))
+        files.sort()
+        return files
+
+    def prune(self, maxsize=None):
+        """
+        Remove the least recently used files until the store isn't
+        larger than maxsize bytes, or than the maximum size given to
+        the constructor. Without a new maximum size, nothing is done
+        unless files were added.
+        """
+        if maxsize is None:
+            if not self._added:
+                return
+            maxsize = self._maxsize
+        self._added = False
+        files = self.getFiles()
+        total = 0
+        for atime, size, path in files:
+            total += size
+        for atime, size, path in files:
+            if total <= maxsize:
+                break
+            try:
+                os.unlink(path)
+                iface.debug(_("Removed %s from the content store") % path)
+            except OSError, e:
+                iface.error(_("Can't remove %s: %s") % (path, e))
+            else:
+                total -= size
+
+def linkFile(source, target):
+    # The target is replaced atomically, since it may be in use.
+    targetpart = target+".part"
+    if os.path.lexists(targetpart):
+        os.unlink(targetpart)
+    try:
+        os.link(source, targetpart)
+    except OSError:
+        # Across filesystems, or not supported by them.
+        shutil.copyfile(source, targetpart)
+    os.rename(targetpart, target)
+
+def getContentStore():
+    """
+    Return the content store in data-dir, or None if the
+    content-store-size option doesn't enable it.
+    """
+    maxsize = sysconf.get("content-store-size", 0)
+    if not maxsize:
+        return None
+    path = os.path.join(sysconf.get("data-dir"), "store")
+    return ContentStore(path, maxsize*1024*1024)
+
+# vim:ts=4:sw=4:et
@@ -19,12 +19,15 @@
 # along with Smart Package Manager; if not, write to the Free Software
 # Foundation, Inc., 59 Temple Place, Suite 330, Boston, MA  02111-1307  USA
 #
-import cPickle
 import sys, os
+import threading
+import Queue
+import cPickle
 import copy
 import time
 import tempfile
 import tarfile
+import shutil
 
 from smart.transaction import ChangeSet, ChangeSetSplitter, INSTALL, REMOVE
 from smart.util.filetools import compareFiles, setCloseOnExecAll
@@ -32,6 +35,7 @@ from smart.util.objdigest import getObjectDigest
 from smart.util.pathlocks import PathLocks
 from smart.util.strtools import strToBool
 from smart.util.metalink import Metalink, Metafile
+from smart.cachefile import dumpCacheFile, loadCacheFile
 from smart.searcher import Searcher
 from smart.media import MediaSet
 from smart.progress import Progress
@@ -63,6 +67,8 @@ class Control(object):
         self._mediaset = self._fetcher.getMediaSet()
         self._achanset = AvailableChannelSet(self._fetcher)
         self._cachechanged = False
+        self._cachedigests = {} # alias -> digest saved in the cache
+        self._upgraderelations = None # Saved upgrade relations
 
     def getChannels(self):
         return self._channels.values()
@@ -157,7 +163,7 @@ class Control(object):
     def restoreMediaState(self):
         self._mediaset.restoreState()
 
-    __stateversion__ = 2
+    __stateversion__ = 3
 
     def loadSysConf(self, confpath=None):
         datadir = sysconf.get("data-dir")
@@ -188,29 +194,19 @@ class Control(object):
 
     def saveSysConf(self, confpath=None):
         msys = self._fetcher.getMirrorSystem()
-        if msys.getHistoryChanged() and not sysconf.getReadOnly():
-            sysconf.set("mirrors-history", msys.getHistory())
+        if msys.getScoresChanged() and not sysconf.getReadOnly():
+            sysconf.set("mirrors-scores", msys.getScores())
+            sysconf.remove("mirrors-history")
         if confpath:
             confpath = os.path.expanduser(confpath)
         else:
             if sysconf.getReadOnly():
                 return
 
-            if self._cachechanged:
-                cachepath = os.path.join(sysconf.get("data-dir"), "cache")
-                if sysconf.get("disk-cache", True):
-                    iface.showStatus(_("Saving cache..."))
-                    cachefile = open(cachepath+".new", "w")
-                    state = (self.__stateversion__,
-                             self._cache,
-                             self._channels,
-                             self._sysconfchannels)
-                    cPickle.dump(state, cachefile, 2)
-                    cachefile.close()
-                    os.rename(cachepath+".new", cachepath)
-                    iface.hideStatus()
-                elif os.path.isfile(cachepath):
-                    os.unlink(cachepath)
+            if self._cachechanged or self._getChangedLoaders():
+                self.saveCache()
+
+            self.saveUpgradeRelations()
 
             if not sysconf.getModified():
                 return
@@ -220,6 +216,132 @@ class Control(object):
 
         sysconf.save(confpath)
 
+    def saveCache(self):
+        # The cache is saved in one segment per channel, so that only
+        # segments of channels which changed have to be rewritten.
+        cachedir = os.path.join(sysconf.get("data-dir"), "cache")
+        if os.path.isfile(cachedir):
+            # Single file cache from older versions.
+            os.unlink(cachedir)
+        if not sysconf.get("disk-cache", True):
+            if os.path.isdir(cachedir):
+                shutil.rmtree(cachedir)
+            self._cachedigests.clear()
+            return
+        if not os.path.isdir(cachedir):
+            os.makedirs(cachedir)
+        changed = []
+        changedloaders = self._getChangedLoaders()
+        for alias in self._sysconfchannels:
+            channel = self._channels[alias]
+            digest = channel.getDigest()
+            if (alias not in self._cachedigests or
+                self._cachedigests[alias] != digest):
+                changed.append(alias)
+            elif isinstance(channel, PackageChannel):
+                for loader in channel.getLoaders():
+                    if loader in changedloaders:
+                        changed.append(alias)
+                        break
+        if changed:
+            iface.showStatus(_("Saving cache..."))
+            for alias in changed:
+                channel = self._channels[alias]
+                loaders = {}
+                packages = {}
+                if isinstance(channel, PackageChannel):
+                    for loader in channel.getLoaders():
+                        loader._cachechanged = False
+                        loaders[loader] = True
+                        packages.update(dict.fromkeys(loader.getPackages()))
+                state = (self.__stateversion__,
+                         channel,
+                         self._sysconfchannels[alias])
+                segmentpath = os.path.join(cachedir, alias)
+                dumpCacheFile(segmentpath+".new", state, packages.keys(),
+                              (self._cache,), loaders)
+                os.rename(segmentpath+".new", segmentpath)
+                self._cachedigests[alias] = channel.getDigest()
+            iface.hideStatus()
+        for entry in os.listdir(cachedir):
+            if entry not in self._sysconfchannels:
+                os.unlink(os.path.join(cachedir, entry))
+                if entry in self._cachedigests:
+                    del self._cachedigests[entry]
+
+    def _getChangedLoaders(self):
+        # Loaders may attach data to themselves after the cache is
+        # loaded, such as search indexes, and flag that their cache
+        # segment must be rewritten to keep it.
+        changed = {}
+        for loader in self._cache.getLoaders():
+            if getattr(loader, "_cachechanged", False):
+                changed[loader] = True
+        return changed
+
+    def saveUpgradeRelations(self):
+        relations = self._cache.getUpgradeRelations()
+        if relations is self._upgraderelations:
+            return
+        path = os.path.join(sysconf.get("data-dir"), "upgrade-relations")
+        if relations and sysconf.get("disk-cache", True):
+            file = open(path+".new", "w")
+            try:
+                cPickle.dump(relations, file, 2)
+            finally:
+                file.close()
+            os.rename(path+".new", path)
+        elif os.path.isfile(path):
+            os.unlink(path)
+        self._upgraderelations = relations
+
+    def loadCache(self, aliases):
+        cachedir = os.path.join(sysconf.get("data-dir"), "cache")
+        if not os.path.isdir(cachedir) or not sysconf.get("disk-cache", True):
+            return
+        iface.showStatus(_("Loading cache..."))
+        # Segments share the object map, so that packages and relations
+        # available in several channels are loaded only once.
+        objmap = {}
+        for alias in aliases:
+            segmentpath = os.path.join(cachedir, alias)
+            if not os.path.isfile(segmentpath):
+                continue
+            try:
+                state = loadCacheFile(segmentpath, (self._cache,), objmap)
+                if state[0] != self.__stateversion__:
+                    raise StateVersionError
+            except:
+                if sysconf.get("log-level") == DEBUG:
+                    import traceback
+                    traceback.print_exc()
+                # Only this channel will have to be parsed again.
+                if os.access(cachedir, os.W_OK):
+                    os.unlink(segmentpath)
+            else:
+                (__stateversion__, channel, data) = state
+                self._channels[alias] = channel
+                self._sysconfchannels[alias] = data
+                self._cachedigests[alias] = channel.getDigest()
+                if isinstance(channel, PackageChannel):
+                    channel.addLoaders(self._cache)
+        path = os.path.join(sysconf.get("data-dir"), "upgrade-relations")
+        if os.path.isfile(path):
+            try:
+                file = open(path)
+                try:
+                    relations = cPickle.load(file)
+                finally:
+                    file.close()
+            except:
+                if sysconf.get("log-level") == DEBUG:
+                    import traceback
+                    traceback.print_exc()
+            else:
+                self._cache.setUpgradeRelations(relations)
+                self._upgraderelations = relations
+        iface.hideStatus()
+
     def reloadMirrors(self):
         mirrors = sysconf.get("mirrors", {})
         for channel in self._channels.values():
@@ -232,8 +354,11 @@ class Control(object):
                         mirrors[origin] = set.keys()
         msys = self._fetcher.getMirrorSystem()
         msys.setMirrors(mirrors)
-        if not msys.getHistory():
-            msys.setHistory(sysconf.get("mirrors-history", []))
+        if not msys.getScores():
+            msys.setScores(sysconf.get("mirrors-scores", {}))
+            history = sysconf.get("mirrors-history")
+            if history:
+                msys.addHistory(history)
 
     def rebuildSysConfChannels(self):
 
@@ -249,31 +374,8 @@ class Control(object):
             return not data.get("disabled")
 
         if channels and not self._channels:
-            cachepath = os.path.join(sysconf.get("data-dir"), "cache")
-            if os.path.isfile(cachepath) and sysconf.get("disk-cache", True):
-                iface.showStatus(_("Loading cache..."))
-                cachefile = open(cachepath)
-                try:
-                    state = cPickle.load(cachefile)
-                    if state[0] != self.__stateversion__:
-                        raise StateVersionError
-                except:
-                    if sysconf.get("log-level") == DEBUG:
-                        import traceback
-                        traceback.print_exc()
-                    if os.access(os.path.dirname(cachepath), os.W_OK):
-                        os.unlink(cachepath)
-                else:
-                    (__stateversion__,
-                     self._cache,
-                     self._channels,
-                     self._sysconfchannels) = state
-                    for alias in self._channels.keys():
-                        if (alias not in channels or
-                            not isEnabled(alias, channels[alias])):
-                            self.removeChannel(alias)
-                cachefile.close()
-                iface.hideStatus()
+            self.loadCache([alias for alias in channels
+                            if isEnabled(alias, channels[alias])])
 
         for alias in channels:
             data = channels[alias]
@@ -573,7 +675,7 @@ class Control(object):
             urls = metafile.urls()
             info = metafile.info()
             # TODO: use random url
-            fetcher.enqueue(urls[0], **info)
+            fetcher.enqueue(urls[0], urls=urls[1:], **info)
         fetcher.run(what=what)
         return fetcher.getSucceededSet(), fetcher.getFailedSet()
 
@@ -657,17 +759,47 @@ class Control(object):
             to a log file specified with via the sysconf"commit-log"
             variable
         """
-        logfile = sysconf.get("commit-log",None)
-        if logfile == None:
+        logpath = self.getCommitLogPath()
+        if logpath == None:
             return
-        logdir = os.path.join(sysconf.get("data-dir"), "logs/")
+        logdir = os.path.dirname(logpath)
         if not os.path.isdir(logdir):
             os.makedirs(logdir)
-        log = open(logdir+logfile,"a")
+        log = open(logpath,"a")
         for pkg in changeset:
             log.write("%s %s: %s\n" % (time.ctime(), pkg, changeset[pkg]))
         log.write("\n")
 
+    def getCommitLogPath(self):
+        logfile = sysconf.get("commit-log",None)
+        if logfile == None:
+            return None
+        return os.path.join(sysconf.get("data-dir"), "logs/")+logfile
+
+    def readCommitLog(self, offset=0):
+        """ returns the (package, operation) pairs written to the
+            commit log after the given offset, and the offset of the
+            end of the log. The whole log is read if it got shorter
+            than the offset, since it was rotated meanwhile.
+        """
+        logpath = self.getCommitLogPath()
+        if logpath == None or not os.path.isfile(logpath):
+            return [], 0
+        log = open(logpath)
+        log.seek(0, 2)
+        if log.tell() < offset:
+            offset = 0
+        log.seek(offset)
+        changes = []
+        for line in log.readlines():
+            # Lines start with the 24 characters of time.ctime().
+            entry = line[25:].rstrip("\n")
+            if ": " in entry:
+                changes.append(tuple(entry.rsplit(": ", 1)))
+        offset = log.tell()
+        log.close()
+        return changes, offset
+
     def setPackageOrigins(self, changeset, channels):
         for pkg in changeset:
             if changeset[pkg] is INSTALL:
@@ -680,6 +812,30 @@ class Control(object):
     def commitTransaction(self, trans, caching=OPTIONAL, confirm=True):
         return self.commitChangeSet(trans.getChangeSet(), caching, confirm)
 
+    def commitPackages(self, cs, pmpkgs, pkgpaths, pkgchannels):
+        hooks.call("pre-commit")
+
+        for pmclass in pmpkgs:
+            pmcs = ChangeSet(self._cache)
+            for pkg in pmpkgs[pmclass]:
+                if pkg in cs:
+                    pmcs[pkg] = cs[pkg]
+                    pmcs.setRequested(pkg, cs.getRequested(pkg))
+            if sysconf.get("commit", True):
+                pmcs.markPackagesAutoInstalled()
+                self.writeCommitLog(pmcs)
+                pmclass().commit(pmcs, pkgpaths)
+                self.setPackageOrigins(pmcs, pkgchannels)
+
+        hooks.call("post-commit")
+
+        if sysconf.get("remove-packages", True):
+            datadir = sysconf.get("data-dir")
+            for pkg in pkgpaths:
+                for path in pkgpaths[pkg]:
+                    if path.startswith(os.path.join(datadir, "packages")):
+                        os.unlink(path)
+
     def commitChangeSet(self, changeset, caching=OPTIONAL, confirm=True):
         if sysconf.get("commit-stepped", False):
             return self.commitChangeSetStepped(changeset, caching, confirm)
@@ -695,17 +851,14 @@ class Control(object):
 
         setCloseOnExecAll()
 
-        pmpkgs = {}
-        for pkg in changeset:
-            pmclass = pkg.packagemanager
-            if pmclass not in pmpkgs:
-                pmpkgs[pmclass] = [pkg]
-            else:
-                pmpkgs[pmclass].append(pkg)
+        pmpkgs = getPackagesByManager(changeset)
 
         channels = getChannelsWithPackages([x for x in changeset
                                             if changeset[x] is INSTALL])
-        datadir = sysconf.get("data-dir")
+        if (sysconf.get("commit-pipelined", False) and
+            not [x for x in channels if x.isRemovable()]):
+            return self.commitChangeSetPipelined(changeset, pmpkgs,
+                                                 channels, caching)
         splitter = ChangeSetSplitter(changeset)
         donecs = ChangeSet(self._cache)
         copypkgpaths = {}
@@ -735,28 +888,7 @@ class Control(object):
                         pkgpaths[pkg] = copypkgpaths[pkg]
                         del copypkgpaths[pkg]
 
-                hooks.call("pre-commit")
-                
-                for pmclass in pmpkgs:
-                    pmcs = ChangeSet(self._cache)
-                    for pkg in pmpkgs[pmclass]:
-                        if pkg in cs:
-                            pmcs[pkg] = cs[pkg]
-                            pmcs.setRequested(pkg, cs.getRequested(pkg))
-                    if sysconf.get("commit", True):
-                        pmcs.markPackagesAutoInstalled()
-                        self.writeCommitLog(pmcs)
-                        pmclass().commit(pmcs, pkgpaths)
-                        self.setPackageOrigins(pmcs, pkgchannels)
-
-                hooks.call("post-commit")
-                
-                if sysconf.get("remove-packages", True):
-                    for pkg in pkgpaths:
-                        for path in pkgpaths[pkg]:
-                            if path.startswith(os.path.join(datadir,
-                                                            "packages")):
-                                os.unlink(path)
+                self.commitPackages(cs, pmpkgs, pkgpaths, pkgchannels)
 
             if donecs == changeset:
                 break
@@ -785,11 +917,57 @@ class Control(object):
         return self.commitChangeSetStepped(trans.getChangeSet(),
                                            caching, confirm)
 
-    def commitChangeSetStepped(self, changeset, caching=OPTIONAL,
-                               confirm=True):
-        if confirm and not iface.confirmChangeSet(changeset):
-            return False
+    def commitChangeSetPipelined(self, changeset, pmpkgs, channels,
+                                 caching=OPTIONAL):
+        """
+        Commit the changeset in dependency-closed steps, downloading
+        the packages of the following steps while the current one is
+        being committed.
+        """
+        self._achanset.setChannels(channels)
+        steps = self.splitChangeSet(changeset)
+        results = Queue.Queue()
+        stopped = []
+        def fetch():
+            # Downloads after the first one are not shown, since the
+            # progress is being used by the package managers.
+            progress = None
+            for cs in steps:
+                if stopped:
+                    break
+                try:
+                    result = self.fetchPackages([pkg for pkg in cs
+                                                 if cs[pkg] is INSTALL],
+                                                caching, channels=True,
+                                                progress=progress)
+                except Exception, e:
+                    results.put((None, e))
+                    break
+                results.put((result, None))
+                progress = Progress()
+        fetchthread = threading.Thread(target=fetch)
+        fetchthread.start()
+        try:
+            for cs in steps:
+                result, error = results.get()
+                if error:
+                    raise error
+                pkgpaths, pkgchannels = result
+                self.commitPackages(cs, pmpkgs, pkgpaths, pkgchannels)
+        finally:
+            if fetchthread.isAlive():
+                stopped.append(True)
+                self._fetcher.cancel()
+                fetchthread.join()
+        self._mediaset.restoreState()
+        return True
 
+    def splitChangeSet(self, changeset):
+        """
+        Split the changeset into changesets which may be committed
+        one after the other, ordered so that packages required by
+        others come first.
+        """
         # Order by number of required packages inside the transaction.
         pkglst = []
         for pkg in changeset:
@@ -805,17 +983,27 @@ class Control(object):
 
         splitter = ChangeSetSplitter(changeset)
         unioncs = ChangeSet(self._cache)
+        steps = []
         for n, pkg in pkglst:
             if pkg in unioncs:
                 continue
             cs = ChangeSet(self._cache, unioncs)
             splitter.include(unioncs, pkg)
-            cs = unioncs.difference(cs)
+            steps.append(unioncs.difference(cs))
+        return steps
+
+    def commitChangeSetStepped(self, changeset, caching=OPTIONAL,
+                               confirm=True):
+        if confirm and not iface.confirmChangeSet(changeset):
+            return False
+
+        for cs in self.splitChangeSet(changeset):
             self.commitChangeSet(cs, confirm=confirm)
 
         return True
 
-    def fetchPackages(self, packages, caching=OPTIONAL, targetdir=None, channels=False):
+    def fetchPackages(self, packages, caching=OPTIONAL, targetdir=None,
+                      channels=False, progress=None):
         fetcher = self._fetcher
         fetcher.reset()
         fetcher.setCaching(caching)
@@ -827,7 +1015,19 @@ class Control(object):
             fetcher.setLocalDir(localdir, mangle=False)
         else:
             fetcher.setLocalDir(targetdir, mangle=False)
-        pkgitems = {}
+        def enqueue(url, info, media):
+            return fetcher.enqueue(url, media=media,
+                                   md5=info.getMD5(url),
+                                   sha=info.getSHA(url),
+                                   sha256=info.getSHA256(url),
+                                   size=info.getSize(url),
+                                   validate=info.validate)
+        usedeltas = (caching is OPTIONAL and not targetdir and
+                     sysconf.get("use-deltas", True))
+        localschemes = fetcher.getLocalSchemes()
+        items = {}
+        deltas = {}
+        pkgurls = {}
         pkgchannels = {}
         for pkg in packages:
             for loader in pkg.loaders:
@@ -841,27 +1041,58 @@ class Control(object):
             pkgchannels[pkg] = channel
             info = loader.getInfo(pkg)
             urls = info.getURLs()
-            pkgitems[pkg] = []
+            pkgurls[pkg] = urls
             for url in urls:
                 media = self._achanset.getMedia(channel)
-                pkgitems[pkg].append(fetcher.enqueue(url, media=media,
-                                                     md5=info.getMD5(url),
-                                                     sha=info.getSHA(url),
-                                                     sha256=info.getSHA256(url),
-                                                     size=info.getSize(url),
-                                                     validate=info.validate))
+                # Local files would be used in place, so their deltas
+                # aren't worth it.
+                delta = (usedeltas and
+                         url.split(":", 1)[0] not in localschemes and
+                         getBestDelta(info, url))
+                if delta:
+                    item = fetcher.enqueue(delta.getURL(), media=media,
+                                           md5=delta.getMD5(),
+                                           sha=delta.getSHA(),
+                                           sha256=delta.getSHA256(),
+                                           size=delta.getSize())
+                    deltas[url] = (item, delta, info, media)
+                else:
+                    items[url] = enqueue(url, info, media)
         if targetdir:
             fetcher.setForceCopy(True)
-        fetcher.run(what=_("packages"))
+        fetcher.run(what=_("packages"), progress=progress)
         fetcher.setForceCopy(False)
         failed = fetcher.getFailedSet()
+        if deltas:
+            # Build packages from their deltas, and check them as usual
+            # by enqueueing their URLs. Packages which couldn't be built
+            # are downloaded.
+            for url in deltas:
+                item, delta, info, media = deltas[url]
+                if item.getStatus() is SUCCEEDED:
+                    deltapath = item.getTargetPath()
+                    try:
+                        delta.apply(deltapath,
+                                    fetcher.getLocalPathForURL(url))
+                    except Error, e:
+                        iface.debug(unicode(e))
+                    os.unlink(deltapath)
+                else:
+                    del failed[item.getOriginalURL()]
+            fetcher.reset()
+            for url in deltas:
+                item, delta, info, media = deltas[url]
+                items[url] = enqueue(url, info, media)
+            fetcher.run(what=_("packages"), progress=progress)
+            failed.update(fetcher.getFailedSet())
         if failed:
             raise Error, _("Failed to download packages:\n") + \
                          "\n".join([u"    %s: %s" % (url, failed[url])
                                     for url in failed])
         pkgpaths = {}
         for pkg in packages:
-            pkgpaths[pkg] = [item.getTargetPath() for item in pkgitems[pkg]]
+            pkgpaths[pkg] = [items[url].getTargetPath()
+                             for url in pkgurls[pkg]]
         if not channels:
             return pkgpaths
         return pkgpaths, pkgchannels
@@ -1029,6 +1260,31 @@ class ChannelSorter(object):
                 rc *= -1
         return rc
 
+def getBestDelta(info, url):
+    """
+    Return the smallest applicable delta for the package in the given
+    URL, or None if there's no delta smaller than the package itself.
+    """
+    best = None
+    size = info.getSize(url)
+    for delta in info.getDeltas(url):
+        deltasize = delta.getSize()
+        if (deltasize and (not size or deltasize < size) and
+            (not best or deltasize < best.getSize()) and
+            delta.isApplicable()):
+            best = delta
+    return best
+
+def getPackagesByManager(packages):
+    pmpkgs = {}
+    for pkg in packages:
+        pmclass = pkg.packagemanager
+        if pmclass not in pmpkgs:
+            pmpkgs[pmclass] = [pkg]
+        else:
+            pmpkgs[pmclass].append(pkg)
+    return pmpkgs
+
 def getChannelsWithPackages(packages):
     channels = {}
     for pkg in packages:
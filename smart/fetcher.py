@@ -22,11 +22,14 @@
 #
 from smart.util.strtools import sizeToStr, speedToStr, secondsToStr
 from smart.media import MediaSet, DeviceMedia
+from smart.contentstore import getContentStore, STOREKINDS
 from smart.uncompress import Uncompressor
 from smart.mirror import MirrorSystem
 from smart.const import *
 from smart import *
 import tempfile
+import httplib
+import base64
 import socket
 import urllib
 import string
@@ -42,6 +45,8 @@ SPEEDDELAY = 1
 CANCELDELAY = 2
 MAXACTIVEDOWNLOADS = 10
 SOCKETTIMEOUT = 600
+MAXPROBES = 8
+PROBETIMEOUT = 5
 
 class FetcherCancelled(Error): pass
 
@@ -56,6 +61,7 @@ class Fetcher(object):
         self._uncompressing = 0
         self._localdir = tempfile.gettempdir()
         self._mirrorsystem = MirrorSystem()
+        self._contentstore = None
         self._mangle = False
         self._caching = OPTIONAL
         self._items = {}
@@ -68,15 +74,38 @@ class Fetcher(object):
         self._activedownloads = 0
         self._activedownloadslock = thread.allocate_lock()
         self._maxactivedownloads = 0
+        self._changed = []
+        self._changedlock = thread.allocate_lock()
+        self._wakeup = threading.Event()
         self.time = 0
         self._eta = 0
 
     def reset(self):
         self._items.clear()
         self._uncompressing = 0
+        self._changedlock.acquire()
+        del self._changed[:]
+        self._changedlock.release()
 
     def cancel(self):
         self._cancel = True
+        self.wakeUp()
+
+    def wakeUp(self, item=None):
+        # Called from any thread when the state of the given item or
+        # of some handler changed, so that run() checks it.
+        if item:
+            self._changedlock.acquire()
+            self._changed.append(item)
+            self._changedlock.release()
+        self._wakeup.set()
+
+    def getChanged(self):
+        self._changedlock.acquire()
+        changed = self._changed
+        self._changed = []
+        self._changedlock.release()
+        return changed
 
     def getItem(self, url):
         return self._items.get(url)
@@ -107,6 +136,9 @@ class Fetcher(object):
     def getMirrorSystem(self):
         return self._mirrorsystem
 
+    def getContentStore(self):
+        return self._contentstore
+
     def getCaching(self):
         return self._caching
 
@@ -128,7 +160,9 @@ class Fetcher(object):
 
     def getLocalPath(self, item):
         assert isinstance(item, FetchItem)
-        url = item.getOriginalURL()
+        return self.getLocalPathForURL(item.getOriginalURL())
+
+    def getLocalPathForURL(self, url):
         if self._mangle:
             filename = url.replace("/", "_")
         else:
@@ -191,7 +225,11 @@ class Fetcher(object):
 
     def run(self, what=None, progress=None):
         socket.setdefaulttimeout(sysconf.get("socket-timeout", SOCKETTIMEOUT))
-        self._cancel = False
+        # A cancel() made before running, possibly from another thread,
+        # still cancels this run, and is cleared once it's over.
+        if self._cancel:
+            self._cancel = False
+            raise FetcherCancelled, _("Cancelled")
         thread_name = threading.currentThread().getName()
         if thread_name == "MainThread":
             def quitIntHandler(signal, frame):
@@ -204,7 +242,7 @@ class Fetcher(object):
                                                MAXACTIVEDOWNLOADS)
         self._maxdownloadrate = sysconf.get("max-download-rate", 0)
         self.time = time.time()
-        handlers = self._handlers.values()
+        self._contentstore = getContentStore()
         total = len(self._items)
         self.runLocal()
         local = len([x for x in self._items.values()
@@ -212,7 +250,10 @@ class Fetcher(object):
         if local == total or self._caching is ALWAYS:
             if progress:
                 progress.add(total)
+            self._cancel = False
             return
+        self.probeMirrors()
+        handlers = self._handlers.values()
         if progress:
             prog = progress
             prog.add(local)
@@ -236,7 +277,10 @@ class Fetcher(object):
         uncompchecked = {}
         self._speedupdated = self.time
         cancelledtime = None
+        wakeup = self._wakeup
         while active or self._uncompressing:
+            # Anything happening from now on wakes the next wait up.
+            wakeup.clear()
             self.time = time.time()
             if self._cancel:
                 if not cancelledtime:
@@ -256,17 +300,17 @@ class Fetcher(object):
                     prog.show()
                     break
                 prog.show()
+                wakeup.wait(cancelledtime+CANCELDELAY-self.time)
                 continue
             for handler in active[:]:
                 if not handler.tick():
                     active.remove(handler)
             if self._speedupdated+SPEEDDELAY < self.time:
                 self._speedupdated = self.time
-                updatespeed = True
-            else:
-                updatespeed = False
-            for url in self._items:
-                item = self._items[url]
+                for item in self._items.values():
+                    item.updateSpeed()
+                    item.updateETA()
+            for item in self.getChanged():
                 if item.getStatus() == FAILED:
                     if (item.getRetries() < MAXRETRIES and
                         item.setNextURL()):
@@ -275,14 +319,16 @@ class Fetcher(object):
                         handler.enqueue(item)
                         if handler not in active:
                             active.append(handler)
+                        wakeup.set()
                     continue
-                elif (item.getStatus() != SUCCEEDED or
-                      not item.getInfo("uncomp")):
-                    if updatespeed:
-                        item.updateSpeed()
-                        item.updateETA()
+                elif item.getStatus() != SUCCEEDED:
                     continue
                 localpath = item.getTargetPath()
+                if (self._contentstore and
+                    localpath == self.getLocalPath(item)):
+                    self.storeItem(item)
+                if not item.getInfo("uncomp"):
+                    continue
                 if localpath in uncompchecked:
                     continue
                 uncompchecked[localpath] = True
@@ -290,25 +336,128 @@ class Fetcher(object):
                 if not uncomphandler:
                     continue
                 uncomppath = uncomphandler.getTargetPath(localpath)
-                if (not self.hasStrongValidate(item, uncomp=True) or
-                    not self.validate(item, uncomppath, uncomp=True)):
+                if item.finishStream(localpath):
+                    valid, reason = self.validate(item, uncomppath,
+                                                  withreason=True,
+                                                  uncomp=True)
+                    if valid:
+                        item.setSucceeded(uncomppath)
+                    else:
+                        item.setFailed(reason)
+                elif (not self.hasStrongValidate(item, uncomp=True) or
+                      not self.validate(item, uncomppath, uncomp=True)):
                     self._uncompressing += 1
                     thread.start_new_thread(self._uncompress,
                                             (item, localpath, uncomphandler))
                 else:
                     item.setSucceeded(uncomppath)
             prog.show()
-            time.sleep(0.1)
+            if active or self._uncompressing:
+                wakeup.wait(self._speedupdated+SPEEDDELAY-time.time())
         for handler in handlers:
             handler.stop()
+        if self._contentstore:
+            self._contentstore.prune()
         if not progress:
             prog.stop()
         if thread_name == "MainThread":
             signal.signal(signal.SIGQUIT, old_quit_handler)
             signal.signal(signal.SIGINT, old_int_handler)
         if self._cancel:
+            self._cancel = False
             raise FetcherCancelled, _("Cancelled")
 
+    def storeItem(self, item):
+        """
+        Put the file downloaded for the item into the content store,
+        if the digest of its contents is known and matches.
+        """
+        for kind in STOREKINDS:
+            expected = item.getInfo(kind)
+            if expected:
+                break
+        else:
+            return
+        store = self._contentstore
+        if store.find([(kind, expected)]):
+            return
+        localpath = item.getTargetPath()
+        digests = item.getDigests(localpath)
+        if not digests or kind not in digests.getKinds():
+            digests = Digests([kind])
+            digests.updateFromFile(localpath)
+        if digests.hexdigest(kind) == expected:
+            store.add(localpath, kind, expected)
+
+    def linkFromStore(self, item, localpath):
+        """
+        Link the file of the item in the content store, if any, into
+        localpath.
+        """
+        store = self._contentstore
+        if store:
+            digests = [(kind, item.getInfo(kind)) for kind in STOREKINDS
+                       if item.getInfo(kind)]
+            storepath = store.find(digests, item.getInfo("size"))
+            if storepath:
+                store.link(storepath, localpath)
+
+    def probeMirrors(self):
+        """
+        When at least mirror-probe-threshold items are waiting, measure
+        the latency of the mirrors they may use and which weren't
+        measured recently, and choose the mirror of each item again.
+        """
+        threshold = sysconf.get("mirror-probe-threshold", 0)
+        items = [x for x in self._items.values()
+                 if x.getStatus() is WAITING and not x.getRetries()]
+        if not threshold or len(items) < threshold:
+            return
+        msys = self._mirrorsystem
+        probes = {}
+        for item in items:
+            for mirror, url in item.getMirrorCandidates():
+                if mirror not in probes and msys.needsProbe(mirror):
+                    probes[mirror] = url
+        queue = []
+        for mirror, url in probes.items():
+            try:
+                handler = self.getSchemeHandler(URL(url).scheme)
+            except Error:
+                continue
+            if handler.canProbe(url):
+                queue.append((handler, mirror, url))
+        if not queue:
+            return
+        iface.debug(_("Probing %d mirrors") % len(queue))
+        lock = thread.allocate_lock()
+        def probe():
+            while True:
+                lock.acquire()
+                if not queue:
+                    lock.release()
+                    break
+                handler, mirror, url = queue.pop()
+                lock.release()
+                try:
+                    latency = handler.probe(url)
+                except (IOError, socket.error, Error):
+                    msys.addInfo(mirror, failed=1)
+                else:
+                    msys.addInfo(mirror, latency=latency)
+        threads = []
+        for i in range(min(MAXPROBES, len(queue))):
+            probethread = threading.Thread(target=probe)
+            probethread.start()
+            threads.append(probethread)
+        for probethread in threads:
+            probethread.join()
+        for item in items:
+            handler = self.getHandlerInstance(item)
+            if item.setBestURL():
+                handler.dequeue(item)
+                self.getHandlerInstance(item).enqueue(item)
+
     def _uncompress(self, item, localpath, uncomphandler):
         try:
             uncomphandler.uncompress(localpath)
@@ -323,6 +472,7 @@ class Fetcher(object):
             else:
                 item.setSucceeded(uncomppath)
         self._uncompressing -= 1
+        self.wakeUp()
 
     def getLocalSchemes(self):
         return self._localschemes
@@ -339,7 +489,9 @@ class Fetcher(object):
     getHandler = classmethod(getHandler)
 
     def getHandlerInstance(self, item):
-        scheme = item.getURL().scheme
+        return self.getSchemeHandler(item.getURL().scheme)
+
+    def getSchemeHandler(self, scheme):
         proxy = sysconf.get("%s-proxy" % scheme)
         if proxy:
             os.environ["%s_proxy" % scheme] = proxy
@@ -355,6 +507,31 @@ class Fetcher(object):
             self._handlers[scheme] = handler
         return handler
 
+    def getETag(self, localpath):
+        """
+        Return the entity tag sent by the server with the file in
+        localpath, if it was kept by setETag().
+        """
+        try:
+            file = open(localpath+".etag")
+        except IOError:
+            return None
+        try:
+            return file.read().strip() or None
+        finally:
+            file.close()
+
+    def setETag(self, item, localpath, etag):
+        # Files which may be validated locally are never requested
+        # again, so there's no point in keeping their tags.
+        etagpath = localpath+".etag"
+        if etag and not self.hasStrongValidate(item):
+            file = open(etagpath, "w")
+            file.write(etag)
+            file.close()
+        elif os.path.isfile(etagpath):
+            os.unlink(etagpath)
+
     def hasStrongValidate(self, item, uncomp=False):
         if uncomp:
             prefix = "uncomp_"
@@ -391,56 +568,17 @@ class Fetcher(object):
                     raise Error, _("Unexpected size (expected %d, got %d)") % \
                                  (size, lsize)
 
-            filemd5 = item.getInfo(uncompprefix+"md5")
-            if filemd5:
-                try:
-                    from hashlib import md5
-                except ImportError:
-                    from md5 import md5
-                digest = md5()
-                file = open(localpath)
-                data = file.read(BLOCKSIZE)
-                while data:
-                    digest.update(data)
-                    data = file.read(BLOCKSIZE)
-                lfilemd5 = digest.hexdigest()
-                if lfilemd5 != filemd5:
-                    raise Error, _("Invalid MD5 (expected %s, got %s)") % \
-                                 (filemd5, lfilemd5)
-
-            filesha256 = item.getInfo(uncompprefix+"sha256")
-            if filesha256:
-                try:
-                    from hashlib import sha256
-                except ImportError:
-                    from smart.util.sha256 import sha256
-                digest = sha256()
-                file = open(localpath)
-                data = file.read(BLOCKSIZE)
-                while data:
-                    digest.update(data)
-                    data = file.read(BLOCKSIZE)
-                lfilesha256 = digest.hexdigest()
-                if lfilesha256 != filesha256:
-                   raise Error, _("Invalid SHA256 (expected %s, got %s)") % \
-                                 (filesha256, lfilesha256)
-            else:
-                filesha = item.getInfo(uncompprefix+"sha")
-                if filesha:
-                    try:
-                        from hashlib import sha1 as sha
-                    except ImportError:
-                        from sha import sha
-                    digest = sha()
-                    file = open(localpath)
-                    data = file.read(BLOCKSIZE)
-                    while data:
-                        digest.update(data)
-                        data = file.read(BLOCKSIZE)
-                    lfilesha = digest.hexdigest()
-                    if lfilesha != filesha:
-                        raise Error, _("Invalid SHA (expected %s, got %s)") % \
-                                     (filesha, lfilesha)
+            kinds = getDigestKinds(item, uncomp)
+            if kinds:
+                digests = item.getDigests(localpath)
+                if not digests:
+                    digests = Digests(kinds)
+                    digests.updateFromFile(localpath)
+                for kind in kinds:
+                    expected = item.getInfo(uncompprefix+kind)
+                    got = digests.hexdigest(kind)
+                    if got != expected:
+                        raise Error, DIGESTERRORS[kind] % (expected, got)
         except Error, reason:
             if withreason:
                 return False, reason
@@ -450,6 +588,149 @@ class Fetcher(object):
                 return True, None
             return True
 
+DIGESTERRORS = {"md5": _("Invalid MD5 (expected %s, got %s)"),
+                "sha256": _("Invalid SHA256 (expected %s, got %s)"),
+                "sha": _("Invalid SHA (expected %s, got %s)")}
+
+def getDigestKinds(item, uncomp=False):
+    if uncomp:
+        prefix = "uncomp_"
+    else:
+        prefix = ""
+    kinds = []
+    if item.getInfo(prefix+"md5"):
+        kinds.append("md5")
+    # SHA is only checked when there's no SHA256.
+    if item.getInfo(prefix+"sha256"):
+        kinds.append("sha256")
+    elif item.getInfo(prefix+"sha"):
+        kinds.append("sha")
+    return kinds
+
+class Digests(object):
+    """
+    Digests of a file, which handlers may compute while writing it, so
+    that it doesn't have to be read again for validation.
+    """
+
+    def __init__(self, kinds, path=None):
+        self.path = path
+        self.size = 0
+        self._digests = {}
+        for kind in kinds:
+            if kind == "md5":
+                try:
+                    from hashlib import md5 as digest
+                except ImportError:
+                    from md5 import md5 as digest
+            elif kind == "sha256":
+                try:
+                    from hashlib import sha256 as digest
+                except ImportError:
+                    from smart.util.sha256 import sha256 as digest
+            else:
+                try:
+                    from hashlib import sha1 as digest
+                except ImportError:
+                    from sha import sha as digest
+            self._digests[kind] = digest()
+
+    def update(self, data):
+        for digest in self._digests.itervalues():
+            digest.update(data)
+        self.size += len(data)
+
+    def updateFromFile(self, path):
+        file = open(path)
+        try:
+            data = file.read(BLOCKSIZE)
+            while data:
+                self.update(data)
+                data = file.read(BLOCKSIZE)
+        finally:
+            file.close()
+
+    def getKinds(self):
+        return self._digests.keys()
+
+    def hexdigest(self, kind):
+        return self._digests[kind].hexdigest()
+
+class ItemStream(object):
+    """
+    Data of a download, fed by handlers as it's written from the start
+    to localpath. Its digests, and the uncompressed file when the item
+    must be uncompressed, are then ready once the download is over,
+    without reading the file again.
+    """
+
+    def __init__(self, item, localpath, uncompressor):
+        self.path = localpath
+        self.digests = Digests(getDigestKinds(item), localpath)
+        self.uncompdigests = None
+        self._decompressor = None
+        self._uncompfile = None
+        self._uncomppath = None
+        handler = item.getInfo("uncomp") and \
+                  uncompressor.getHandler(localpath)
+        decompressor = handler and handler.getDecompressor()
+        if decompressor:
+            uncomppath = handler.getTargetPath(localpath)
+            try:
+                self._uncompfile = open(uncomppath+".part", "w")
+            except (IOError, OSError):
+                return
+            self._decompressor = decompressor
+            self._uncomppath = uncomppath
+            self.uncompdigests = Digests(getDigestKinds(item, True),
+                                         uncomppath)
+
+    def update(self, data):
+        self.digests.update(data)
+        if self._decompressor:
+            try:
+                data = self._decompressor.decompress(data)
+                self._uncompfile.write(data)
+                self.uncompdigests.update(data)
+            except Exception:
+                # Decompressors have their own error types. The file
+                # will be uncompressed as usual, reporting the problem.
+                self.abort()
+
+    def finish(self):
+        """
+        Finish uncompressing the data, and return the path of the
+        uncompressed file, or None if it wasn't uncompressed.
+        """
+        decompressor = self._decompressor
+        if not decompressor:
+            return None
+        try:
+            if hasattr(decompressor, "flush"):
+                data = decompressor.flush()
+                self._uncompfile.write(data)
+                self.uncompdigests.update(data)
+            if getattr(decompressor, "unused_data", None):
+                # More streams follow, as in concatenated gzip files.
+                raise Error
+            self._uncompfile.close()
+            os.rename(self._uncomppath+".part", self._uncomppath)
+        except Exception:
+            self.abort()
+            return None
+        self._decompressor = None
+        return self._uncomppath
+
+    def abort(self):
+        if self._decompressor:
+            self._decompressor = None
+            self.uncompdigests = None
+            self._uncompfile.close()
+            try:
+                os.unlink(self._uncomppath+".part")
+            except OSError:
+                pass
+
 class FetchItem(object):
 
     def __init__(self, fetcher, url, mirror):
@@ -459,6 +740,7 @@ class FetchItem(object):
         self._urlobj = URL(mirror.getNext())
         self._retries = 0
         self._starttime = None
+        self._latency = None
         self._current = 0
         self._total = 0
         self._speed = 0
@@ -471,6 +753,7 @@ class FetchItem(object):
         self._status = WAITING
         self._failedreason = None
         self._targetpath = None
+        self._stream = None
 
         self._progress = iface.getSubProgress(fetcher)
 
@@ -478,7 +761,11 @@ class FetchItem(object):
         self._status = WAITING
         self._failedreason = None
         self._targetpath = None
+        if self._stream:
+            self._stream.abort()
+            self._stream = None
         self._starttime = None
+        self._latency = None
         self._current = 0
         self._total = 0
         self._speed = 0
@@ -503,6 +790,23 @@ class FetchItem(object):
             self._urlobj.set(self._url)
             return False
 
+    def setBestURL(self):
+        """
+        Choose the mirror for the item again, returning whether its URL
+        has changed.
+        """
+        url = self._mirror.rewind()
+        if url and url != self._urlobj.original:
+            self._urlobj.set(url)
+            return True
+        return False
+
+    def getMirrorURLs(self, count):
+        return self._mirror.getBest(count)
+
+    def getMirrorCandidates(self):
+        return self._mirror.getCandidates()
+
     def getOriginalURL(self):
         return self._url
 
@@ -521,6 +825,36 @@ class FetchItem(object):
     def getTargetPath(self):
         return self._targetpath
 
+    def openStream(self, localpath):
+        """
+        Return the ItemStream which the data written from the start of
+        a download to localpath must be fed into.
+        """
+        if self._stream:
+            self._stream.abort()
+        uncompressor = self._fetcher.getUncompressor()
+        self._stream = ItemStream(self, localpath, uncompressor)
+        return self._stream
+
+    def getDigests(self, localpath):
+        stream = self._stream
+        if stream:
+            for digests in (stream.digests, stream.uncompdigests):
+                if (digests and digests.path == localpath and
+                    digests.size == os.path.getsize(localpath)):
+                    return digests
+        return None
+
+    def finishStream(self, localpath):
+        """
+        Return the path of the file uncompressed while localpath was
+        downloaded, or None if it wasn't.
+        """
+        stream = self._stream
+        if stream and stream.path == localpath:
+            return stream.finish()
+        return None
+
     def getInfo(self, kind, default=None):
         return self._info.get(kind, default)
 
@@ -536,6 +870,7 @@ class FetchItem(object):
         # - size: file size
         # - uncomp: whether to uncompress or not
         # - uncomp_{md5,sha,sha256,size}: uncompressed equivalents
+        # - urls: other URLs where the same file may be found
         #
         for kind in ("md5", "sha", "sha256",
                      "uncomp_md5", "uncomp_sha", "uncomp_sha256"):
@@ -558,6 +893,8 @@ class FetchItem(object):
 
     def progress(self, current, total):
         if self._status is RUNNING:
+            if current and self._latency is None:
+                self._latency = max(time.time()-self._starttime, 0)
             self._current = current
             self._total = total
             if total:
@@ -603,18 +940,23 @@ class FetchItem(object):
                     timedelta = now-self._starttime
                     if timedelta < 1:
                         timedelta = 1
-                    self._mirror.addInfo(time=timedelta, size=fetchedsize)
+                    self._mirror.addInfo(time=timedelta, size=fetchedsize,
+                                         latency=self._latency)
                     self._speed = fetchedsize/timedelta
                 self._progress.setSubDone(self._urlobj.original)
                 self._progress.show()
+            self._fetcher.wakeUp(self)
 
     def setFailed(self, reason):
         self._status = FAILED
         self._failedreason = reason
+        if self._stream:
+            self._stream.abort()
         if self._starttime:
             self._mirror.addInfo(failed=1)
             self._progress.setSubStopped(self._urlobj.original)
             self._progress.show()
+        self._fetcher.wakeUp(self)
 
     def setCancelled(self):
         self.setFailed(_("Cancelled"))
@@ -729,13 +1071,33 @@ class FetcherHandler(object):
     def changeActiveDownloads(self, value):
         return self._fetcher.changeActiveDownloads(value)
 
+    def canProbe(self, url):
+        # Whether probe() may be used for the given URL.
+        return False
+
+    def probe(self, url):
+        # Return the time taken by a small request for the given URL,
+        # or raise IOError if it fails.
+        raise Error, _("Probing is not supported")
+
     def tick(self):
-        # Ticking does periodic maintenance of the tasks running
-        # inside the handler. It should return true while there
+        # Ticking does maintenance of the tasks running inside the
+        # handler. It's done whenever the fetcher is woken up, and
+        # at least once a second. It should return true while there
         # is still something to be done, and should not lock for
-        # very long. Threads should be started for that purpose.
+        # very long. Threads should be started for that purpose,
+        # with startThread().
         return False
 
+    def startThread(self, function, args=()):
+        def run():
+            try:
+                function(*args)
+            finally:
+                # Let the fetcher tick the handler with its new state.
+                self._fetcher.wakeUp()
+        thread.start_new_thread(run, ())
+
     def getLocalPath(self, item):
         return self._fetcher.getLocalPath(item)
 
@@ -749,6 +1111,7 @@ class FetcherHandler(object):
             for i in range(len(self._queue)-1,-1,-1):
                 item = self._queue[i]
                 localpath = self.getLocalPath(item)
+                fetcher.linkFromStore(item, localpath)
                 uncomphandler = uncompressor.getHandler(localpath)
                 if uncomphandler and item.getInfo("uncomp"):
                     uncomppath = uncomphandler.getTargetPath(localpath)
@@ -860,7 +1223,7 @@ class FileHandler(FetcherHandler):
     def tick(self):
         if self._queue and not self._active:
             self._active = True
-            thread.start_new_thread(self.copy, ())
+            self.startThread(self.copy)
         return self._active
 
     def copy(self):
@@ -963,7 +1326,7 @@ class FTPHandler(FetcherHandler):
                             if self._inactive[ftp] == userhost:
                                 del self._inactive[ftp]
                                 self._active[ftp] = url.host
-                                thread.start_new_thread(self.fetch, (ftp, item))
+                                self.startThread(self.fetch, (ftp, item))
                                 break
                         else:
                             if len(self._inactive) > self.MAXINACTIVE:
@@ -971,8 +1334,8 @@ class FTPHandler(FetcherHandler):
                             ftp = ftplib.FTP()
                             ftp.lasttime = self._fetcher.time
                             self._active[ftp] = url.host
-                            thread.start_new_thread(self.connect,
-                                                    (ftp, item, len(hostactive)))
+                            self.startThread(self.connect,
+                                             (ftp, item, len(hostactive)))
         self._lock.release()
         return bool(self._queue or self._active)
 
@@ -1071,10 +1434,17 @@ class FTPHandler(FetcherHandler):
                 except (IOError, OSError), e:
                     raise Error, "%s: %s" % (localpathpart, e)
 
+                if openmode == "w":
+                    stream = item.openStream(localpath)
+                else:
+                    stream = None
+
                 def write(data):
                     if self._cancel:
                         raise FetcherCancelled
                     local.write(data)
+                    if stream:
+                        stream.update(data)
                     item.current += len(data)
                     item.progress(item.current, total)
 
@@ -1139,26 +1509,239 @@ class FTPHandler(FetcherHandler):
 
 Fetcher.setHandler("ftp", FTPHandler)
 
+class ConnectionPool(object):
+    """
+    Persistent HTTP connections, shared by the threads of a handler,
+    so that many files from the same host don't need a new connection
+    each.
+    """
+
+    def __init__(self, maxidle):
+        self._maxidle = maxidle
+        self._idle = {} # (scheme, host) -> [connection]
+        self._lock = thread.allocate_lock()
+        self.requests = 0
+        self.connections = 0
+
+    def get(self, scheme, host):
+        self._lock.acquire()
+        try:
+            self.requests += 1
+            idle = self._idle.get((scheme, host))
+            if idle:
+                return idle.pop(), True
+            self.connections += 1
+        finally:
+            self._lock.release()
+        if scheme == "https":
+            return httplib.HTTPSConnection(host), False
+        return httplib.HTTPConnection(host), False
+
+    def put(self, scheme, host, conn):
+        self._lock.acquire()
+        idle = self._idle.setdefault((scheme, host), [])
+        if len(idle) < self._maxidle:
+            idle.append(conn)
+            conn = None
+        self._lock.release()
+        if conn:
+            conn.close()
+
+    def clear(self):
+        self._lock.acquire()
+        idle = self._idle
+        self._idle = {}
+        self._lock.release()
+        for conns in idle.values():
+            for conn in conns:
+                conn.close()
+
+    def request(self, scheme, host, selector, headers):
+        """
+        Send a GET request for selector to the given host, and return
+        the response and a file with its body. The connection is given
+        back to the pool once the file is closed after being read.
+        """
+        while True:
+            conn, reused = self.get(scheme, host)
+            try:
+                conn.request("GET", selector, headers=headers)
+                response = conn.getresponse()
+            except (socket.error, httplib.HTTPException), e:
+                conn.close()
+                if reused:
+                    # The server has closed the idle connection.
+                    continue
+                if isinstance(e, socket.error):
+                    raise
+                raise IOError, "%s: %s" % (host,
+                                           str(e) or e.__class__.__name__)
+            return response, PooledFile(self, scheme, host, conn, response)
+
+    def open(self, url, headers):
+        """
+        Like request(), but taking the scheme, host, selector and the
+        authentication information from the given URL.
+        """
+        scheme, rest = urllib.splittype(url)
+        host, selector = urllib.splithost(rest)
+        if not host:
+            raise IOError, ("http error", "no host given")
+        user_passwd, host = urllib.splituser(host)
+        host = urllib.unquote(host)
+        headers = headers.copy()
+        if user_passwd:
+            auth = base64.b64encode(urllib.unquote(user_passwd))
+            headers["Authorization"] = "Basic "+auth.strip()
+        return self.request(scheme, host, selector, headers)
+
+class PooledFile(object):
+
+    def __init__(self, pool, scheme, host, conn, response):
+        self._pool = pool
+        self._scheme = scheme
+        self._host = host
+        self._conn = conn
+        self._response = response
+
+    def read(self, amt=None):
+        return self._response.read(amt)
+
+    def readline(self):
+        # Required by urllib.addinfourl, but not used by the fetcher.
+        line = []
+        while not line or line[-1] != "\n":
+            data = self.read(1)
+            if not data:
+                break
+            line.append(data)
+        return "".join(line)
+
+    def close(self):
+        response = self._response
+        conn = self._conn
+        if not conn:
+            return
+        self._conn = None
+        if (not response.isclosed() and response.length is not None and
+            response.length <= BLOCKSIZE):
+            # Read small bodies, such as error pages, to keep the
+            # connection usable.
+            try:
+                response.read()
+            except (socket.error, httplib.HTTPException):
+                pass
+        if response.isclosed() and not response.will_close:
+            self._pool.put(self._scheme, self._host, conn)
+        else:
+            response.close()
+            conn.close()
+
+class Segment(object):
+
+    def __init__(self, start, end, urls):
+        self.start = start
+        self.current = start
+        self.end = end
+        self.urls = urls
+        self.error = None
+
 class URLLIBHandler(FetcherHandler):
 
     MAXACTIVE = 5
+    MAXPERHOST = 2
+    MINSEGMENTSIZE = 1024*1024
 
     def __init__(self, *args):
         FetcherHandler.__init__(self, *args)
         self._active = 0
         self._lock = thread.allocate_lock()
+        self._pool = ConnectionPool(self.MAXPERHOST)
+        self._hostactive = {} # (scheme, host) -> num
+
+    def stop(self):
+        FetcherHandler.stop(self)
+        pool = self._pool
+        # Progress only shows the state of each item, so how well
+        # connections were reused is left to the debug log.
+        if pool.requests:
+            iface.debug(_("Made %d HTTP requests with %d connections") %
+                        (pool.requests, pool.connections))
+            pool.requests = pool.connections = 0
+        pool.clear()
+
+    def canProbe(self, url):
+        scheme = url.split(":", 1)[0]
+        return (scheme in ("http", "https") and
+                scheme not in urllib.getproxies())
+
+    def probe(self, url):
+        scheme, rest = urllib.splittype(url)
+        host, selector = urllib.splithost(rest)
+        host = urllib.unquote(urllib.splituser(host)[1])
+        if scheme == "https":
+            conn = httplib.HTTPSConnection(host, timeout=PROBETIMEOUT)
+        else:
+            conn = httplib.HTTPConnection(host, timeout=PROBETIMEOUT)
+        start = time.time()
+        try:
+            try:
+                conn.request("HEAD", selector,
+                             headers={"User-Agent": "smart/"+VERSION})
+                response = conn.getresponse()
+            except httplib.HTTPException, e:
+                raise IOError, "%s: %s" % (host,
+                                           str(e) or e.__class__.__name__)
+        finally:
+            conn.close()
+        if response.status >= 500:
+            raise IOError, "%s: %d %s" % (host, response.status,
+                                          response.reason)
+        return time.time()-start
 
     def tick(self):
         self._lock.acquire()
         if self._queue:
             while (self._active < self.MAXACTIVE and
                    self.changeActiveDownloads(+1)):
+                item = self.takeItem()
+                if not item:
+                    self.changeActiveDownloads(-1)
+                    break
                 self._active += 1
-                thread.start_new_thread(self.fetch, ())
+                self.startThread(self.fetch, (item,))
         self._lock.release()
         return bool(self._queue or self._active)
 
-    def fetch(self):
+    def takeItem(self, done=None):
+        # Must be called with the lock held. Forget about the item
+        # which is done, if any, and take the next queued item whose
+        # host has less than MAXPERHOST items being fetched.
+        hostactive = self._hostactive
+        if done:
+            url = done.getURL()
+            schemehost = (url.scheme, url.host)
+            hostactive[schemehost] -= 1
+            if not hostactive[schemehost]:
+                del hostactive[schemehost]
+        if self._cancel:
+            return None
+        for i in range(len(self._queue)-1,-1,-1):
+            url = self._queue[i].getURL()
+            schemehost = (url.scheme, url.host)
+            if hostactive.get(schemehost, 0) < self.MAXPERHOST:
+                hostactive[schemehost] = hostactive.get(schemehost, 0)+1
+                return self._queue.pop(i)
+        return None
+
+    def nextItem(self, done):
+        self._lock.acquire()
+        try:
+            return self.takeItem(done)
+        finally:
+            self._lock.release()
+
+    def fetch(self, item):
         import urllib, rfc822, calendar
         from time import time, sleep
 
@@ -1182,19 +1765,29 @@ class URLLIBHandler(FetcherHandler):
                 info.errcode = errcode
                 info.errmsg = errmsg
                 return info
+            def open_http(self, url, data=None):
+                return self.open_pooled("http", url, data)
+            def open_https(self, url, data=None):
+                return self.open_pooled("https", url, data)
+            def open_pooled(self, scheme, url, data):
+                if not isinstance(url, str) or data is not None:
+                    # Requests through proxies are left to urllib.
+                    method = getattr(urllib.FancyURLopener, "open_"+scheme)
+                    return method(self, url, data)
+                response, fp = pool.open(scheme+":"+url,
+                                         dict(self.addheaders))
+                if 200 <= response.status < 300:
+                    return urllib.addinfourl(fp, response.msg,
+                                             scheme+":"+url, response.status)
+                return self.http_error(url, fp, response.status,
+                                       response.reason, response.msg)
 
         opener = Opener()
+        pool = self._pool
         
         fetcher = self._fetcher
 
-        while not self._cancel:
-
-            self._lock.acquire()
-            if not self._queue:
-                self._lock.release()
-                break
-            item = self._queue.pop()
-            self._lock.release()
+        while item:
 
             url = item.getURL()
 
@@ -1203,6 +1796,12 @@ class URLLIBHandler(FetcherHandler):
 
             item.start()
 
+            segments = self.getSegments(item)
+            if segments:
+                self.fetchSegments(item, segments)
+                item = self.nextItem(item)
+                continue
+
             try:
 
                 localpath = self.getLocalPath(item)
@@ -1220,6 +1819,9 @@ class URLLIBHandler(FetcherHandler):
                     mtime = os.path.getmtime(localpath)
                     opener.addheader("if-modified-since",
                                      rfc822.formatdate(mtime))
+                    etag = fetcher.getETag(localpath)
+                    if etag:
+                        opener.addheader("if-none-match", etag)
 
                 localpathpart = localpath+".part"
                 if os.path.isfile(localpathpart):
@@ -1233,6 +1835,7 @@ class URLLIBHandler(FetcherHandler):
 
                 if hasattr(remote, "errcode") and remote.errcode == 416:
                     # Range not satisfiable, try again without it.
+                    remote.close()
                     opener.addheaders = [x for x in opener.addheaders
                                          if x[0] != "range"]
                     remote = opener.open(url.original)
@@ -1265,6 +1868,11 @@ class URLLIBHandler(FetcherHandler):
                 except (IOError, OSError), e:
                     raise IOError, "%s: %s" % (localpathpart, e)
 
+                if openmode == "w":
+                    stream = item.openStream(localpath)
+                else:
+                    stream = None
+
                 rate_limit = self._fetcher._maxdownloadrate
                 if rate_limit:
                     rate_limit /= self._active
@@ -1276,6 +1884,8 @@ class URLLIBHandler(FetcherHandler):
                         if self._cancel:
                             raise FetcherCancelled
                         local.write(data)
+                        if stream:
+                            stream.update(data)
                         current += len(data)
                         item.progress(current, total)
                         if rate_limit:
@@ -1311,6 +1921,7 @@ class URLLIBHandler(FetcherHandler):
                         fetchedsize = os.path.getsize(localpath)
                     else:
                         fetchedsize = None
+                    fetcher.setETag(item, localpath, info.get("etag"))
                     item.setSucceeded(localpath, fetchedsize)
 
                     if "last-modified" in info:
@@ -1321,6 +1932,7 @@ class URLLIBHandler(FetcherHandler):
                             os.utime(localpath, (mtime, mtime))
 
             except urllib.addinfourl, remote:
+                remote.close()
                 if remote.errcode == 304: # Not modified
                     item.setSucceeded(localpath)
                 elif remote.errcode == 404:
@@ -1339,12 +1951,145 @@ class URLLIBHandler(FetcherHandler):
             except FetcherCancelled:
                 item.setCancelled()
 
+            item = self.nextItem(item)
+
         self._lock.acquire()
         self._active -= 1
         self._lock.release()
 
         self.changeActiveDownloads(-1)
 
+    def isSegmentURL(self, url):
+        scheme = urllib.splittype(url)[0]
+        return (scheme in ("http", "https") and
+                scheme not in urllib.getproxies())
+
+    def getSegments(self, item):
+        # Large files with a known size may be fetched in segments,
+        # at once, from the best mirrors available.
+        maxsegments = sysconf.get("download-segments", 1)
+        size = item.getInfo("size")
+        url = item.getURL().original
+        if (maxsegments < 2 or not size or
+            size < 2*self.MINSEGMENTSIZE or
+            self._fetcher._maxdownloadrate or
+            not self.isSegmentURL(url) or
+            self._fetcher.validate(item, self.getLocalPath(item))):
+            return None
+        count = min(maxsegments, size/self.MINSEGMENTSIZE)
+        urls = [url]
+        for url in (item.getMirrorURLs(count-1)+
+                    (item.getInfo("urls") or [])):
+            if url not in urls and self.isSegmentURL(url):
+                urls.append(url)
+        segments = []
+        while len(segments) < count:
+            # The first segment uses the slot taken for the item.
+            if segments and not self.changeActiveDownloads(+1):
+                break
+            i = len(segments)
+            segments.append(Segment(0, 0, urls[i%len(urls):]+
+                                          urls[:i%len(urls)]))
+        if len(segments) < 2:
+            return None
+        for i, segment in enumerate(segments):
+            segment.start = segment.current = i*size/len(segments)
+            segment.end = (i+1)*size/len(segments)
+        return segments
+
+    def fetchSegments(self, item, segments):
+        fetcher = self._fetcher
+        size = item.getInfo("size")
+        localpath = self.getLocalPath(item)
+        localpathpart = localpath+".part"
+        try:
+            try:
+                local = open(localpathpart, "w")
+                local.truncate(size)
+                local.close()
+            except (IOError, OSError), e:
+                item.setFailed("%s: %s" % (localpathpart, e))
+                return
+            workers = []
+            for segment in segments[1:]:
+                worker = threading.Thread(target=self.fetchSegment,
+                                          args=(item, segment, segments,
+                                                localpathpart))
+                worker.start()
+                workers.append(worker)
+            self.fetchSegment(item, segments[0], segments, localpathpart)
+            for worker in workers:
+                worker.join()
+        finally:
+            self.changeActiveDownloads(1-len(segments))
+        if self._cancel:
+            item.setCancelled()
+            return
+        for segment in segments:
+            if segment.error:
+                item.setFailed(segment.error)
+                return
+        os.rename(localpathpart, localpath)
+        valid, reason = fetcher.validate(item, localpath, withreason=True)
+        if valid:
+            item.setSucceeded(localpath, size)
+        else:
+            item.setFailed(reason)
+
+    def fetchSegment(self, item, segment, segments, localpathpart):
+        try:
+            local = open(localpathpart, "r+")
+        except (IOError, OSError), e:
+            segment.error = "%s: %s" % (localpathpart, e)
+            return
+        try:
+            for url in segment.urls:
+                try:
+                    self.fetchRange(item, url, segment, segments, local)
+                except FetcherCancelled:
+                    break
+                except (IOError, OSError, Error, socket.error), e:
+                    try:
+                        segment.error = unicode(e[1])
+                    except IndexError:
+                        segment.error = unicode(e)
+                else:
+                    segment.error = None
+                    break
+        finally:
+            local.close()
+
+    def fetchRange(self, item, url, segment, segments, local):
+        size = item.getInfo("size")
+        headers = {"User-Agent": "smart/"+VERSION,
+                   "Range": "bytes=%d-%d" % (segment.current, segment.end-1)}
+        response, remote = self._pool.open(url, headers)
+        try:
+            if response.status == 404:
+                raise Error, _("File not found")
+            elif response.status != 206:
+                raise Error, _("Server doesn't support byte ranges")
+            contentrange = response.getheader("content-range", "")
+            if (not contentrange.startswith("bytes %d-" % segment.current) or
+                contentrange.split("/")[-1] not in (str(size), "*")):
+                raise Error, _("Server reports unexpected size")
+            local.seek(segment.current)
+            while segment.current < segment.end:
+                if self._cancel:
+                    raise FetcherCancelled
+                data = remote.read(min(BLOCKSIZE,
+                                       segment.end-segment.current))
+                if not data:
+                    raise Error, _("Connection closed by server")
+                local.write(data)
+                segment.current += len(data)
+                current = 0
+                for each in segments:
+                    current += each.current-each.start
+                item.progress(current, size)
+        finally:
+            remote.close()
+
 #Fetcher.setHandler("ftp", URLLIBHandler)
 Fetcher.setHandler("http", URLLIBHandler)
 Fetcher.setHandler("https", URLLIBHandler)
@@ -1418,6 +2163,9 @@ class URLLIB2Handler(FetcherHandler):
                     mtime = os.path.getmtime(localpath)
                     request.add_header("if-modified-since",
                                        rfc822.formatdate(mtime))
+                    etag = fetcher.getETag(localpath)
+                    if etag:
+                        request.add_header("if-none-match", etag)
 
                 localpathpart = localpath+".part"
                 if os.path.isfile(localpathpart):
@@ -1489,6 +2237,7 @@ class URLLIB2Handler(FetcherHandler):
                         fetchedsize = os.path.getsize(localpath)
                     else:
                         fetchedsize = None
+                    fetcher.setETag(item, localpath, info.get("etag"))
                     item.setSucceeded(localpath, fetchedsize)
 
                     if "last-modified" in info:
@@ -1540,7 +2289,7 @@ class PyCurlHandler(FetcherHandler):
 
         if not self._running and (self._queue or self._active):
             self._running = True
-            thread.start_new_thread(self.perform, ())
+            self.startThread(self.perform)
 
         fetcher = self._fetcher
         multi = self._multi
@@ -1592,6 +2341,7 @@ class PyCurlHandler(FetcherHandler):
                     mtime = handle.getinfo(pycurl.INFO_FILETIME)
                     if mtime != -1:
                         os.utime(localpath, (mtime, mtime))
+                    fetcher.setETag(item, localpath, handle.etag)
 
                 del self._active[handle]
                 userhost = (url.user, url.host, url.port)
@@ -1725,11 +2475,17 @@ class PyCurlHandler(FetcherHandler):
                         handle.setopt(pycurl.WRITEDATA, local)
                         handle.setopt(pycurl.FOLLOWLOCATION, 1)
                         handle.setopt(pycurl.MAXREDIRS, 5)
-                        handle.setopt(pycurl.HTTPHEADER, ["Pragma:"])
                         handle.setopt(pycurl.USERAGENT, "smart/" + VERSION)
                         handle.setopt(pycurl.FAILONERROR, 1)
 
+                        def header(line, handle=handle):
+                            if line[:5].lower() == "etag:":
+                                handle.etag = line[5:].strip()
+                        handle.etag = None
+                        handle.setopt(pycurl.HEADERFUNCTION, header)
+
                         # check if we have a valid local file and use I-M-S
+                        headers = ["Pragma:"]
                         if fetcher.validate(item, localpath):
                             handle.setopt(pycurl.TIMECONDITION,
                                           pycurl.TIMECONDITION_IFMODSINCE)
@@ -1737,10 +2493,14 @@ class PyCurlHandler(FetcherHandler):
                             if url.scheme == "ftp":
                                 mtime += 1 # libcurl handles ftp mtime wrongly
                             handle.setopt(pycurl.TIMEVALUE, int(mtime))
+                            etag = fetcher.getETag(localpath)
+                            if etag:
+                                headers.append("If-None-Match: "+etag)
                         else:
                             # reset the I-M-S option 
                             handle.setopt(pycurl.TIMECONDITION,
                                           pycurl.TIMECONDITION_NONE)
+                        handle.setopt(pycurl.HTTPHEADER, headers)
                                           
                         rate_limit = self._fetcher._maxdownloadrate
                         if rate_limit:
@@ -1758,12 +2518,17 @@ class PyCurlHandler(FetcherHandler):
         import pycurl
         multi = self._multi
         mp = pycurl.E_CALL_MULTI_PERFORM
+        running = 0
         while self._queue or self._active:
             self._lock.acquire()
             res = mp
             while res == mp:
                 res, num = multi.perform()
             self._lock.release()
+            if num < running:
+                # Transfers are done, and tick() must read them.
+                self._fetcher.wakeUp()
+            running = num
             multi.select(1.0)
         # Keep in mind that even though the while above has exited due to
         # self._active being False, it may actually be true *here* due to
@@ -1810,7 +2575,7 @@ class SCPHandler(FetcherHandler):
                         self._active.append(item)
                         item.total = None
                         item.localpath = None
-                        thread.start_new_thread(self.fetch, (item,))
+                        self.startThread(self.fetch, (item,))
         prog = iface.getSubProgress(self._fetcher)
         for item in self._active:
             if item.total and item.localpath:
@@ -25,6 +25,16 @@ import traceback
 class Hooks:
     def __init__(self):
         self._hook = {}
+        self._module = {}
+
+    def registerModule(self, hookname, modulename):
+        """Import the given module once the hook is first called, so
+        that it may register its hook functions only when needed."""
+        modules = self._module.get(hookname)
+        if not modules:
+            self._module[hookname] = [modulename]
+        elif modulename not in modules:
+            modules.append(modulename)
     
     def register(self, hookname, hookfunc, priority=500, threaded=0):
         metahookname = hookname+"-registered"
@@ -55,6 +65,9 @@ class Hooks:
         self._hook[hookname].remove((hookfunc,priority,threaded))
     
     def call(self, hookname, *hookparam, **hookkwparam):
+        if hookname in self._module:
+            for modulename in self._module.pop(hookname):
+                __import__(modulename)
         ret = []
         if hookname in self._hook:
             for hook in self._hook[hookname][:]:
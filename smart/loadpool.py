@@ -0,0 +1,235 @@
+#
+# Copyright (c) 2004 Conectiva, Inc.
+#
+# Written by Gustavo Niemeyer <niemeyer@conectiva.com>
+#
+# This file is part of Smart Package Manager.
+#
+# Smart Package Manager is free software; you can redistribute it and/or
+# modify it under the terms of the GNU General Public License as published
+# by the Free Software Foundation; either version 2 of the License, or (at
+# your option) any later version.
+#
+# Smart Package Manager is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the GNU
+# General Public License for more details.
+#
+# You should have received a copy of the GNU General Public License
+# along with Smart Package Manager; if not, write to the Free Software
+# Foundation, Inc., 59 Temple Place, Suite 330, Boston, MA  02111-1307  USA
+#
+from smart.interface import Interface
+from smart.progress import Progress
+from smart import *
+from cStringIO import StringIO
+import cPickle
+import time
+import os
+
+try:
+    import multiprocessing
+    import Queue
+except ImportError:
+    multiprocessing = None
+
+#
+# Loaders are run in forked worker processes, with a private cache.
+# Packages are sent back as buildPackage() argument tuples, and the
+# loader attributes, which may reference packages and relations, are
+# pickled with persistent ids pointing to them. The parent then calls
+# buildPackage() with the same arguments, so the result is the same
+# as if the loader had run in the parent.
+#
+
+# Set in the parent before forking, so that workers inherit them.
+_loaders = None
+_queue = None
+
+SHOWDELAY = 0.1
+
+class WorkerProgress(Progress):
+
+    def __init__(self, queue):
+        Progress.__init__(self)
+        self._queue = queue
+        self._pending = 0
+        self._lastsent = 0
+
+    def add(self, value):
+        self._pending += value
+
+    def show(self):
+        now = time.time()
+        if self._pending and self._lastsent < now-SHOWDELAY:
+            self.flush()
+            self._lastsent = now
+
+    def flush(self):
+        if self._pending:
+            self._queue.put(("progress", self._pending))
+            self._pending = 0
+
+class WorkerInterface(Interface):
+
+    def __init__(self, ctrl, queue):
+        Interface.__init__(self, ctrl)
+        self._queue = queue
+        self._progress = WorkerProgress(queue)
+
+    def getProgress(self, obj, hassub=False):
+        return self._progress
+
+    def getSubProgress(self, obj):
+        return self._progress
+
+    def message(self, level, msg):
+        self._queue.put(("message", level, msg))
+
+def _getArgs(relations):
+    return [x.getInitArgs() for x in relations]
+
+def _loadInWorker(index):
+    from smart.cache import Cache
+    loader = _loaders[index]
+    cache = Cache()
+    loader.setCache(cache)
+    workeriface = WorkerInterface(iface.getControl(), _queue)
+    iface.object = workeriface
+    try:
+        try:
+            loader.load()
+        except Error:
+            # Let the parent run it again and report the problem.
+            return None
+    finally:
+        workeriface._progress.flush()
+
+    pkgindex = {}
+    pkgs = []
+    for i, pkg in enumerate(loader._packages):
+        pkgindex[id(pkg)] = i
+        pkgs.append((pkg.getInitArgs(),
+                     _getArgs(pkg.provides), _getArgs(pkg.requires),
+                     _getArgs(pkg.upgrades), _getArgs(pkg.conflicts),
+                     _getArgs(pkg.recommends),
+                     pkg.essential, pkg.priority))
+    relindex = {}
+    for rels in (cache._provides, cache._requires, cache._upgrades,
+                 cache._conflicts, cache._recommends):
+        for rel in rels:
+            relindex[id(rel)] = rel
+
+    def persistentId(obj):
+        i = pkgindex.get(id(obj))
+        if i is not None:
+            return ("pkg", i)
+        if id(obj) in relindex:
+            return ("rel", obj.getInitArgs())
+        return None
+
+    state = loader.__dict__.copy()
+    for attr in ("_packages", "_cache", "_channel", "_installed"):
+        if attr in state:
+            del state[attr]
+    infos = [pkg.loaders.get(loader) for pkg in loader._packages]
+    file = StringIO()
+    pickler = cPickle.Pickler(file, 2)
+    pickler.persistent_id = persistentId
+    try:
+        pickler.dump((infos, state))
+    except (cPickle.PicklingError, TypeError):
+        # Can't be moved into the parent.
+        return None
+    return pkgs, file.getvalue()
+
+def _merge(cache, loader, result):
+    pkgs, data = result
+    built = []
+    for (pkgargs, prvargs, reqargs, upgargs, cnfargs, recargs,
+         essential, priority) in pkgs:
+        pkg = loader.buildPackage(pkgargs, prvargs, reqargs,
+                                  upgargs, cnfargs, recargs)
+        if essential:
+            pkg.essential = essential
+        if priority:
+            pkg.priority = priority
+        built.append(pkg)
+    objmap = cache._objmap
+
+    def persistentLoad(pid):
+        kind, value = pid
+        if kind == "pkg":
+            return built[value]
+        rel = objmap.get(value)
+        if rel is None:
+            rel = value[0](*value[1:])
+        return rel
+
+    unpickler = cPickle.Unpickler(StringIO(data))
+    unpickler.persistent_load = persistentLoad
+    infos, state = unpickler.load()
+    for pkg, info in zip(built, infos):
+        pkg.loaders[loader] = info
+    loader.__dict__.update(state)
+
+def _handleEvent(prog, timeout):
+    try:
+        event = _queue.get(timeout=timeout)
+    except Queue.Empty:
+        return False
+    if event[0] == "progress":
+        prog.add(event[1])
+        prog.show()
+    else:
+        iface.message(event[1], event[2])
+    return True
+
+def loadLoaders(cache, prog):
+    """
+    Run the load() method of loaders without packages in worker
+    processes, when the load-processes option allows it. Loaders which
+    can't be loaded that way are left alone, and will be loaded as
+    usual by Cache.load().
+    """
+    global _loaders, _queue
+    processes = sysconf.get("load-processes", 1)
+    loaders = [x for x in cache._loaders if not x._packages]
+    if (processes < 2 or len(loaders) < 2 or
+        multiprocessing is None or not hasattr(os, "fork")):
+        return
+    processes = min(processes, len(loaders))
+    iface.debug(_("Loading %d channels with %d processes") %
+                (len(loaders), processes))
+    _loaders = loaders
+    _queue = multiprocessing.Queue()
+    pool = multiprocessing.Pool(processes)
+    try:
+        pending = {}
+        for i in range(len(loaders)):
+            pending[i] = pool.apply_async(_loadInWorker, (i,))
+        pool.close()
+        while pending:
+            if _handleEvent(prog, SHOWDELAY):
+                continue
+            for i in pending.keys():
+                result = pending[i]
+                if not result.ready():
+                    continue
+                del pending[i]
+                try:
+                    result = result.get()
+                except Exception, e:
+                    iface.debug(_("Failed loading %s in worker: %s") %
+                                (loaders[i], e))
+                    continue
+                if result:
+                    _merge(cache, loaders[i], result)
+        pool.join()
+        while _handleEvent(prog, 0):
+            pass
+    finally:
+        pool.terminate()
+        _loaders = _queue = None
+
+# vim:ts=4:sw=4:et
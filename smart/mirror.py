@@ -21,21 +21,45 @@
 #
 from smart import *
 import random
+import math
 import time
 
-HISTORYPERMIRROR = 20
-HISTORYCUTDELAY = 60
-GRANULARITY = 100
+#
+# Mirrors are scored with exponentially weighted moving averages of
+# their throughput and latency, and with a count of failures which
+# decays with time, so that recent downloads matter the most. The
+# penality of a mirror is the estimated time, in milliseconds, to
+# fetch a file of REFERENCESIZE bytes from it. Mirrors with penalities
+# within SPREAD of each other are considered equal, so that load is
+# distributed among them.
+#
+
+WEIGHT = 0.3
+FAILUREHALFLIFE = 3600
+REFERENCESIZE = 100*1024
+SPREAD = 0.2
+PROBEDELAY = 24*3600
+
+def getAverage(average, value):
+    if average is None:
+        return value
+    return average+(value-average)*WEIGHT
+
+def getDecayed(failures, elapsed):
+    if not failures or elapsed <= 0:
+        return failures
+    return failures*0.5**(float(elapsed)/FAILUREHALFLIFE)
 
 class MirrorSystem(object):
 
     def __init__(self):
         self._mirrors = {}
-        self._history = []
+        # mirror -> (throughput, latency, failures, time, latency time)
+        self._scores = {}
         self._penality = {}
+        self._rank = {}
         self._changed = False
-        self._historychanged = False
-        self._lastcuttime = 0
+        self._scoreschanged = False
 
     def getMirrors(self):
         return self._mirrors
@@ -44,29 +68,52 @@ class MirrorSystem(object):
         self._changed = True
         self._mirrors = mirrors
 
-    def getHistory(self):
-        return self._history
+    def getScores(self):
+        return self._scores
 
-    def setHistory(self, history):
+    def setScores(self, scores):
         self._changed = True
-        self._history = history
-        self._historychanged = False
+        self._scores = scores.copy()
+        self._scoreschanged = False
+
+    def getScoresChanged(self):
+        return self._scoreschanged
 
-    def getHistoryChanged(self):
-        return self._historychanged
+    def addHistory(self, history):
+        """
+        Score mirrors with the download history kept by older versions,
+        which has the most recent information first.
+        """
+        for mirror, info in history[::-1]:
+            self.addInfo(mirror, **info)
 
     def addInfo(self, mirror, **info):
         if mirror:
-            self._changed = True
-            self._history.insert(0, (mirror, info))
-            self._historychanged = True
             now = time.time()
-            if now-self._lastcuttime > HISTORYCUTDELAY:
-                self._lastcuttime = now
-                count = 0
-                for origin in self._mirrors:
-                    count += 1+len(self._mirrors[origin])
-                del self._history[count*HISTORYPERMIRROR:]
+            throughput, latency, failures, updated, probed = \
+                self._scores.get(mirror, (None, None, 0, now, None))
+            failures = getDecayed(failures, now-updated)
+            failures += info.get("failed", 0)
+            size = info.get("size")
+            elapsed = info.get("time")
+            if size and elapsed:
+                throughput = getAverage(throughput, size/float(elapsed))
+            if info.get("latency") is not None:
+                latency = getAverage(latency, info["latency"])
+                probed = now
+            self._scores[mirror] = (throughput, latency, failures, now,
+                                    probed)
+            self._changed = True
+            self._scoreschanged = True
+
+    def needsProbe(self, mirror):
+        """
+        Return whether the latency of the given mirror is unknown or
+        wasn't measured for a while.
+        """
+        score = self._scores.get(mirror)
+        return (not score or score[1] is None or
+                score[4] < time.time()-PROBEDELAY)
 
     def get(self, url): 
         elements = {}
@@ -90,35 +137,44 @@ class MirrorSystem(object):
             return
         self._changed = False
         self._penality.clear()
-        data = {}
-        for mirror, info in self._history:
-            if mirror not in data:
-                mirrordata = data.setdefault(mirror, {"size": 0, "time": 0,
-                                                      "failed": 0})
-            else:
-                mirrordata = data[mirror]
-            mirrordata["size"] += info.get("size", 0)
-            mirrordata["time"] += info.get("time", 0)
-            mirrordata["failed"] += info.get("failed", 0)
-        maxpenality = 1
+        self._rank.clear()
+        now = time.time()
+        throughputs = [x[0] for x in self._scores.values() if x[0]]
+        if throughputs:
+            defaultthroughput = sum(throughputs)/len(throughputs)
+        else:
+            defaultthroughput = None
+        estimates = {}
         justerrors = []
-        for mirror in data:
-            mirrordata = data[mirror]
-            if mirrordata["size"]:
-                penality = (mirrordata["time"]*1000000)/mirrordata["size"]
-                penality += mirrordata["failed"]*(penality*0.1)
-                # Integer division by granularity ensures that mirrors
-                # which are close enough will be considered equal to
-                # distribute load.
-                penality /= GRANULARITY
-                self._penality[mirror] = penality
-                if penality > maxpenality:
-                    maxpenality = penality
-            elif mirrordata["failed"]:
-                justerrors.append(mirror)
-        if justerrors:
-            for mirror in justerrors:
-                self._penality[mirror] = maxpenality
+        for mirror, (throughput, latency, failures, updated, probed) \
+                in self._scores.items():
+            if throughput is None and latency is None:
+                if getDecayed(failures, now-updated) >= 0.5:
+                    justerrors.append(mirror)
+                continue
+            throughput = throughput or defaultthroughput
+            estimate = latency or 0
+            if throughput:
+                estimate += REFERENCESIZE/throughput
+            estimates[mirror] = estimate
+        if estimates:
+            maxestimate = max(estimates.values())
+        else:
+            maxestimate = 1
+        for mirror in justerrors:
+            estimates[mirror] = maxestimate
+        for mirror in estimates:
+            throughput, latency, failures, updated, probed = \
+                self._scores[mirror]
+            failures = getDecayed(failures, now-updated)
+            penality = int(estimates[mirror]*(1+failures)*1000)
+            self._penality[mirror] = penality
+            # Penalities within SPREAD of each other share the same rank.
+            if penality > 1:
+                self._rank[mirror] = int(math.log(penality)/
+                                         math.log(1+SPREAD))
+            else:
+                self._rank[mirror] = 0
 
 class MirrorElement(object):
 
@@ -136,8 +192,8 @@ class MirrorElement(object):
                   other.mirror.startswith("file://"))
         if rc == 0:
             # Otherwise, check penality.
-            pen = self._system._penality
-            rc = cmp(pen.get(self.mirror, 0), pen.get(other.mirror, 0))
+            rank = self._system._rank
+            rc = cmp(rank.get(self.mirror, 0), rank.get(other.mirror, 0))
         return rc
 
 class MirrorItem(object):
@@ -166,4 +222,36 @@ class MirrorItem(object):
             self._current = None
             return None
 
+    def getCandidates(self):
+        """
+        Return (mirror, url) tuples for the current mirror and for the
+        ones which were not tried yet.
+        """
+        elements = self._elements[:]
+        if self._current:
+            elements.append(self._current)
+        return [(elem.mirror, elem.mirror+self._url[len(elem.origin):])
+                for elem in elements if elem.mirror]
+
+    def rewind(self):
+        """
+        Choose the current mirror again, among the ones not tried yet,
+        and return its URL.
+        """
+        if self._current:
+            self._elements.append(self._current)
+        return self.getNext()
+
+    def getBest(self, count):
+        """
+        Return the URLs of up to count of the best mirrors which were
+        not tried yet, without changing the current one.
+        """
+        self._system.updatePenality()
+        elements = self._elements[:]
+        random.shuffle(elements)
+        elements.sort()
+        return [elem.mirror+self._url[len(elem.origin):]
+                for elem in elements[:count]]
+
 # vim:ts=4:sw=4:et
@@ -20,3 +20,17 @@
 # Foundation, Inc., 59 Temple Place, Suite 330, Boston, MA  02111-1307  USA
 #
 
+# Sysconf options enabling plugins, and their defaults. Plugins listed
+# here are only imported when their option is set, while any other
+# plugin is always imported.
+OPTIONS = {
+    "aptchannelsync":   ("sync-apt-sources", False),
+    "debdir":           ("deb-dir", None),
+    "detectsys":        ("detect-sys-channels", True),
+    "landscape":        ("use-landscape-proxies", False),
+    "rpmdir":           ("rpm-dir", None),
+    "urpmichannelsync": ("sync-urpmi-medialist", False),
+    "yumchannelsync":   ("sync-yum-repos", False),
+    "zyppchannelsync":  ("sync-zypp-repos", False),
+}
+
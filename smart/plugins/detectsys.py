@@ -20,7 +20,7 @@
 # Foundation, Inc., 59 Temple Place, Suite 330, Boston, MA  02111-1307  USA
 #
 from smart import *
-from smart.backends.rpm.base import rpm_join_dbpath
+from smart.backends.rpm import rpm_join_dbpath
 import os
 
 def detectRPMSystem():
@@ -20,6 +20,7 @@
 # Foundation, Inc., 59 Temple Place, Suite 330, Boston, MA  02111-1307  USA
 #
 from smart.util.strtools import globdistance
+from smart.searchindex import getPatternWords
 from smart.cache import Provides
 from smart import *
 import fnmatch
@@ -71,6 +72,7 @@ class Searcher(object):
         self.summary = []
         self.description = []
         self.ignorecase = True
+        self._patternwords = {}
 
     def reset(self):
         self._results.clear()
@@ -85,6 +87,7 @@ class Searcher(object):
         del self.group[:]
         del self.summary[:]
         del self.description[:]
+        self._patternwords.clear()
 
     def addResult(self, obj, ratio=1.0):
         results = self._results
@@ -200,6 +203,9 @@ class Searcher(object):
         return bool(self.group or self.path or self.url or
                     self.summary or self.description)
 
+    def getPatternWords(self, pattern):
+        return self._patternwords.get(pattern, [])
+
     def addPath(self, s, cutoff=1.0):
         self.path.append((s, cutoff))
 
@@ -207,16 +213,22 @@ class Searcher(object):
         self.url.append((s, cutoff))
 
     def addGroup(self, s):
+        words = getPatternWords(s)
         s = _stripeol(fnmatch.translate(s)).replace("\ ", " ")
         p = re.compile("\s+".join(s.split()), self.ignorecase and re.I or 0)
+        self._patternwords[p] = words
         self.group.append(p)
 
     def addSummary(self, s):
+        words = getPatternWords(s)
         s = _stripeol(fnmatch.translate(s)).replace("\ ", " ")
         p = re.compile("\s+".join(s.split()), self.ignorecase and re.I or 0)
+        self._patternwords[p] = words
         self.summary.append(p)
 
     def addDescription(self, s):
+        words = getPatternWords(s)
         s = _stripeol(fnmatch.translate(s)).replace("\ ", " ")
         p = re.compile("\s+".join(s.split()), self.ignorecase and re.I or 0)
+        self._patternwords[p] = words
         self.description.append(p)
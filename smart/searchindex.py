@@ -0,0 +1,319 @@
+#
+# Copyright (c) 2005 Canonical
+#
+# Written by Gustavo Niemeyer <niemeyer@conectiva.com>
+#
+# This file is part of Smart Package Manager.
+#
+# Smart Package Manager is free software; you can redistribute it and/or
+# modify it under the terms of the GNU General Public License as published
+# by the Free Software Foundation; either version 2 of the License, or (at
+# your option) any later version.
+#
+# Smart Package Manager is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the GNU
+# General Public License for more details.
+#
+# You should have received a copy of the GNU General Public License
+# along with Smart Package Manager; if not, write to the Free Software
+# Foundation, Inc., 59 Temple Place, Suite 330, Boston, MA  02111-1307  USA
+#
+from smart import *
+from array import array
+from bisect import bisect
+import re
+
+#
+# Each loader may have a SearchIndex, mapping the words found in the
+# group, summary and description of its packages to the packages
+# themselves. The index is kept in the loader, and so is saved with
+# it in the cache. When searching, words which must be present for a
+# pattern to match select the candidate packages, and these are then
+# checked against the patterns as usual.
+#
+# Loaders may also have a NameIndex, mapping the character bigrams of
+# the names of their packages and provides to the names themselves.
+# Every string compared by the search() method of packages and provides
+# starts with their name, so a name can only be close enough to a
+# pattern if most of its bigrams are found in the pattern. Only names
+# passing that test have their packages and provides searched.
+#
+
+_wordre = re.compile(r"\w+")
+_globre = re.compile(r"\[[^]]*\]|[*?]")
+
+def getWords(text):
+    return _wordre.findall(text.lower())
+
+def getPatternWords(pattern):
+    """
+    Return the words which must be found, possibly as part of longer
+    words, in any text matched by the given glob pattern.
+    """
+    return getWords(_globre.sub(" ", pattern))
+
+class PackageIndex(object):
+
+    def __init__(self, packages=()):
+        self._packages = list(packages)
+
+    def isValid(self, packages):
+        # Packages are built again whenever the loader is reloaded.
+        indexed = self._packages
+        return (len(packages) == len(indexed) and
+                (not packages or (packages[0] is indexed[0] and
+                                  packages[-1] is indexed[-1])))
+
+class SearchIndex(PackageIndex):
+
+    def __init__(self, packages=()):
+        PackageIndex.__init__(self, packages)
+        self._words = {}
+        self._vocabulary = None
+
+    def __getstate__(self):
+        return (self._packages, self._words)
+
+    def __setstate__(self, state):
+        self._packages, self._words = state
+        self._vocabulary = None
+
+    def build(self, loader):
+        words = {}
+        for i, pkg in enumerate(self._packages):
+            info = loader.getInfo(pkg)
+            text = " ".join([info.getGroup() or "",
+                             info.getSummary() or "",
+                             info.getDescription() or ""])
+            for word in dict.fromkeys(getWords(text)):
+                lst = words.get(word)
+                if lst is None:
+                    words[word] = array("i", [i])
+                else:
+                    lst.append(i)
+        # Packed strings are much cheaper to pickle than arrays.
+        for word in words:
+            words[word] = words[word].tostring()
+        self._words = words
+        self._vocabulary = None
+
+    def getCandidates(self, patternwords):
+        """
+        Return the packages which may match any of the patterns whose
+        words are given, or None if all of them may match.
+        """
+        vocabulary = self._vocabulary
+        if vocabulary is None:
+            # All indexed words, one per line, so that words containing
+            # a pattern word are found with a single scan.
+            vocabulary = "\n"+"\n".join(self._words)+"\n"
+            self._vocabulary = vocabulary
+        indexedwords = self._words
+        result = set()
+        for words in patternwords:
+            if not words:
+                return None
+            candidates = None
+            for word in words:
+                indexes = set()
+                pos = vocabulary.find(word)
+                while pos != -1:
+                    start = vocabulary.rfind("\n", 0, pos)+1
+                    end = vocabulary.find("\n", pos)
+                    indexed = indexedwords[vocabulary[start:end]]
+                    indexes.update(array("i", indexed))
+                    pos = vocabulary.find(word, end)
+                if candidates is None:
+                    candidates = indexes
+                else:
+                    candidates &= indexes
+                if not candidates:
+                    break
+            result |= candidates
+        result = list(result)
+        result.sort()
+        packages = self._packages
+        return [packages[i] for i in result]
+
+def getBigrams(name):
+    name = "^"+name.lower()
+    return dict.fromkeys([name[i:i+2] for i in range(len(name)-1)]).keys()
+
+def getMaxDistance(pattern, cutoff):
+    """
+    Return the maximum edit distance between the given pattern and
+    a string which globdistance() may accept with the given cutoff,
+    or None if there's no useful limit.
+    """
+    if "*" in pattern or "?" in pattern or len(pattern) > 1024:
+        return None
+    if type(cutoff) is int:
+        return cutoff
+    if not cutoff or cutoff <= 0:
+        return None
+    # Strings longer than len(pattern)/cutoff are always too distant.
+    return int((1-cutoff)*len(pattern)/cutoff+0.001)
+
+class NameIndex(PackageIndex):
+
+    def __init__(self, packages=()):
+        PackageIndex.__init__(self, packages)
+        self._names = []
+        self._counts = array("i")
+        self._bigrams = {}
+
+    def __getstate__(self):
+        return (self._packages, self._names, self._counts, self._bigrams)
+
+    def __setstate__(self, state):
+        (self._packages, self._names,
+         self._counts, self._bigrams) = state
+
+    def build(self):
+        names = {}
+        for pkg in self._packages:
+            names[pkg.name] = True
+            for prv in pkg.provides:
+                names[prv.name] = True
+        # Names are sorted by their number of bigrams, so that the
+        # ones with few of them may be taken in a single slice.
+        names = [(len(x), name, x) for name, x in
+                 [(name, getBigrams(name)) for name in names]]
+        names.sort()
+        bigrams = {}
+        for i, (count, name, namebigrams) in enumerate(names):
+            for bigram in namebigrams:
+                lst = bigrams.get(bigram)
+                if lst is None:
+                    bigrams[bigram] = [i]
+                else:
+                    lst.append(i)
+        for bigram in bigrams:
+            bigrams[bigram] = array("i", bigrams[bigram]).tostring()
+        self._names = [x[1] for x in names]
+        self._counts = array("i", [x[0] for x in names])
+        self._bigrams = bigrams
+
+    def getCandidates(self, pattern, maxdistance):
+        """
+        Return the names which may start a string within the given
+        edit distance from the pattern, or None if too many of them
+        may.
+        """
+        # Each edit changes at most two bigrams of the name, and the
+        # name can't be longer than the pattern plus the edits.
+        maxchanged = maxdistance*2
+        maxlen = len(pattern)+maxdistance
+        names = self._names
+        counts = self._counts
+        first = bisect(counts, maxchanged)
+        if first > len(names)/2:
+            return None
+        result = [x for x in names[:first] if len(x) <= maxlen]
+        shared = {}
+        for bigram in getBigrams(pattern):
+            data = self._bigrams.get(bigram)
+            if data:
+                data = array("i", data)
+                for i in data[bisect(data, first-1):]:
+                    shared[i] = shared.get(i, 0)+1
+        for i, count in shared.iteritems():
+            if count >= counts[i]-maxchanged and len(names[i]) <= maxlen:
+                result.append(names[i])
+        return result
+
+def buildSearchIndexes(cache):
+    if not sysconf.get("search-index", False):
+        return
+    for loader in cache._loaders:
+        index = getattr(loader, "_searchindex", None)
+        if index and index.isValid(loader._packages):
+            continue
+        iface.debug(_("Building search index for %s") % loader)
+        index = SearchIndex(loader._packages)
+        index.build(loader)
+        loader._searchindex = index
+        index = NameIndex(loader._packages)
+        index.build()
+        loader._nameindex = index
+        loader._cachechanged = True
+
+hooks.register("cache-loaded", buildSearchIndexes)
+
+def getNameCandidates(cache, patterns):
+    """
+    Return the set of names which may be matched by the given
+    (pattern, cutoff) tuples, or None if any name may be matched.
+    """
+    indexes = []
+    for loader in cache._loaders:
+        index = getattr(loader, "_nameindex", None)
+        if not index or not index.isValid(loader._packages):
+            return None
+        indexes.append(index)
+    names = {}
+    for pattern, cutoff in patterns:
+        maxdistance = getMaxDistance(pattern, cutoff)
+        if maxdistance is None:
+            return None
+        for index in indexes:
+            candidates = index.getCandidates(pattern, maxdistance)
+            if candidates is None:
+                return None
+            names.update(dict.fromkeys(candidates))
+    return names
+
+def searchNames(cache, searcher):
+    """
+    Search for package names and provides, using the name index of
+    loaders when possible.
+    """
+    if searcher.nameversion:
+        names = getNameCandidates(cache, searcher.nameversion)
+        for pkg in cache._packages:
+            if names is None or pkg.name in names:
+                pkg.search(searcher)
+    if searcher.provides:
+        names = getNameCandidates(cache, searcher.provides)
+        for prv in cache._provides:
+            if names is None or prv.name in names:
+                prv.search(searcher)
+
+def searchLoaders(cache, searcher):
+    """
+    Search in the package information of all loaders, using their
+    search index when possible.
+    """
+    patternwords = None
+    if not (searcher.url or searcher.path):
+        patternwords = []
+        for pattern in searcher.group+searcher.summary+searcher.description:
+            patternwords.append(searcher.getPatternWords(pattern))
+    for loader in cache._loaders:
+        index = getattr(loader, "_searchindex", None)
+        if (patternwords is None or not index or
+            not index.isValid(loader._packages)):
+            loader.search(searcher)
+            continue
+        candidates = index.getCandidates(patternwords)
+        if candidates is None:
+            loader.search(searcher)
+            continue
+        for pkg in candidates:
+            info = loader.getInfo(pkg)
+            for patterns, text in ((searcher.group, info.getGroup),
+                                   (searcher.summary, info.getSummary),
+                                   (searcher.description,
+                                    info.getDescription)):
+                if patterns:
+                    text = text() or ""
+                    for pat in patterns:
+                        if pat.search(text):
+                            break
+                    else:
+                        continue
+                    searcher.addResult(pkg, 1)
+                    break
+
+# vim:ts=4:sw=4:et
@@ -41,6 +41,8 @@ if sys.version_info < (2, 4):
     __builtins__['sorted'] = sorted
 
 
+_nothing = object()
+
 class DisableError(Error):
     """Raised on a request to break a non-existent or unbreakable relation."""
 
@@ -48,6 +50,120 @@ class EnableError(Error):
     """Raised on a request to enable a non-disabled relation."""
 
 
+def getStronglyConnected(successors, ignore=None):
+    """Return the strongly connected components of a graph.
+
+    The graph is given as a dictionary mapping elements to their
+    successors, and the components are returned as lists of elements,
+    successors before their predecessors. The C{ignore} relation, if
+    given, isn't followed. This is an iterative version of Tarjan's
+    algorithm, so deep graphs don't exhaust the stack.
+    """
+    # Elements already in a component get the highest index, so that
+    # they never lower the link of others.
+    done = sys.maxint
+    ignorepred, ignoresucc = ignore or (_nothing, _nothing)
+    index = {}
+    lowlink = {}
+    stack = []
+    components = []
+    for root in successors:
+        if root in index:
+            continue
+        index[root] = lowlink[root] = len(index)
+        stack.append(root)
+        work = [(root, iter(successors[root]))]
+        while work:
+            elem, succs = work[-1]
+            for succ in succs:
+                if succ not in index:
+                    if succ == ignoresucc and elem == ignorepred:
+                        continue
+                    index[succ] = lowlink[succ] = len(index)
+                    stack.append(succ)
+                    work.append((succ, iter(successors.get(succ, ()))))
+                    break
+                elif index[succ] < lowlink[elem]:
+                    if succ == ignoresucc and elem == ignorepred:
+                        continue
+                    lowlink[elem] = index[succ]
+            else:
+                work.pop()
+                if work:
+                    pred = work[-1][0]
+                    if lowlink[elem] < lowlink[pred]:
+                        lowlink[pred] = lowlink[elem]
+                if lowlink[elem] == index[elem]:
+                    component = []
+                    while True:
+                        member = stack.pop()
+                        index[member] = done
+                        component.append(member)
+                        if member is elem:
+                            break
+                    components.append(component)
+    return components
+
+def findLoops(successors, ignore=None):
+    """Return the loops in a graph.
+
+    The graph is given as for L{getStronglyConnected()}, and the result
+    is a list of (elements, relations) tuples of sets, one for each
+    strongly connected component with a loop in it.
+    """
+    loops = []
+    for component in getStronglyConnected(successors, ignore):
+        if len(component) == 1:
+            elem = component[0]
+            if (elem not in successors.get(elem, ()) or
+                (elem, elem) == ignore):
+                continue
+        elements = set(component)
+        relations = set()
+        for pred in component:
+            for succ in successors.get(pred, ()):
+                if succ in elements:
+                    relations.add((pred, succ))
+        if ignore in relations:
+            relations.remove(ignore)
+        if relations:
+            loops.append((elements, relations))
+    return loops
+
+def getSuccessors(relations):
+    successors = {}
+    for pred, succ in relations:
+        lst = successors.get(pred)
+        if lst is None:
+            successors[pred] = [succ]
+        else:
+            lst.append(succ)
+    return successors
+
+def isReachable(start, end, successors, ignore=None):
+    """Return whether C{end} may be reached from C{start}.
+
+    The successors dictionary maps elements to their successors, and
+    the C{ignore} relation, if given, isn't followed.
+    """
+    if start == end:
+        return True
+    ignorepred, ignoresucc = ignore or (_nothing, _nothing)
+    seen = set([start])
+    todo = [start]
+    while todo:
+        elem = todo.pop()
+        for succ in successors.get(elem, ()):
+            if succ not in seen:
+                if succ == ignoresucc and elem == ignorepred:
+                    continue
+                if succ == end:
+                    return True
+                seen.add(succ)
+                todo.append(succ)
+    return False
+
+
 class ElementGroup(object):
 
     def __init__(self):
@@ -140,26 +256,14 @@ class ElementSorter(object):
         The result is the same as for L{getPathData()}, except that only
         elements and relations involved in loops will be returned.
         """
-        all_loop_elements = set()
-        loops = []
-        for elem in self._successors:
-            if elem not in all_loop_elements:
-                loop_elements, loop_relations = self.getPathData(elem, elem)
-                if loop_elements:
-                    done = set([elem])
-                    todo = loop_elements - done
-                    while todo:
-                        loop_elem = todo.pop()
-                        more_elements, more_relations = \
-                            self.getPathData(loop_elem, loop_elem)
-                        loop_elements.update(more_elements)
-                        loop_relations.update(more_relations)
-                        done.add(loop_elem)
-                        more_elements.difference_update(done)
-                        todo.update(more_elements)
-                    loops.append((loop_elements, loop_relations))
-                    all_loop_elements.update(loop_elements)
-        return loops
+        successors = self._successors
+        if self._disabled:
+            disabled = self._disabled
+            successors = {}
+            for pred in self._successors:
+                successors[pred] = [succ for succ in self._successors[pred]
+                                    if (pred, succ) not in disabled]
+        return findLoops(successors)
 
     def hasLoop(self, elements, relations):
         for elem in elements:
@@ -169,38 +273,82 @@ class ElementSorter(object):
         return False
 
     def countRelationsInLoop(self, elements, relations, maximum_priority=None):
+        priorities = self._priorities
+        disabled = self._disabled
+        elements = set(elements)
+        loops = findLoops(getSuccessors([x for x in relations
+                                         if x not in disabled and
+                                         (maximum_priority is None or
+                                          priorities[x] <= maximum_priority)]))
         loop_relations = 0
-        loop_elements = set()
-        for elem in elements:
-            if elem not in loop_elements:
-                data = self.getPathData(elem, elem,
-                                        follow_relations=relations,
-                                        maximum_priority=maximum_priority)
-                if data[0]:
-                    loop_elements.update(data[0])
-                    loop_relations += len(data[1])
+        for loop_elements, relations in loops:
+            if loop_elements & elements:
+                loop_relations += len(relations)
         return loop_relations
 
     def _getReenableOrder(self, elements, relations):
-        follow_relations = set(relations)
+        # Now we're going to produce the tuple which will be used to
+        # sort each relation.  If the priority of a relation is 1, and
+        # if we disable this relation we'll still have 5 other relations
+        # in the loop when considering only relatins of priority 0 in the
+        # loop, and also 4 relations when considering 0, 1, and 2, and the
+        # maximum priority number for all the relations this sorter knows
+        # about is 3, we want a tuple such as (1, -5, 0, -4, -4).
+        #
+        # The loops of each priority level are found once. Disabling a
+        # relation only changes the loop it's in, and only if its
+        # successor can't be reached from its predecessor through the
+        # other relations of the loop. In that case the loop is split
+        # again without the relation, unless it's a simple cycle, with
+        # as many relations as elements, which is then gone. Relations
+        # chained through elements with a single predecessor and a
+        # single successor are in the same cycles, so disabling any of
+        # them has the same effect.
+        priorities = self._priorities
         sort_key = {}
         for relation in relations:
-            # Now we're going to produce the tuple which will be used to
-            # sort this specific relation.  If the priority of this relation
-            # is 1, and if we disable this relation we'll still have 5 other
-            # relations in the loop when considering only relatins of
-            # priority 0 in the loop, and also 4 relations when considering
-            # 0, 1, and 2, and the maximum priority number for all the
-            # relations this sorter knows about is 3, we want a tuple such
-            # as (1, -5, 0, -4, -4).
-            follow_relations.remove(relation)
-            sort_tuple = [self._priorities[relation]]
-            for priority in range(self._maximum_priority + 1):
-                sort_tuple.append(-self.countRelationsInLoop(elements,
-                                                             follow_relations,
-                                                             priority))
-            sort_key[relation] = tuple(sort_tuple)
-            follow_relations.add(relation)
+            sort_key[relation] = [priorities[relation]]
+        for priority in range(self._maximum_priority + 1):
+            loops = findLoops(getSuccessors([x for x in relations
+                                             if priorities[x] <= priority]))
+            total = 0
+            for loop_elements, loop_relations in loops:
+                total += len(loop_relations)
+            for relation in relations:
+                sort_key[relation].append(-total)
+            for loop_elements, loop_relations in loops:
+                if len(loop_relations) == len(loop_elements):
+                    for relation in loop_relations:
+                        sort_key[relation][-1] = len(loop_relations)-total
+                    continue
+                successors = getSuccessors(loop_relations)
+                predecessors = getSuccessors([(succ, pred) for pred, succ
+                                              in loop_relations])
+                def isChained(elem):
+                    return (len(successors[elem]) == 1 and
+                            len(predecessors[elem]) == 1)
+                done = set()
+                for relation in loop_relations:
+                    if relation in done:
+                        continue
+                    pred, succ = relation
+                    count = total-1
+                    if not isReachable(pred, succ, successors, relation):
+                        count -= len(loop_relations)-1
+                        for x in findLoops(successors, relation):
+                            count += len(x[1])
+                    chain = [relation]
+                    while isChained(succ):
+                        chain.append((succ, successors[succ][0]))
+                        succ = successors[succ][0]
+                    while isChained(pred):
+                        chain.append((predecessors[pred][0], pred))
+                        pred = predecessors[pred][0]
+                    for chained in chain:
+                        sort_key[chained][-1] = -count
+                        done.add(chained)
+        for relation in relations:
+            sort_key[relation] = tuple(sort_key[relation])
         return sorted(relations, key=sort_key.get)
 
     def breakLoops(self):
@@ -227,14 +375,13 @@ class ElementSorter(object):
             # order which gives precedence for relations with higher
             # priority, and for relations that are unlikely to
             # recreate big loops.
+            successors = {}
             for relation in reenable_order:
                 if relation in self._disabled:
                     pred, succ = relation
-                    elements, relations = \
-                        self.getPathData(succ, pred,
-                                         follow_relations=loop_relations)
-                    if not elements:
+                    if not isReachable(succ, pred, successors):
                         self.enableRelation(relation)
+                        successors.setdefault(pred, []).append(succ)
 
     def addElement(self, elem):
         if elem not in self._successors:
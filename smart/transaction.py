@@ -21,7 +21,9 @@
 #
 from smart.const import INSTALL, REMOVE, UPGRADE, FIX, REINSTALL, KEEP, LOCKED_EXCLUDE, LOCKED_INSTALL, LOCKED_CONFLICT, LOCKED_CONFLICT_BY, LOCKED_NO_COEXIST, LOCKED_SYSCONF, LOCKED_REMOVE
 from smart.cache import PreRequires, Package
+from smart.util.objdigest import getObjectDigest
 from smart import *
+import itertools
 
 def lock_reason(pkg, lockvalue):
     try:
@@ -46,7 +48,117 @@ def lock_reason(pkg, lockvalue):
     else:
         return _("%s is locked (unknown reason)") % pkg
 
-class ChangeSet(dict):
+class JournalDict(dict):
+    """
+    Dictionary which may be forked, so that changes made after that
+    point may be collected and rolled back, without copying it. None
+    is not a valid value, since it is used to mark removed keys.
+    """
+
+    _journal = None
+    _forkversions = None
+    _version = None
+    _versions = itertools.count(1)
+
+    def __setitem__(self, key, value):
+        if self._journal is not None:
+            self._journal.append(self._getUndo(key))
+        self._store(key, value)
+
+    def __delitem__(self, key):
+        if key not in self:
+            raise KeyError, key
+        if self._journal is not None:
+            self._journal.append(self._getUndo(key))
+        self._store(key, None)
+
+    def clear(self):
+        if self._journal is not None:
+            for key in self.keys():
+                del self[key]
+        else:
+            dict.clear(self)
+            self._version = None
+
+    def update(self, other):
+        if self._journal is not None:
+            for key in other:
+                self[key] = other[key]
+        else:
+            dict.update(self, other)
+            self._version = None
+
+    def copy(self):
+        return self.__class__(self)
+
+    def _store(self, key, value):
+        self._version = None
+        if value is None:
+            if key in self:
+                dict.__delitem__(self, key)
+        else:
+            dict.__setitem__(self, key, value)
+
+    def _getUndo(self, key):
+        return (key, self.get(key))
+
+    def _undo(self, entry):
+        self._store(*entry)
+
+    def getVersion(self):
+        """
+        Return a number identifying the current contents. A new one is
+        used after every change, and the one from the mark is restored
+        by rollback(), so equal versions always mean equal contents.
+        """
+        if self._version is None:
+            self._version = self._versions.next()
+        return self._version
+
+    def fork(self):
+        """
+        Start collecting changes, and return a mark which may be given
+        to getChanges() and rollback(). Every fork must be ended by
+        rolling it back.
+        """
+        if self._journal is None:
+            self._journal = []
+            self._forkversions = []
+        self._forkversions.append(self.getVersion())
+        return len(self._journal)
+
+    def getChanges(self, mark):
+        """
+        Return a dictionary with the current value of every key changed
+        since the given mark, or None for removed keys.
+        """
+        changes = {}
+        for entry in self._journal[mark:]:
+            key = entry[0]
+            changes[key] = self.get(key)
+        return changes
+
+    def setChanges(self, changes):
+        for key, value in changes.iteritems():
+            if value is not None:
+                self[key] = value
+            elif key in self:
+                del self[key]
+
+    def rollback(self, mark):
+        """
+        Undo every change made since the given mark was obtained.
+        """
+        journal = self._journal
+        while len(journal) > mark:
+            self._undo(journal.pop())
+        self._version = self._forkversions.pop()
+        if not self._forkversions:
+            self._journal = None
+
+class ChangeSet(JournalDict):
+
+    _weight = None
 
     def __init__(self, cache, state=None, requested=None):
         self._cache = cache
@@ -57,20 +169,54 @@ class ChangeSet(dict):
             self._requested.update(requested)
 
     def clear(self):
-        dict.clear(self)
+        JournalDict.clear(self)
         self._requested.clear()
+        if self._weight is not None:
+            self._weight.reset(self)
 
     def update(self, other):
-        dict.update(self, other)
+        JournalDict.update(self, other)
         if type(other) is ChangeSet:
             self._requested.update(other._requested)
+        if self._weight is not None:
+            self._weight.reset(self)
 
     def copy(self):
         return ChangeSet(self._cache, self, self._requested)
 
+    def _store(self, pkg, op):
+        JournalDict._store(self, pkg, op)
+        if self._weight is not None:
+            self._weight.changed(self, pkg)
+
+    def _getUndo(self, pkg):
+        return (pkg, self.get(pkg), pkg in self._requested)
+
+    def _undo(self, entry):
+        pkg, op, requested = entry
+        self._store(pkg, op)
+        if requested:
+            self._requested[pkg] = True
+        elif pkg in self._requested:
+            del self._requested[pkg]
+
+    def setChanges(self, changes):
+        JournalDict.setChanges(self, changes)
+        for pkg in changes:
+            if pkg not in self and pkg in self._requested:
+                del self._requested[pkg]
+
     def getCache(self):
         return self._cache
 
+    def getIncrementalWeight(self):
+        return self._weight
+
+    def setIncrementalWeight(self, weight):
+        self._weight = weight
+        if weight is not None:
+            weight.reset(self)
+
     def getState(self):
         return (self.copy(), self._requested.copy())
 
@@ -141,6 +287,9 @@ class ChangeSet(dict):
 
     def setRequested(self, pkg, flag):
         assert pkg in self
+        if self._journal is not None:
+            self._journal.append(self._getUndo(pkg))
+        self._version = None
         if flag:
             self._requested[pkg] = True
         elif pkg in self._requested:
@@ -196,6 +345,47 @@ class ChangeSet(dict):
             l.append("%s %s\n" % (self[pkg] is INSTALL and "I" or "R", pkg))
         return "".join(l)
 
+class IncrementalWeight(object):
+    """
+    Weight given by a policy to a changeset, kept up to date as the
+    changeset is changed, instead of computed again for every
+    alternative the solver compares. The weight is the sum of terms
+    given by the policy for individual packages, and only the terms
+    of packages depending on a changed one are computed again.
+
+    The policy must provide getWeightTerm(changeset, pkg), returning
+    the term of the given package, and getWeightDependents(pkg),
+    returning the packages whose terms may change when the given
+    package is changed, including the package itself.
+    """
+
+    def __init__(self, policy):
+        self._policy = policy
+        self._terms = {}
+        self._weight = 0
+
+    def getWeight(self):
+        return self._weight
+
+    def reset(self, changeset):
+        self._terms.clear()
+        self._weight = 0
+        for pkg in changeset:
+            self.changed(changeset, pkg)
+
+    def changed(self, changeset, pkg):
+        terms = self._terms
+        getterm = self._policy.getWeightTerm
+        for deppkg in self._policy.getWeightDependents(pkg):
+            term = getterm(changeset, deppkg)
+            old = terms.get(deppkg, 0)
+            if term != old:
+                self._weight += term-old
+                if term:
+                    terms[deppkg] = term
+                else:
+                    del terms[deppkg]
+
 class Policy(object):
 
     def __init__(self, trans):
@@ -238,6 +428,15 @@ class Policy(object):
     def getWeight(self, changeset):
         return 0
 
+    def getIncrementalWeight(self):
+        """
+        Return an IncrementalWeight for this policy, or None if its
+        weights must be computed with getWeight() every time. Policies
+        returning one must return None as well when a subclass gives
+        its own getWeight(), which the weight terms wouldn't follow.
+        """
+        return None
+
     def getPriority(self, pkg):
         priority = self._priorities.get(pkg)
         if priority is None:
@@ -264,6 +463,7 @@ class PolicyInstall(Policy):
         self._upgrading = upgrading = {}
         self._upgraded = upgraded = {}
         self._downgraded = downgraded = {}
+        self._dependents = dependents = {}
         for pkg in self._trans.getCache().getPackages():
             # Precompute upgrade relations.
             for upg in pkg.upgrades:
@@ -282,6 +482,7 @@ class PolicyInstall(Policy):
                                     downgraded[prvpkg].append(pkg)
                                 else:
                                     downgraded[prvpkg] = [pkg]
+                            dependents.setdefault(pkg, []).append(prvpkg)
             # Downgrades are upgrades if they have a higher priority.
             for prv in pkg.provides:
                 for upg in prv.upgradedby:
@@ -299,12 +500,39 @@ class PolicyInstall(Policy):
                                     downgraded[upgpkg].append(pkg)
                                 else:
                                     downgraded[upgpkg] = [pkg]
+                            dependents.setdefault(pkg, []).append(upgpkg)
 
     def runFinished(self):
         Policy.runFinished(self)
         del self._upgrading
         del self._upgraded
         del self._downgraded
+        del self._dependents
+
+    def getIncrementalWeight(self):
+        if type(self).getWeight.im_func is PolicyInstall.getWeight.im_func:
+            return IncrementalWeight(self)
+        return None
+
+    def getWeightTerm(self, changeset, pkg):
+        op = changeset.get(pkg)
+        if op is REMOVE:
+            for upgpkg in self._upgraded.get(pkg, ()):
+                if changeset.get(upgpkg) is INSTALL:
+                    return -1
+            for dwnpkg in self._downgraded.get(pkg, ()):
+                if changeset.get(dwnpkg) is INSTALL:
+                    return 15
+            return 20
+        elif op is INSTALL:
+            if pkg in self._upgrading:
+                return 2
+            return 3
+        return 0
+
+    def getWeightDependents(self, pkg):
+        # Removed packages depend on their upgrades and downgrades.
+        return [pkg]+self._dependents.get(pkg, [])
 
     def getWeight(self, changeset):
         weight = 0
@@ -337,6 +565,22 @@ class PolicyInstall(Policy):
 class PolicyRemove(Policy):
     """Give precedence to the choice with less changes."""
 
+    def getIncrementalWeight(self):
+        if type(self).getWeight.im_func is PolicyRemove.getWeight.im_func:
+            return IncrementalWeight(self)
+        return None
+
+    def getWeightTerm(self, changeset, pkg):
+        op = changeset.get(pkg)
+        if op is REMOVE:
+            return 1
+        elif op is INSTALL:
+            return 5
+        return 0
+
+    def getWeightDependents(self, pkg):
+        return (pkg,)
+
     def getWeight(self, changeset):
         weight = 0
         for pkg in changeset:
@@ -351,11 +595,50 @@ class PolicyUpgrade(Policy):
 
     def runStarting(self):
         Policy.runStarting(self)
-        self._upgrading = upgrading = {}
-        self._upgraded = upgraded = {}
-        self._sortbonus = sortbonus = {}
-        self._stablebonus = stablebonus = {}
-        queue = self._trans.getQueue()
+        self._sortbonus = {}
+        cache = self._trans.getCache()
+        key = self.getUpgradeRelationsKey()
+        relations = cache.getUpgradeRelations()
+        if not (relations and relations.getKey() == key and
+                relations.resolve(cache)):
+            relations = self.computeUpgradeRelations(key)
+            cache.setUpgradeRelations(relations)
+        self._upgrading = relations.upgrading
+        self._upgraded = relations.upgraded
+        self._stablebonus = relations.stablebonus
+        self._bonusdependents = bonusdependents = {}
+        for bonuspkg, lst in self._stablebonus.iteritems():
+            for bonusvalue, bonusdeps in lst:
+                for deppkg in bonusdeps:
+                    bonusdependents.setdefault(deppkg, {})[bonuspkg] = True
+
+        pkgs = self._trans._queue.keys()
+        sortUpgrades(pkgs, self)
+        for i, pkg in enumerate(pkgs):
+            self._sortbonus[pkg] = -1./(i+100)
+
+    def getUpgradeRelationsKey(self):
+        """
+        Return a digest of everything the upgrade relations depend on,
+        so that they may be reused until any of it changes.
+        """
+        cache = self._trans.getCache()
+        channels = []
+        for loader in cache.getLoaders():
+            channel = loader.getChannel()
+            channels.append((channel.getAlias(), channel.getDigest(),
+                             channel.getPriority()))
+        channels.sort()
+        installed = [(pkg.name, pkg.version)
+                     for pkg in cache.getPackages() if pkg.installed]
+        installed.sort()
+        return getObjectDigest((channels, installed,
+                                sysconf.get("package-priorities")))
+
+    def computeUpgradeRelations(self, key):
+        upgrading = {}
+        upgraded = {}
+        stablebonus = {}
         for pkg in self._trans.getCache().getPackages():
             # Precompute upgrade relations.
             for upg in pkg.upgrades:
@@ -440,15 +723,59 @@ class PolicyUpgrade(Policy):
                 lst.sort()
                 stablebonus[bonuspkg] = lst
 
-        pkgs = self._trans._queue.keys()
-        sortUpgrades(pkgs, self)
-        for i, pkg in enumerate(pkgs):
-            self._sortbonus[pkg] = -1./(i+100)
+        return UpgradeRelations(key, upgrading, upgraded, stablebonus)
 
     def runFinished(self):
         Policy.runFinished(self)
         del self._upgrading
         del self._upgraded
+        del self._bonusdependents
+
+    def getIncrementalWeight(self):
+        if type(self).getWeight.im_func is PolicyUpgrade.getWeight.im_func:
+            return IncrementalWeight(self)
+        return None
+
+    def getWeightTerm(self, changeset, pkg):
+        # The same computation of getWeight(), with the terms of
+        # upgraded packages given by the packages themselves.
+        weight = 0
+        op = changeset.get(pkg)
+        if op is REMOVE:
+            for lstpkg in self._upgraded.get(pkg, ()):
+                if changeset.get(lstpkg) is INSTALL:
+                    weight -= 1
+                    break
+            else:
+                weight += 3
+        elif op is INSTALL:
+            weight += 1
+            if self._upgrading.get(pkg):
+                weight += self._sortbonus.get(pkg, 0)
+        for upgpkg in self._upgraded.get(pkg, ()):
+            if changeset.get(upgpkg) is INSTALL:
+                weight -= 31
+                for bonusvalue, bonusdeps in self._stablebonus.get(pkg, ()):
+                    for deppkg in bonusdeps:
+                        if deppkg in changeset:
+                            break
+                    else:
+                        weight += bonusvalue
+                        break
+                break
+        return weight
+
+    def getWeightDependents(self, pkg):
+        # Removed and upgraded packages depend on their upgrades, and
+        # stable bonuses on their dependencies.
+        dependents = [pkg]
+        upgpkgs = self._upgrading.get(pkg)
+        if upgpkgs:
+            dependents.extend(upgpkgs)
+        bonuspkgs = self._bonusdependents.get(pkg)
+        if bonuspkgs:
+            dependents.extend(bonuspkgs)
+        return dependents
 
     def getWeight(self, changeset):
         weight = 0
@@ -493,6 +820,83 @@ class PolicyUpgrade(Policy):
         weight += -30*upgradedcount+(installedcount-upgradedcount)
         return weight
 
+class UpgradeRelations(object):
+    """
+    Upgrade relations between the packages in the cache, as computed
+    by PolicyUpgrade. Computing them walks every package and relation,
+    so they're kept with the cache, and saved with it, for as long as
+    their key stays the same. Packages are saved as (class name, name,
+    version) tuples, and only found again in the cache when resolved.
+    """
+
+    def __init__(self, key, upgrading, upgraded, stablebonus):
+        self._key = key
+        self._packages = None
+        self.upgrading = upgrading
+        self.upgraded = upgraded
+        self.stablebonus = stablebonus
+
+    def getKey(self):
+        return self._key
+
+    def resolve(self, cache):
+        """
+        Find the packages of loaded relations in the given cache,
+        returning whether all of them were found.
+        """
+        if self._packages is None:
+            return True
+        pkgmap = {}
+        for pkg in cache.getPackages():
+            pkgmap[pkg.__class__.__name__, pkg.name, pkg.version] = pkg
+        try:
+            packages = [pkgmap[x] for x in self._packages]
+        except KeyError:
+            return False
+        upgrading = {}
+        for i, lst in self.upgrading:
+            upgrading[packages[i]] = dict.fromkeys([packages[j]
+                                                    for j in lst], True)
+        upgraded = {}
+        for i, lst in self.upgraded:
+            upgraded[packages[i]] = [packages[j] for j in lst]
+        stablebonus = {}
+        for i, lst in self.stablebonus:
+            stablebonus[packages[i]] = [(value,
+                                         dict.fromkeys([packages[j]
+                                                        for j in deps], True))
+                                        for value, deps in lst]
+        self.upgrading = upgrading
+        self.upgraded = upgraded
+        self.stablebonus = stablebonus
+        self._packages = None
+        return True
+
+    def __getstate__(self):
+        assert self._packages is None
+        packages = []
+        indexes = {}
+        def index(pkg):
+            i = indexes.get(pkg)
+            if i is None:
+                i = indexes[pkg] = len(packages)
+                packages.append((pkg.__class__.__name__,
+                                 pkg.name, pkg.version))
+            return i
+        upgrading = [(index(pkg), [index(x) for x in self.upgrading[pkg]])
+                     for pkg in self.upgrading]
+        upgraded = [(index(pkg), [index(x) for x in self.upgraded[pkg]])
+                    for pkg in self.upgraded]
+        stablebonus = [(index(pkg), [(value, [index(x) for x in deps])
+                                     for value, deps in
+                                     self.stablebonus[pkg]])
+                       for pkg in self.stablebonus]
+        return (self._key, packages, upgrading, upgraded, stablebonus)
+
+    def __setstate__(self, state):
+        (self._key, self._packages, self.upgrading,
+         self.upgraded, self.stablebonus) = state
+
 class Failed(Error): pass
 
 PENDING_REMOVE   = 1
@@ -505,6 +909,9 @@ class Transaction(object):
         self._policy = policy and policy(self) or Policy(self)
         self._changeset = changeset or ChangeSet(cache)
         self._queue = queue or {}
+        self._memo = {}
+        self._explored = 0
+        self._budget = 0
 
     def clear(self):
         self._changeset.clear()
@@ -525,6 +932,12 @@ class Transaction(object):
     def getWeight(self):
         return self._policy.getWeight(self._changeset)
 
+    def _getWeight(self, changeset):
+        weight = changeset.getIncrementalWeight()
+        if weight is None:
+            return self._policy.getWeight(changeset)
+        return weight.getWeight()
+
     def getChangeSet(self):
         return self._changeset
 
@@ -663,6 +1076,43 @@ class Transaction(object):
         if ownpending:
             self._pending(changeset, locked, pending, depth)
 
+    def _try(self, op, pkg, changeset, locked, depth=0):
+        # Install or remove pkg on forks of changeset and locked, and
+        # return the weight of the result and the changes made to both,
+        # which are then rolled back. The same package may be tried
+        # again on the same state (e.g. when it upgrades several removed
+        # packages), so outcomes are remembered.
+        key = (op, pkg, changeset.getVersion(), locked.getVersion())
+        outcome = self._memo.get(key)
+        if outcome is None:
+            self._explored += 1
+            csmark = changeset.fork()
+            lkmark = locked.fork()
+            try:
+                try:
+                    if op is INSTALL:
+                        self._install(pkg, changeset, locked, None, depth)
+                    else:
+                        self._remove(pkg, changeset, locked, None, depth)
+                except Failed, e:
+                    outcome = e
+                else:
+                    outcome = (self._getWeight(changeset),
+                               changeset.getChanges(csmark),
+                               locked.getChanges(lkmark))
+            finally:
+                changeset.rollback(csmark)
+                locked.rollback(lkmark)
+            self._memo[key] = outcome
+        if isinstance(outcome, Failed):
+            raise outcome
+        return outcome
+
+    def _overBudget(self):
+        # Once the budget is exhausted, the first working alternative
+        # is taken instead of looking for the best one.
+        return self._budget and self._explored >= self._budget
+
     def _remove(self, pkg, changeset, locked, pending, depth=0):
         #print "[%03d] _remove(%s)" % (depth, pkg)
         #depth += 1
@@ -765,19 +1215,20 @@ class Transaction(object):
                         upgpkgs[prvpkg] = True
 
         # No, let's try to upgrade it.
-        getweight = self._policy.getWeight
-        alternatives = [(getweight(changeset), changeset)]
+        getweight = self._getWeight
+        alternatives = [(getweight(changeset), 0, {})]
 
         # Check if upgrading is possible.
         for upgpkg in upgpkgs:
+            if len(alternatives) > 1 and self._overBudget():
+                break
             try:
-                cs = changeset.copy()
-                lk = locked.copy()
-                self._install(upgpkg, cs, lk, None, depth)
+                weight, cs, lk = self._try(INSTALL, upgpkg, changeset,
+                                           locked, depth)
             except Failed:
                 pass
             else:
-                alternatives.append((getweight(cs), cs))
+                alternatives.append((weight, len(alternatives), cs))
 
         # Is any downgrading version of this package installed?
         try:
@@ -807,26 +1258,27 @@ class Transaction(object):
         else:
             # Check if downgrading is possible.
             for dwnpkg in dwnpkgs:
+                if len(alternatives) > 1 and self._overBudget():
+                    break
                 try:
-                    cs = changeset.copy()
-                    lk = locked.copy()
-                    self._install(dwnpkg, cs, lk, None, depth)
+                    weight, cs, lk = self._try(INSTALL, dwnpkg, changeset,
+                                               locked, depth)
                 except Failed:
                     pass
                 else:
-                    alternatives.append((getweight(cs), cs))
+                    alternatives.append((weight, len(alternatives), cs))
 
         # If there's only one alternative, it's the one currenlty in use.
         if len(alternatives) > 1:
             alternatives.sort()
-            changeset.setState(alternatives[0][1])
+            changeset.setChanges(alternatives[0][2])
 
     def _pending(self, changeset, locked, pending, depth=0):
         #print "[%03d] _pending()" % depth
         #depth += 1
 
         isinst = changeset.installed
-        getweight = self._policy.getWeight
+        getweight = self._getWeight
 
         updown = []
         while pending:
@@ -865,24 +1317,26 @@ class Transaction(object):
                     keeporder = 0.000001
                     pw = self._policy.getPriorityWeights(prvpkgs)
                     for prvpkg in prvpkgs:
+                        if alternatives and self._overBudget():
+                            break
                         try:
-                            cs = changeset.copy()
-                            lk = locked.copy()
-                            self._install(prvpkg, cs, lk, None, depth)
+                            weight, cs, lk = self._try(INSTALL, prvpkg,
+                                                       changeset, locked,
+                                                       depth)
                         except Failed, e:
                             failures.append(unicode(e))
                         else:
-                            alternatives.append((getweight(cs)+pw[prvpkg]+
-                                                 keeporder, cs, lk))
+                            alternatives.append((weight+pw[prvpkg]+keeporder,
+                                                 len(alternatives), cs, lk))
                             keeporder += 0.000001
                     if not alternatives:
                         raise Failed, _("Can't install %s: all packages "
                                         "providing %s failed to install:\n%s")\
                                       % (pkg, req,  "\n".join(failures))
                     alternatives.sort()
-                    changeset.setState(alternatives[0][1])
+                    changeset.setChanges(alternatives[0][2])
                     if len(alternatives) == 1:
-                        locked.update(alternatives[0][2])
+                        locked.setChanges(alternatives[0][3])
                 else:
                     # This turned out to be the only way.
                     self._install(prvpkgs[0], changeset, locked,
@@ -919,15 +1373,17 @@ class Transaction(object):
 
                     pw = self._policy.getPriorityWeights(prvpkgs)
                     for prvpkg in prvpkgs:
+                        if alternatives and self._overBudget():
+                            break
                         try:
-                            cs = changeset.copy()
-                            lk = locked.copy()
-                            self._install(prvpkg, cs, lk, None, depth)
+                            weight, cs, lk = self._try(INSTALL, prvpkg,
+                                                       changeset, locked,
+                                                       depth)
                         except Failed, e:
                             failures.append(unicode(e))
                         else:
-                            alternatives.append((getweight(cs)+pw[prvpkg],
-                                                cs, lk))
+                            alternatives.append((weight+pw[prvpkg],
+                                                 len(alternatives), cs, lk))
 
                 if not prvpkgs or not alternatives:
 
@@ -955,22 +1411,30 @@ class Transaction(object):
                 # Then, remove every requiring package, or
                 # upgrade/downgrade them to something which
                 # does not require this dependency.
-                cs = changeset.copy()
-                lk = locked.copy()
+                csmark = changeset.fork()
+                lkmark = locked.fork()
                 try:
-                    for reqpkg in reqpkgs:
-                        if reqpkg in locked and isinst(reqpkg):
-                            raise Failed, _("%s is locked") % reqpkg
-                    for reqpkg in reqpkgs:
-                        if not cs.installed(reqpkg):
-                            continue
-                        if reqpkg in lk:
-                            raise Failed, _("%s is locked") % reqpkg
-                        self._remove(reqpkg, cs, lk, None, depth)
-                except Failed, e:
-                    failures.append(unicode(e))
-                else:
-                    alternatives.append((getweight(cs), cs, lk))
+                    try:
+                        for reqpkg in reqpkgs:
+                            if reqpkg in locked and isinst(reqpkg):
+                                raise Failed, _("%s is locked") % reqpkg
+                        for reqpkg in reqpkgs:
+                            if not isinst(reqpkg):
+                                continue
+                            if reqpkg in locked:
+                                raise Failed, _("%s is locked") % reqpkg
+                            self._remove(reqpkg, changeset, locked,
+                                         None, depth)
+                    except Failed, e:
+                        failures.append(unicode(e))
+                    else:
+                        alternatives.append((getweight(changeset),
+                                             len(alternatives),
+                                             changeset.getChanges(csmark),
+                                             locked.getChanges(lkmark)))
+                finally:
+                    changeset.rollback(csmark)
+                    locked.rollback(lkmark)
 
                 if not alternatives:
                     raise Failed, _("Can't install %s: all packages providing "
@@ -978,9 +1442,9 @@ class Transaction(object):
                                   % (pkg, prv,  "\n".join(failures))
 
                 alternatives.sort()
-                changeset.setState(alternatives[0][1])
+                changeset.setChanges(alternatives[0][2])
                 if len(alternatives) == 1:
-                    locked.update(alternatives[0][2])
+                    locked.setChanges(alternatives[0][3])
 
         for pkg in updown:
             self._updown(pkg, changeset, locked, depth)
@@ -992,7 +1456,7 @@ class Transaction(object):
         #depth += 1
 
         isinst = changeset.installed
-        getweight = self._policy.getWeight
+        getweight = self._getWeight
 
         sortUpgrades(pkgs, self._policy)
 
@@ -1006,17 +1470,15 @@ class Transaction(object):
                 continue
 
             try:
-                cs = changeset.copy()
-                lk = locked.copy()
-                self._install(pkg, cs, lk, None, depth)
+                csweight, cs, lk = self._try(INSTALL, pkg, changeset,
+                                             locked, depth)
             except Failed, e:
                 pass
             else:
                 lockedstate[pkg] = lk
-                csweight = getweight(cs)
                 if csweight < weight:
                     weight = csweight
-                    changeset.setState(cs)
+                    changeset.setChanges(cs)
 
         lockedstates = {}
         for pkg in pkgs:
@@ -1032,25 +1494,24 @@ class Transaction(object):
                 pkg not in locked and pkg not in lockedstates):
 
                 try:
-                    cs = changeset.copy()
-                    lk = locked.copy()
                     if op is REMOVE:
-                        self._install(pkg, cs, lk, None, depth)
+                        csweight, cs, lk = self._try(INSTALL, pkg, changeset,
+                                                     locked, depth)
                     elif op is INSTALL:
-                        self._remove(pkg, cs, lk, None, depth)
+                        csweight, cs, lk = self._try(REMOVE, pkg, changeset,
+                                                     locked, depth)
                 except Failed, e:
                     pass
                 else:
-                    csweight = getweight(cs)
                     if csweight < weight:
                         weight = csweight
-                        changeset.setState(cs)
+                        changeset.setChanges(cs)
                 
     def _fix(self, pkgs, changeset, locked, pending, depth=0):
         #print "[%03d] _fix()" % depth
         #depth += 1
 
-        getweight = self._policy.getWeight
+        getweight = self._getWeight
         isinst = changeset.installed
 
         sortUpgrades(pkgs)
@@ -1115,32 +1576,36 @@ class Transaction(object):
 
             # Try to fix by installing it.
             try:
-                cs = changeset.copy()
-                lk = locked.copy()
-                self._install(pkg, cs, lk, None, depth)
+                weight, cs, lk = self._try(INSTALL, pkg, changeset, locked,
+                                           depth)
             except Failed, e:
                 failures.append(unicode(e))
             else:
                 # If they weight the same, it's better to keep the package.
-                alternatives.append((getweight(cs)-0.000001, cs))
+                alternatives.append((weight-0.000001, 0, cs))
 
             # Try to fix by removing it.
+            csmark = changeset.fork()
+            lkmark = locked.fork()
             try:
-                cs = changeset.copy()
-                lk = locked.copy()
-                self._remove(pkg, cs, lk, None, depth)
-                self._updown(pkg, cs, lk, depth)
-            except Failed, e:
-                failures.append(unicode(e))
-            else:
-                alternatives.append((getweight(cs), cs))
+                try:
+                    self._remove(pkg, changeset, locked, None, depth)
+                    self._updown(pkg, changeset, locked, depth)
+                except Failed, e:
+                    failures.append(unicode(e))
+                else:
+                    alternatives.append((getweight(changeset), 1,
+                                         changeset.getChanges(csmark)))
+            finally:
+                changeset.rollback(csmark)
+                locked.rollback(lkmark)
 
             if not alternatives:
                 raise Failed, _("Can't fix %s:\n%s") % \
                               (pkg, "\n".join(failures))
 
             alternatives.sort()
-            changeset.setState(alternatives[0][1])
+            changeset.setChanges(alternatives[0][2])
 
     def enqueue(self, pkg, op):
         if op is UPGRADE:
@@ -1175,11 +1640,13 @@ class Transaction(object):
     def run(self):
 
         self._policy.runStarting()
+        self._budget = sysconf.get("solver-budget", 0)
 
         try:
             changeset = self._changeset.copy()
+            changeset.setIncrementalWeight(self._policy.getIncrementalWeight())
             isinst = changeset.installed
-            locked = self._policy.getLockedSet().copy()
+            locked = JournalDict(self._policy.getLockedSet())
             pending = []
 
             for pkg in self._queue:
@@ -1245,8 +1712,15 @@ class Transaction(object):
 
             self._changeset.setState(changeset)
 
+            if self._overBudget():
+                iface.debug(_("Solver budget of %d alternatives exhausted, "
+                              "later choices may not be the best ones")
+                            % self._budget)
+
         finally:
             self._queue.clear()
+            self._memo.clear()
+            self._explored = 0
             self._policy.runFinished()
 
 
@@ -1836,53 +2310,58 @@ def checkPackages(cache, checkset, relateset, report=False):
     checkset.sort()
     relateset = dict.fromkeys(relateset, True)
 
+    # Relations are shared between packages, so each one is resolved
+    # against the relateset only once.
+    satisfied = {}
+    conflicting = {}
+
+    namepkgs = {}
+    for pkg in relateset:
+        if pkg.installed:
+            namepkgs.setdefault(pkg.name, []).append(pkg)
+
     problems = False
     coexistchecked = {}
     for pkg in checkset:
         for req in pkg.requires:
-            for prv in req.providedby:
-                for prvpkg in prv.packages:
-                    if prvpkg in relateset:
-                        break
-                else:
-                    continue
-                break
-            else:
+            if req not in satisfied:
+                satisfied[req] = False
+                for prv in req.providedby:
+                    for prvpkg in prv.packages:
+                        if prvpkg in relateset:
+                            satisfied[req] = True
+                            break
+                    else:
+                        continue
+                    break
+            if not satisfied[req]:
                 if not report:
                     return False
                 problems = True
                 iface.info(_("Unsatisfied dependency: %s requires %s") %
                            (pkg, req))
 
-        for req in pkg.recommends:
-            for prv in req.providedby:
-                for prvpkg in prv.packages:
-                    if prvpkg in relateset:
-                        break
-                else:
-                    continue
-                break
-
         if not pkg.installed:
             continue
 
         for cnf in pkg.conflicts:
-            for prv in cnf.providedby:
-                for prvpkg in prv.packages:
-                    if (prvpkg is not pkg and
-                        prvpkg.installed and
-                        prvpkg in relateset):
-                        if not report:
-                            return False
-                        problems = True
-                        iface.info(_("Unsatisfied dependency: "
-                                     "%s conflicts with %s") % (pkg, prvpkg))
-
-        namepkgs = cache.getPackages(pkg.name)
-        for namepkg in namepkgs:
+            cnfpkgs = conflicting.get(cnf)
+            if cnfpkgs is None:
+                cnfpkgs = conflicting[cnf] = []
+                for prv in cnf.providedby:
+                    for prvpkg in prv.packages:
+                        if prvpkg.installed and prvpkg in relateset:
+                            cnfpkgs.append(prvpkg)
+            for prvpkg in cnfpkgs:
+                if prvpkg is not pkg:
+                    if not report:
+                        return False
+                    problems = True
+                    iface.info(_("Unsatisfied dependency: "
+                                 "%s conflicts with %s") % (pkg, prvpkg))
+
+        for namepkg in namepkgs.get(pkg.name, ()):
             if (namepkg is not pkg and
-                namepkg.installed and
-                namepkg in relateset and
                 (namepkg, pkg) not in coexistchecked):
                 coexistchecked[(pkg, namepkg)] = True
                 if not pkg.coexists(namepkg):
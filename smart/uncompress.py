@@ -45,6 +45,70 @@ class Uncompressor(object):
         else:
             raise Error, _("Unknown compressed file: %s") % localpath
 
+    def open(self, localpath):
+        handler = self.getHandler(localpath)
+        if not handler:
+            return open(localpath)
+        decompressor = handler.getDecompressor()
+        if not decompressor:
+            raise Error, _("Can't read compressed file: %s") % localpath
+        return UncompressedFile(open(localpath), decompressor, handler)
+
+class UncompressedFile(object):
+    """
+    Read-only file object that uncompresses data as it's read, without
+    saving it to disk. Note that tell() returns the offset in the
+    compressed file, so that it may be used to report progress. When
+    handler is given, it provides the decompressors for any streams
+    following the first one, as in concatenated gzip files.
+    """
+
+    def __init__(self, file, decompressor, handler=None):
+        self._file = file
+        self._decompressor = decompressor
+        self._handler = handler
+        self._buffer = ""
+        self._eof = False
+
+    def read(self, size=-1):
+        buffer = self._buffer
+        while not self._eof and (size < 0 or len(buffer) < size):
+            data = self._file.read(BLOCKSIZE)
+            try:
+                if data:
+                    buffer += self._decompress(data)
+                else:
+                    self._eof = True
+                    if hasattr(self._decompressor, "flush"):
+                        buffer += self._decompressor.flush()
+            except Exception, e:
+                # Decompressors have their own error types (zlib.error,
+                # lzma.LZMAError, ...), and bz2 raises IOError/EOFError.
+                raise Error, ("%s\nPossibly corrupted channel file.") % e
+        if size < 0:
+            self._buffer = ""
+            return buffer
+        self._buffer = buffer[size:]
+        return buffer[:size]
+
+    def _decompress(self, data):
+        decompressor = self._decompressor
+        data = decompressor.decompress(data)
+        unused = getattr(decompressor, "unused_data", None)
+        while unused and self._handler:
+            decompressor = self._handler.getDecompressor()
+            self._decompressor = decompressor
+            data += decompressor.decompress(unused)
+            unused = decompressor.unused_data
+        return data
+
+    def tell(self):
+        return self._file.tell()
+
+    def close(self):
+        self._file.close()
+        self._buffer = ""
+
 class UncompressorHandler(object):
 
     def query(self, localpath):
@@ -53,6 +117,9 @@ class UncompressorHandler(object):
     def getTargetPath(self, localpath):
         return None
 
+    def getDecompressor(self):
+        return None
+
     def uncompress(self, localpath):
         raise Error, _("Unsupported file type")
 
@@ -65,6 +132,10 @@ class BZ2Handler(UncompressorHandler):
     def getTargetPath(self, localpath):
         return localpath[:-4]
 
+    def getDecompressor(self):
+        import bz2
+        return bz2.BZ2Decompressor()
+
     def uncompress(self, localpath):
         import bz2
         try:
@@ -91,6 +162,13 @@ class LZMAHandler(UncompressorHandler):
         if localpath.endswith(".lzma"):
             return localpath[:-5]
 
+    def getDecompressor(self):
+        try:
+            import lzma
+        except ImportError:
+            return None
+        return lzma.LZMADecompressor()
+
     def uncompress(self, localpath):
         try:
             import lzma
@@ -126,6 +204,13 @@ class XZHandler(UncompressorHandler):
         if localpath.endswith(".xz"):
             return localpath[:-3]
 
+    def getDecompressor(self):
+        try:
+            import lzma
+        except ImportError:
+            return None
+        return lzma.LZMADecompressor()
+
     def uncompress(self, localpath):
         import lzma
         try:
@@ -151,6 +236,11 @@ class GZipHandler(UncompressorHandler):
     def getTargetPath(self, localpath):
         return localpath[:-3]
 
+    def getDecompressor(self):
+        import zlib
+        # Skip the gzip header and trailer.
+        return zlib.decompressobj(16+zlib.MAX_WBITS)
+
     def uncompress(self, localpath):
         import gzip
         try:
@@ -19,6 +19,11 @@
 # along with Smart Package Manager; if not, write to the Free Software
 # Foundation, Inc., 59 Temple Place, Suite 330, Boston, MA  02111-1307  USA
 #
+from array import array
+import bisect
+import mmap
+import re
+import os
 
 class TagFile(dict):
 
@@ -81,3 +86,130 @@ class TagFile(dict):
         return bool(self)
 
 from ctagfile import *
+
+class TagFileIndex(object):
+    """
+    Index of the spans where the values of the given fields are found
+    in each section of a tag file. Sections are identified by the
+    same offsets used by TagFile, and values are sliced out of a
+    memory mapping of the file, without parsing the whole section.
+    """
+
+    _sectionre = re.compile(r"^(?=\S)[^\n]*:", re.M)
+    _valueendre = re.compile(r"\n(?![^\S\n])")
+
+    def __init__(self, filename, fields):
+        self._filename = filename
+        self._fields = [x.lower() for x in fields]
+        self._size = None
+        self._offsets = array("l")
+        self._spans = dict([(x, array("l")) for x in self._fields])
+        self._map = None
+
+    def __getstate__(self):
+        return (self._filename, self._fields, self._size,
+                self._offsets, self._spans)
+
+    def __setstate__(self, state):
+        (self._filename, self._fields, self._size,
+         self._offsets, self._spans) = state
+        self._map = None
+
+    def _getMap(self):
+        if self._map is None:
+            file = open(self._filename)
+            try:
+                self._map = mmap.mmap(file.fileno(), 0,
+                                      access=mmap.ACCESS_READ)
+            finally:
+                file.close()
+        return self._map
+
+    def isValid(self):
+        try:
+            return os.path.getsize(self._filename) == self._size
+        except OSError:
+            return False
+
+    def build(self):
+        self._map = None
+        self._offsets = offsets = array("l")
+        self._spans = spans = {}
+        self._size = size = os.path.getsize(self._filename)
+        if not size:
+            for field in self._fields:
+                spans[field] = array("l")
+            return
+        map = self._getMap()
+        # Case insensitive matching is done by hand, as it's much faster
+        # than using re.I on a big file.
+        names = []
+        for field in self._fields:
+            names.append("".join([c.isalpha() and "[%s%s]" % (c, c.upper())
+                                  or re.escape(c) for c in field]))
+        fieldre = re.compile(r"(%s)[ \t]*:[ \t]*" % "|".join(names))
+        matches = []
+        match = fieldre.match(map)
+        if match:
+            matches.append(match)
+        matches.extend(re.compile("\n"+fieldre.pattern).finditer(map))
+        sectionsearch = self._sectionre.search
+        valueendsearch = self._valueendre.search
+        find = map.find
+        ends = []
+        offset = 0
+        while True:
+            start = offset
+            if map[start:start+1].isspace():
+                match = sectionsearch(map, offset)
+                if not match:
+                    break
+                start = match.start()
+            end = find("\n\n", start)
+            offsets.append(offset)
+            if end == -1:
+                ends.append(size)
+                break
+            offset = end+2
+            ends.append(offset)
+            if offset >= size:
+                break
+        for field in self._fields:
+            spans[field] = array("l", [-1])*(len(offsets)*2)
+        for match in matches:
+            i = bisect.bisect_right(ends, match.start(1))
+            valuestart = match.end()
+            valueend = valueendsearch(map, valuestart, ends[i])
+            if valueend:
+                valueend = valueend.start()
+            else:
+                valueend = ends[i]
+            fieldspans = spans[match.group(1).lower()]
+            fieldspans[i*2] = valuestart
+            fieldspans[i*2+1] = valueend
+
+    def getSpan(self, offset, field):
+        offsets = self._offsets
+        i = bisect.bisect_left(offsets, offset)
+        if i == len(offsets) or offsets[i] != offset:
+            return None
+        spans = self._spans[field]
+        start = spans[i*2]
+        if start == -1:
+            return None
+        return start, spans[i*2+1]
+
+    def getValue(self, offset, field, default=None):
+        """
+        Return the value of the given field as TagFile would.
+        """
+        span = self.getSpan(offset, field)
+        if not span:
+            return default
+        lines = self._getMap()[span[0]:span[1]].split("\n")
+        for i in range(1, len(lines)):
+            line = lines[i][1:]
+            if line == ".":
+                line = ""
+            lines[i] = line
+        return "\n".join(lines).rstrip(" \t\n")
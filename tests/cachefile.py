@@ -0,0 +1,131 @@
+import tempfile
+import unittest
+import shutil
+import os
+
+from smart.cachefile import dumpCacheFile, loadCacheFile
+from smart.backends.deb.base import DebPackage, DebProvides, DebRequires
+from smart.backends.deb.base import DebOrRequires, DebUpgrades, DebConflicts
+from smart.cache import Cache, Loader, StateVersionError
+
+
+class CacheFileLoader(Loader):
+
+    def load(self):
+        for i in range(3):
+            name = "name%d" % i
+            pkg = self.buildPackage(
+                (DebPackage, name, "1.%d" % i),
+                [(DebProvides, name, "1.%d" % i),
+                 (DebProvides, "virtual", None)],
+                [(DebRequires, "name%d" % ((i+1)%3), ">=", "1.0"),
+                 (DebOrRequires, (("a", None, None), ("b", ">=", "1")))],
+                [(DebUpgrades, name, "<", "1.%d" % i)],
+                [(DebConflicts, "other", None, None)])
+            pkg.loaders[self] = {"offset": i}
+
+
+class CacheFileTest(unittest.TestCase):
+
+    def setUp(self):
+        self.tempdir = tempfile.mkdtemp()
+        self.path = os.path.join(self.tempdir, "cache")
+        self.cache = Cache()
+        self.loader = CacheFileLoader()
+        self.cache.addLoader(self.loader)
+        self.cache.load()
+
+    def tearDown(self):
+        shutil.rmtree(self.tempdir)
+
+    def dump_and_load(self, state):
+        dumpCacheFile(self.path, state, self.cache.getPackages())
+        return loadCacheFile(self.path)
+
+    def test_roundtrip(self):
+        version, cache, other = self.dump_and_load((3, self.cache, "other"))
+        self.assertEquals(version, 3)
+        self.assertEquals(other, "other")
+        packages = sorted(cache.getPackages())
+        self.assertEquals([str(pkg) for pkg in packages],
+                          ["name0_1.0", "name1_1.1", "name2_1.2"])
+        pkg = packages[0]
+        self.assertEquals([str(prv) for prv in pkg.provides],
+                          ["name0 = 1.0", "virtual"])
+        self.assertEquals([str(req) for req in pkg.requires],
+                          ["name1 >= 1.0", "a | b >= 1"])
+        self.assertEquals([str(upg) for upg in pkg.upgrades],
+                          ["name0 < 1.0"])
+        self.assertEquals([str(cnf) for cnf in pkg.conflicts], ["other"])
+        self.assertEquals(type(pkg.requires), list)
+
+    def test_relations_are_shared(self):
+        version, cache = self.dump_and_load((3, self.cache))
+        packages = cache.getPackages()
+        virtuals = [prv for pkg in packages for prv in pkg.provides
+                    if prv.name == "virtual"]
+        self.assertEquals(len(virtuals), 3)
+        self.assertTrue(virtuals[0] is virtuals[1] is virtuals[2])
+        self.assertEquals(len(virtuals[0].packages), 3)
+
+    def test_loaders(self):
+        cache, loader = self.dump_and_load((self.cache, self.loader))
+        for pkg in cache.getPackages():
+            self.assertEquals(pkg.loaders.keys(), [loader])
+            self.assertTrue(pkg in loader.getPackages())
+        offsets = sorted([pkg.loaders[loader]["offset"]
+                          for pkg in cache.getPackages()])
+        self.assertEquals(offsets, [0, 1, 2])
+
+    def test_load_links_dependencies(self):
+        version, cache = self.dump_and_load((3, self.cache))
+        cache.load()
+        self.assertEquals(len(cache.getPackages()), 3)
+        for req in cache.getRequires():
+            if req.name == "name1":
+                self.assertEquals([str(prv) for prv in req.providedby],
+                                  ["name1 = 1.1"])
+                break
+        else:
+            self.fail("Requires not found")
+
+    def test_bad_file(self):
+        file = open(self.path, "w")
+        file.write("garbage")
+        file.close()
+        self.assertRaises(StateVersionError, loadCacheFile, self.path)
+
+    def test_truncated_file(self):
+        dumpCacheFile(self.path, (3, self.cache), self.cache.getPackages())
+        data = open(self.path).read()
+        file = open(self.path, "w")
+        file.write(data[:-10])
+        file.close()
+        self.assertRaises(StateVersionError, loadCacheFile, self.path)
+
+    def test_externals(self):
+        dumpCacheFile(self.path, self.loader, self.cache.getPackages(),
+                      externals=(self.cache,))
+        cache = Cache()
+        loader = loadCacheFile(self.path, externals=(cache,))
+        self.assertTrue(loader.getCache() is cache)
+        self.assertRaises(StateVersionError, loadCacheFile, self.path)
+
+    def test_shared_objmap(self):
+        other = CacheFileLoader()
+        self.cache.addLoader(other)
+        self.cache.load()
+        paths = []
+        for loader in (self.loader, other):
+            path = os.path.join(self.tempdir, str(len(paths)))
+            dumpCacheFile(path, loader, loader.getPackages(),
+                          externals=(self.cache,), loaders=[loader])
+            paths.append(path)
+        cache = Cache()
+        objmap = {}
+        loaders = [loadCacheFile(path, (cache,), objmap) for path in paths]
+        packages = loaders[0].getPackages()
+        self.assertEquals(len(packages), 3)
+        self.assertEquals(packages, loaders[1].getPackages())
+        for pkg in packages:
+            self.assertEquals(set(pkg.loaders), set(loaders))
@@ -0,0 +1,95 @@
+import unittest
+import os
+
+from smart.backends.deb.base import DebPackage, DebNameProvides
+from smart.backends.deb.base import DebRequires, DebConflicts
+from smart.commands.check import getChangedPackages
+from smart.transaction import ChangeSet, checkPackages, INSTALL, REMOVE
+from smart.channel import PackageChannel
+from smart.cache import Cache, Loader
+from smart import sysconf
+
+from tests import ctrl
+
+
+class CheckLoader(Loader):
+
+    def __init__(self, packages):
+        Loader.__init__(self)
+        self._pkgargs = packages
+        self._installed = True
+
+    def getChannel(self):
+        return PackageChannel("check", "installed")
+
+    def load(self):
+        for name, reqargs, cnfargs in self._pkgargs:
+            name, version = (name.split("_")+["1.0"])[:2]
+            self.buildPackage((DebPackage, name, version),
+                              [(DebNameProvides, name, version)],
+                              reqargs, [], cnfargs)
+
+
+class CheckTest(unittest.TestCase):
+
+    def setUp(self):
+        # "a" and "b" share their requirement on "c", and "d" conflicts
+        # with "a".
+        self.cache = Cache()
+        self.cache.addLoader(CheckLoader([
+            ("a", [(DebRequires, "c", None, None)], []),
+            ("b", [(DebRequires, "c", None, None)], []),
+            ("c", [], []),
+            ("d", [], [(DebConflicts, "a", None, None)]),
+            ("e_1.0", [], []),
+            ("e_2.0", [], [])]))
+        self.cache.load()
+        self.pkgs = dict([(str(pkg).replace("_1.0", ""), pkg) for pkg in
+                          self.cache.getPackages()])
+
+    def tearDown(self):
+        logpath = ctrl.getCommitLogPath()
+        if logpath and os.path.isfile(logpath):
+            os.unlink(logpath)
+        sysconf.remove("commit-log", soft=True)
+
+    def check(self, checknames, relatenames):
+        return checkPackages(self.cache,
+                             [self.pkgs[name] for name in checknames],
+                             [self.pkgs[name] for name in relatenames])
+
+    def test_check_requires(self):
+        self.assertTrue(self.check("abc", "abc"))
+        self.assertFalse(self.check("ab", "ab"))
+        self.assertTrue(self.check("c", "c"))
+
+    def test_check_conflicts(self):
+        self.assertFalse(self.check("d", "abcd"))
+        self.assertTrue(self.check("bcd", "bcd"))
+
+    def test_check_coexists(self):
+        self.assertFalse(self.check(["e"], ["e", "e_2.0"]))
+        self.assertTrue(self.check(["e"], ["e"]))
+
+    def test_read_commit_log(self):
+        self.assertEquals(ctrl.readCommitLog(), ([], 0))
+        sysconf.set("commit-log", "commits", soft=True)
+        changeset = ChangeSet(self.cache)
+        changeset[self.pkgs["a"]] = INSTALL
+        ctrl.writeCommitLog(changeset)
+        changes, offset = ctrl.readCommitLog()
+        self.assertEquals(changes, [("a_1.0", "INSTALL")])
+        changeset = ChangeSet(self.cache)
+        changeset[self.pkgs["b"]] = REMOVE
+        ctrl.writeCommitLog(changeset)
+        self.assertEquals(ctrl.readCommitLog(offset)[0],
+                          [("b_1.0", "REMOVE")])
+        self.assertEquals(len(ctrl.readCommitLog(offset*10)[0]), 2)
+
+    def test_changed_packages(self):
+        changed = getChangedPackages(self.cache, [("a_1.0", "INSTALL")])
+        self.assertEquals(sorted([pkg.name for pkg in changed]), ["a", "d"])
+        changed = getChangedPackages(self.cache, [("c_1.0", "REMOVE")])
+        self.assertEquals(sorted([pkg.name for pkg in changed]), ["a", "b"])
+        self.assertEquals(getChangedPackages(self.cache,
+                                             [("f_1.0", "REMOVE")]), None)
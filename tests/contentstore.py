@@ -0,0 +1,63 @@
+import tempfile
+import unittest
+import shutil
+import time
+import os
+
+from smart.contentstore import ContentStore
+
+
+class ContentStoreTest(unittest.TestCase):
+
+    def setUp(self):
+        self.tempdir = tempfile.mkdtemp()
+        self.store = ContentStore(os.path.join(self.tempdir, "store"), 10)
+
+    def tearDown(self):
+        shutil.rmtree(self.tempdir)
+
+    def make_file(self, name, data):
+        path = os.path.join(self.tempdir, name)
+        file = open(path, "w")
+        file.write(data)
+        file.close()
+        return path
+
+    def test_add_and_find(self):
+        path = self.make_file("file", "data")
+        self.assertEquals(self.store.find([("md5", "abcd")]), None)
+        self.store.add(path, "md5", "abcd")
+        storepath = self.store.find([("sha256", "1234"), ("md5", "abcd")])
+        self.assertEquals(storepath, self.store.getPath("md5", "abcd"))
+        self.assertTrue(os.path.samefile(storepath, path))
+        self.assertEquals(self.store.find([("md5", "abcd")], size=5), None)
+
+    def test_link(self):
+        path = self.make_file("file", "data")
+        self.store.add(path, "md5", "abcd")
+        target = os.path.join(self.tempdir, "target")
+        self.make_file("target", "other")
+        self.assertTrue(self.store.link(self.store.getPath("md5", "abcd"),
+                                        target))
+        self.assertEquals(open(target).read(), "data")
+        self.assertFalse(os.path.exists(target+".part"))
+
+    def test_prune_removes_least_recently_used(self):
+        for name in ("a", "b", "c"):
+            self.store.add(self.make_file(name, "data"), "md5", name*4)
+        now = time.time()
+        for i, name in enumerate(("b", "c", "a")):
+            os.utime(self.store.getPath("md5", name*4), (now+i, now))
+        self.store.prune()
+        self.assertEquals(self.store.find([("md5", "bbbb")]), None)
+        self.assertNotEquals(self.store.find([("md5", "cccc")]), None)
+        self.assertNotEquals(self.store.find([("md5", "aaaa")]), None)
+
+    def test_prune_only_after_adding(self):
+        for name in ("a", "b", "c"):
+            self.store.add(self.make_file(name, "data"), "md5", name*4)
+        store = ContentStore(os.path.join(self.tempdir, "store"), 0)
+        store.prune()
+        self.assertEquals(len(store.getFiles()), 3)
+        store.prune(0)
+        self.assertEquals(store.getFiles(), [])
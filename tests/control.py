@@ -0,0 +1,103 @@
+import threading
+import unittest
+
+from smart.backends.deb.base import DebPackage, DebNameProvides, DebRequires
+from smart.transaction import ChangeSet, INSTALL
+from smart.fetcher import FetcherCancelled
+from smart.channel import PackageChannel
+from smart.cache import Loader
+from smart import Error
+
+from tests import ctrl
+
+
+class PipelineLoader(Loader):
+
+    def getChannel(self):
+        return PackageChannel("pipeline", "available")
+
+    def load(self):
+        # Each package requires the one before it.
+        for i in range(3):
+            name = "pkg%d" % i
+            reqargs = []
+            if i:
+                reqargs.append((DebRequires, "pkg%d" % (i-1), None, None))
+            self.buildPackage((DebPackage, name, "1.0"),
+                              [(DebNameProvides, name, "1.0")],
+                              reqargs, [], [])
+
+
+class StubFetcher(object):
+
+    def __init__(self):
+        self.cancelled = threading.Event()
+
+    def cancel(self):
+        self.cancelled.set()
+
+
+class PipelinedCommitTest(unittest.TestCase):
+
+    def setUp(self):
+        self.log = []
+        self.failing = None
+        self.fetcher = StubFetcher()
+        self.loader = PipelineLoader()
+        cache = ctrl.getCache()
+        cache.addLoader(self.loader)
+        cache.load()
+        self.changeset = ChangeSet(cache)
+        for pkg in self.loader.getPackages():
+            self.changeset.set(pkg, INSTALL)
+            self.changeset.setRequested(pkg, True)
+        test = self
+        class StubPackageManager(object):
+            def commit(self, changeset, pkgpaths):
+                names = sorted([pkg.name for pkg in changeset])
+                test.log.append(("commit", names))
+                if test.failing in names:
+                    raise Error, "Failed"
+        self.pmpkgs = {StubPackageManager: list(self.changeset)}
+        self.realfetcher = ctrl._fetcher
+        ctrl._fetcher = self.fetcher
+        ctrl.fetchPackages = self.fetchPackages
+
+    def tearDown(self):
+        ctrl._fetcher = self.realfetcher
+        del ctrl.fetchPackages
+        cache = ctrl.getCache()
+        cache.removeLoader(self.loader)
+        cache.load()
+
+    def fetchPackages(self, packages, caching, channels, progress):
+        self.log.append(("fetch", sorted([pkg.name for pkg in packages])))
+        if self.failing and progress:
+            # Later downloads are still running when the commit fails.
+            self.fetcher.cancelled.wait(10)
+        if self.fetcher.cancelled.isSet():
+            raise FetcherCancelled, "Cancelled"
+        return dict([(pkg, ["/"+pkg.name]) for pkg in packages]), {}
+
+    def commit(self):
+        return ctrl.commitChangeSetPipelined(self.changeset, self.pmpkgs,
+                                             {})
+
+    def test_order(self):
+        self.assertTrue(self.commit())
+        commits = [x for x in self.log if x[0] == "commit"]
+        self.assertEquals(commits, [("commit", ["pkg0"]),
+                                    ("commit", ["pkg1"]),
+                                    ("commit", ["pkg2"])])
+        # Each step is fetched before being committed.
+        for i in range(3):
+            self.assertTrue(self.log.index(("fetch", ["pkg%d" % i])) <
+                            self.log.index(("commit", ["pkg%d" % i])))
+
+    def test_commit_failure_cancels_fetching(self):
+        self.failing = "pkg0"
+        self.assertRaises(Error, self.commit)
+        self.assertTrue(self.fetcher.cancelled.isSet())
+        self.assertEquals([x for x in self.log if x[0] == "commit"],
+                          [("commit", ["pkg0"])])
+        self.assertTrue(("fetch", ["pkg2"]) not in self.log)
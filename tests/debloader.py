@@ -1,8 +1,13 @@
 from StringIO import StringIO
+import tempfile
 import unittest
+import shutil
+import os
 
-from smart.backends.deb.loader import DebTagLoader, DEBARCH, TagFile
+from smart.backends.deb.loader import DebTagLoader, DebTagFileLoader
+from smart.backends.deb.loader import DEBARCH, TagFile
 from smart.backends.deb.base import DebBreaks
+from smart.searcher import Searcher
 from smart.cache import Cache
 
 
@@ -96,3 +101,47 @@ class DebLoaderTest(unittest.TestCase):
         except ValueError, e:
             self.fail(e)
 
+
+
+class DebTagFileLoaderTest(unittest.TestCase):
+
+    def setUp(self):
+        self.tempdir = tempfile.mkdtemp()
+        self.filename = os.path.join(self.tempdir, "Packages")
+        file = open(self.filename, "w")
+        file.write(SMARTPM_SECTION + "\n" +
+                   SMARTPM_SECTION.replace("smartpm-core", "other")
+                                  .replace("Full description.",
+                                           "Other description."))
+        file.close()
+        self.cache = Cache()
+        self.loader = DebTagFileLoader(self.filename)
+        self.cache.addLoader(self.loader)
+        self.cache.load()
+
+    def tearDown(self):
+        shutil.rmtree(self.tempdir)
+
+    def search(self, description=None, summary=None):
+        searcher = Searcher()
+        if description:
+            searcher.addDescription(description)
+        if summary:
+            searcher.addSummary(summary)
+        self.loader.search(searcher)
+        return sorted([pkg.name for ratio, pkg in searcher.getResults()])
+
+    def test_search_description(self):
+        self.assertEquals(self.search(description="other*"), ["other"])
+        self.assertEquals(self.search(summary="summary line"),
+                          ["other", "smartpm-core"])
+
+    def test_search_without_index(self):
+        self.loader._index = None
+        self.assertEquals(self.search(description="other*"), ["other"])
+
+    def test_search_with_changed_file(self):
+        file = open(self.filename, "a")
+        file.write("\n")
+        file.close()
+        self.assertEquals(self.search(description="full*"), ["smartpm-core"])
@@ -1,15 +1,22 @@
 import BaseHTTPServer
+import SocketServer
 import threading
 import unittest
 import socket
 import signal
+import gzip
 import time
 import os
 
+from cStringIO import StringIO
+
+from hashlib import md5, sha256
+
 from smart.progress import Progress
 from smart.interface import Interface
-from smart.fetcher import Fetcher
-from smart.const import VERSION, SUCCEEDED, FAILED
+from smart.fetcher import Fetcher, FetcherHandler, FetcherCancelled
+from smart.fetcher import URLLIBHandler
+from smart.const import VERSION, SUCCEEDED, FAILED, NEVER
 from smart import fetcher, sysconf, iface
 
 from tests.mocker import MockerTestCase
@@ -28,6 +35,34 @@ class HTTPServer(BaseHTTPServer.HTTPServer):
             BaseHTTPServer.HTTPServer.handle_error(self, request, client_address)
 
 
+class ThreadingHTTPServer(SocketServer.ThreadingMixIn, HTTPServer):
+
+    daemon_threads = True
+
+
+class ThreadHandler(FetcherHandler):
+
+    def __init__(self, *args):
+        FetcherHandler.__init__(self, *args)
+        self._active = False
+
+    def tick(self):
+        if self._queue and not self._active:
+            self._active = True
+            self.startThread(self.fetch)
+        return self._active
+
+    def fetch(self):
+        while self._queue:
+            item = self._queue.pop(0)
+            item.start()
+            if item.getURL().host == "broken":
+                item.setFailed("Broken")
+            else:
+                item.setSucceeded(item.getURL().path)
+        self._active = False
+
+
 class FetcherTest(MockerTestCase):
 
     def setUp(self):
@@ -45,11 +80,12 @@ class FetcherTest(MockerTestCase):
         # See above.
         signal.signal(signal.SIGPIPE, signal.SIG_DFL)
 
-    def start_server(self, handler, hide_errors=False):
+    def start_server(self, handler, hide_errors=False, protocol="HTTP/1.0"):
         startup_lock = threading.Lock()
         startup_lock.acquire()
         def server():
             class Handler(BaseHTTPServer.BaseHTTPRequestHandler):
+                protocol_version = protocol
                 def do_GET(self):
                     return handler(self)
                 def log_message(self, format, *args):
@@ -75,6 +111,42 @@ class FetcherTest(MockerTestCase):
     def wait_for_server(self):
         self.server_thread.join()
 
+    def start_range_server(self, data):
+        """Serve data with byte ranges, returning the requests made."""
+        requests = []
+        class Handler(BaseHTTPServer.BaseHTTPRequestHandler):
+            protocol_version = "HTTP/1.1"
+            def do_GET(self):
+                start, end = self.headers["Range"][6:].split("-")
+                start, end = int(start), int(end)+1
+                requests.append((self.headers["Host"], start, end))
+                self.send_response(206)
+                self.send_header("Content-Length", str(end-start))
+                self.send_header("Content-Range", "bytes %d-%d/%d" %
+                                 (start, end-1, len(data)))
+                self.end_headers()
+                self.wfile.write(data[start:end])
+            def log_message(self, format, *args):
+                pass
+        httpd = ThreadingHTTPServer(("127.0.0.1", PORT), Handler)
+        thread = threading.Thread(target=httpd.serve_forever)
+        thread.start()
+        def stop():
+            httpd.shutdown()
+            httpd.server_close()
+            thread.join()
+        self.addCleanup(stop)
+        return requests
+
+    def set_segments(self, segments):
+        sysconf.set("download-segments", segments, soft=True)
+        self.addCleanup(sysconf.remove, "download-segments", soft=True)
+        minsize = URLLIBHandler.MINSEGMENTSIZE
+        URLLIBHandler.MINSEGMENTSIZE = 10
+        def restore():
+            URLLIBHandler.MINSEGMENTSIZE = minsize
+        self.addCleanup(restore)
+
     def test_user_agent(self):
         headers = []
         def handler(request):
@@ -158,6 +230,7 @@ class FetcherTest(MockerTestCase):
         rate_limit = 10
         
         sysconf.set("max-download-rate", rate_limit, soft=True)
+        self.addCleanup(sysconf.remove, "max-download-rate", soft=True)
 
         def handler(request):
             request.send_header("Content-Length", str(bytes))
@@ -171,4 +244,264 @@ class FetcherTest(MockerTestCase):
         elapsed_time = stop - start
         
         self.assertTrue(elapsed_time >= bytes / rate_limit)
-    
+
+    def test_handler_threads_wake_fetcher_up(self):
+        Fetcher.setHandler("thread", ThreadHandler)
+        self.addCleanup(Fetcher._registry.pop, "thread")
+        for i in range(3):
+            self.fetcher.enqueue("thread://host/file%d" % i)
+        started = time.time()
+        self.fetcher.run(progress=Progress())
+        self.assertTrue(time.time()-started < fetcher.SPEEDDELAY)
+        self.assertEquals(sorted(self.fetcher.getSucceededSet().values()),
+                          ["/file0", "/file1", "/file2"])
+
+    def test_cancel_before_run(self):
+        Fetcher.setHandler("thread", ThreadHandler)
+        self.addCleanup(Fetcher._registry.pop, "thread")
+        self.fetcher.enqueue("thread://host/file")
+        self.fetcher.cancel()
+        self.assertRaises(FetcherCancelled, self.fetcher.run,
+                          progress=Progress())
+        self.assertEquals(self.fetcher.getSucceededSet(), {})
+        # The cancel only applies to one run.
+        self.fetcher.run(progress=Progress())
+        self.assertEquals(self.fetcher.getSucceededSet(),
+                          {"thread://host/file": "/file"})
+
+    def test_failed_items_use_next_mirror(self):
+        Fetcher.setHandler("thread", ThreadHandler)
+        self.addCleanup(Fetcher._registry.pop, "thread")
+        self.fetcher.getMirrorSystem().setMirrors(
+            {"thread://broken/": ["thread://host/mirror/"]})
+        self.fetcher.enqueue("thread://broken/file")
+        self.fetcher.run(progress=Progress())
+        self.assertEquals(self.fetcher.getSucceededSet(),
+                          {"thread://broken/file": "/mirror/file"})
+
+    def test_connections_are_reused(self):
+        sysconf.set("max-active-downloads", 1, soft=True)
+        self.addCleanup(sysconf.remove, "max-active-downloads", soft=True)
+        connections = set()
+        def handler(request):
+            connections.add(request.client_address)
+            request.send_response(200)
+            request.send_header("Content-Length", "5")
+            request.end_headers()
+            request.wfile.write("Hello")
+        # A single HTTP/1.1 connection is served.
+        self.start_server(handler, protocol="HTTP/1.1")
+        for i in range(3):
+            self.fetcher.enqueue("http://127.0.0.1:%d/file%d.pkg" % (PORT, i))
+        self.fetcher.run(progress=Progress())
+        self.wait_for_server()
+        self.assertEquals(len(self.fetcher.getSucceededSet()), 3)
+        self.assertEquals(len(connections), 1)
+
+    def test_connections_per_host_are_limited(self):
+        sysconf.set("max-active-downloads", 5, soft=True)
+        self.addCleanup(sysconf.remove, "max-active-downloads", soft=True)
+        lock = threading.Lock()
+        active = [0, 0] # Current and maximum.
+        class Handler(BaseHTTPServer.BaseHTTPRequestHandler):
+            protocol_version = "HTTP/1.1"
+            def do_GET(self):
+                lock.acquire()
+                active[0] += 1
+                active[1] = max(active)
+                lock.release()
+                time.sleep(0.1)
+                lock.acquire()
+                active[0] -= 1
+                lock.release()
+                self.send_response(200)
+                self.send_header("Content-Length", "5")
+                self.end_headers()
+                self.wfile.write("Hello")
+            def log_message(self, format, *args):
+                pass
+        httpd = ThreadingHTTPServer(("127.0.0.1", PORT), Handler)
+        thread = threading.Thread(target=httpd.serve_forever)
+        thread.start()
+        try:
+            for i in range(6):
+                self.fetcher.enqueue("http://127.0.0.1:%d/file%d.pkg" %
+                                     (PORT, i))
+            self.fetcher.run(progress=Progress())
+        finally:
+            httpd.shutdown()
+            httpd.server_close()
+            thread.join()
+        self.assertEquals(len(self.fetcher.getSucceededSet()), 6)
+        self.assertEquals(active[1], URLLIBHandler.MAXPERHOST)
+
+    def test_segmented_download(self):
+        self.set_segments(3)
+        data = "".join([chr(i) for i in range(100)])
+        requests = self.start_range_server(data)
+        item = self.fetcher.enqueue(URL, size=100,
+                                    md5=md5(data).hexdigest())
+        self.fetcher.run(progress=Progress())
+        self.assertEquals(item.getStatus(), SUCCEEDED)
+        self.assertEquals(open(item.getTargetPath()).read(), data)
+        self.assertEquals(sorted([x[1:] for x in requests]),
+                          [(0, 33), (33, 66), (66, 100)])
+
+    def test_segments_use_mirrors(self):
+        self.set_segments(2)
+        data = "x"*100
+        requests = self.start_range_server(data)
+        mirror = "http://localhost:%d/" % PORT
+        self.fetcher.getMirrorSystem().setMirrors(
+            {"http://127.0.0.1:%d/" % PORT: [mirror]})
+        item = self.fetcher.enqueue(URL, size=100)
+        self.fetcher.run(progress=Progress())
+        self.assertEquals(item.getStatus(), SUCCEEDED)
+        self.assertEquals(sorted([x[0].split(":")[0] for x in requests]),
+                          ["127.0.0.1", "localhost"])
+
+    def test_segmented_download_is_validated(self):
+        self.set_segments(2)
+        requests = self.start_range_server("x"*100)
+        item = self.fetcher.enqueue(URL, size=100,
+                                    md5=md5("y"*100).hexdigest())
+        self.fetcher.run(progress=Progress())
+        self.assertEquals(item.getStatus(), FAILED)
+        self.assertEquals(len(requests), 2)
+
+    def test_mirrors_are_probed(self):
+        requests = []
+        class Handler(BaseHTTPServer.BaseHTTPRequestHandler):
+            protocol_version = "HTTP/1.1"
+            def do_HEAD(self):
+                requests.append((self.command, self.headers["Host"]))
+                self.send_response(200)
+                self.send_header("Content-Length", "4")
+                self.end_headers()
+            def do_GET(self):
+                self.do_HEAD()
+                self.wfile.write("data")
+            def log_message(self, format, *args):
+                pass
+        httpd = ThreadingHTTPServer(("127.0.0.1", PORT), Handler)
+        server_thread = threading.Thread(target=httpd.serve_forever)
+        server_thread.start()
+        def stop():
+            httpd.shutdown()
+            httpd.server_close()
+            server_thread.join()
+        self.addCleanup(stop)
+        sysconf.set("mirror-probe-threshold", 2, soft=True)
+        self.addCleanup(sysconf.remove, "mirror-probe-threshold", soft=True)
+        msys = self.fetcher.getMirrorSystem()
+        msys.setMirrors({"http://127.0.0.1:%d/" % PORT:
+                         ["http://localhost:%d/" % PORT]})
+        items = [self.fetcher.enqueue(URL+str(i)) for i in range(2)]
+        self.fetcher.run(progress=Progress())
+        for item in items:
+            self.assertEquals(item.getStatus(), SUCCEEDED)
+        heads = sorted([host.split(":")[0] for command, host in requests
+                        if command == "HEAD"])
+        self.assertEquals(heads, ["127.0.0.1", "localhost"])
+        for mirror in msys.getScores():
+            self.assertFalse(msys.needsProbe(mirror))
+
+    def test_content_store_avoids_downloads(self):
+        data = "x"*100
+        def handler(request):
+            request.send_response(200)
+            request.send_header("Content-Length", str(len(data)))
+            request.end_headers()
+            request.wfile.write(data)
+        self.start_server(handler)
+        sysconf.set("data-dir", self.makeDir(), soft=True)
+        sysconf.set("content-store-size", 1, soft=True)
+        self.addCleanup(sysconf.remove, "data-dir", soft=True)
+        self.addCleanup(sysconf.remove, "content-store-size", soft=True)
+        item = self.fetcher.enqueue(URL, sha256=sha256(data).hexdigest())
+        self.fetcher.run(progress=Progress())
+        self.assertEquals(item.getStatus(), SUCCEEDED)
+        self.server_thread.join()
+        # The same file from elsewhere isn't fetched again.
+        self.fetcher.reset()
+        self.fetcher.setLocalPathPrefix(self.local_path + "/other")
+        item = self.fetcher.enqueue(URL, sha256=sha256(data).hexdigest())
+        self.fetcher.run(progress=Progress())
+        self.assertEquals(item.getStatus(), SUCCEEDED)
+        path = item.getTargetPath()
+        self.assertEquals(os.path.basename(path), "otherfilename.pkg")
+        self.assertEquals(open(path).read(), data)
+
+    def test_conditional_requests_use_etag(self):
+        headers = []
+        def handler(request):
+            headers.append(request.headers.get("If-None-Match"))
+            if request.headers.get("If-None-Match") == '"tag"':
+                request.send_response(304)
+                request.end_headers()
+                return
+            request.send_response(200)
+            request.send_header("ETag", '"tag"')
+            request.send_header("Content-Length", "4")
+            request.end_headers()
+            request.wfile.write("data")
+        self.fetcher.setCaching(NEVER)
+        for i in range(2):
+            self.start_server(handler)
+            self.fetcher.reset()
+            item = self.fetcher.enqueue(URL)
+            self.fetcher.run(progress=Progress())
+            self.server_thread.join()
+            self.assertEquals(item.getStatus(), SUCCEEDED)
+            self.assertEquals(open(item.getTargetPath()).read(), "data")
+        self.assertEquals(headers, [None, '"tag"'])
+
+    def test_digests_are_computed_while_downloading(self):
+        data = "x"*100
+        def handler(request):
+            request.send_response(200)
+            request.send_header("Content-Length", str(len(data)))
+            request.end_headers()
+            request.wfile.write(data)
+        self.start_server(handler)
+        item = self.fetcher.enqueue(URL, md5=md5(data).hexdigest(),
+                                    sha256=sha256(data).hexdigest())
+        self.fetcher.run(progress=Progress())
+        self.assertEquals(item.getStatus(), SUCCEEDED)
+        path = item.getTargetPath()
+        digests = item.getDigests(path)
+        self.assertEquals(digests.hexdigest("md5"), md5(data).hexdigest())
+        # The file isn't read again while the digests are known.
+        open(path, "w").write("y"*100)
+        self.assertTrue(self.fetcher.validate(item, path))
+        item.reset()
+        self.assertEquals(item.getDigests(path), None)
+        valid, reason = self.fetcher.validate(item, path, withreason=True)
+        self.assertFalse(valid)
+        self.assertTrue(str(reason).startswith("Invalid MD5"))
+
+    def test_downloads_are_uncompressed_while_fetched(self):
+        data = "x"*100
+        file = StringIO()
+        gzfile = gzip.GzipFile(fileobj=file, mode="w")
+        gzfile.write(data)
+        gzfile.close()
+        gzdata = file.getvalue()
+        def handler(request):
+            request.send_response(200)
+            request.send_header("Content-Length", str(len(gzdata)))
+            request.end_headers()
+            request.wfile.write(gzdata)
+        self.start_server(handler)
+        item = self.fetcher.enqueue(URL+".gz", uncomp=True,
+                                    uncomp_md5=md5(data).hexdigest())
+        self.fetcher.run(progress=Progress())
+        self.assertEquals(item.getFailedReason(), None)
+        self.assertEquals(item.getStatus(), SUCCEEDED)
+        path = item.getTargetPath()
+        self.assertFalse(path.endswith(".gz"))
+        self.assertEquals(open(path).read(), data)
+        self.assertFalse(os.path.exists(path+".part"))
+        # Digests were computed while uncompressing.
+        self.assertEquals(item.getDigests(path).hexdigest("md5"),
+                          md5(data).hexdigest())
@@ -0,0 +1,38 @@
+import tempfile
+import unittest
+import shutil
+import sys
+import os
+
+from smart.hook import Hooks
+
+
+class HooksTest(unittest.TestCase):
+
+    def setUp(self):
+        self.tempdir = tempfile.mkdtemp()
+        sys.path.insert(0, self.tempdir)
+        self.hooks = Hooks()
+
+    def tearDown(self):
+        sys.path.remove(self.tempdir)
+        sys.modules.pop("hookmodule", None)
+        shutil.rmtree(self.tempdir)
+
+    def test_register_module(self):
+        file = open(os.path.join(self.tempdir, "hookmodule.py"), "w")
+        file.write("import tests.hook\n"
+                   "tests.hook.registered.append(1)\n"
+                   "tests.hook.hooks.register('hook', lambda: 'called')\n")
+        file.close()
+        global hooks, registered
+        hooks = self.hooks
+        registered = []
+        self.hooks.registerModule("hook", "hookmodule")
+        self.hooks.registerModule("hook", "hookmodule")
+        self.assertEquals(registered, [])
+        self.assertEquals(self.hooks.call("other"), [])
+        self.assertEquals(registered, [])
+        self.assertEquals(self.hooks.call("hook"), ["called"])
+        self.assertEquals(self.hooks.call("hook"), ["called"])
+        self.assertEquals(registered, [1])
@@ -0,0 +1,54 @@
+import unittest
+
+from smart.backends.deb.base import DebPackage, DebProvides, DebRequires
+from smart.cache import Cache, Loader
+from smart import sysconf
+
+
+class LoadPoolLoader(Loader):
+
+    def __init__(self, prefix):
+        Loader.__init__(self)
+        self._prefix = prefix
+
+    def load(self):
+        self._first = None
+        for i in range(3):
+            name = "%s%d" % (self._prefix, i)
+            pkg = self.buildPackage((DebPackage, name, "1.0"),
+                                    [(DebProvides, name, "1.0")],
+                                    [(DebRequires, "common", None, None)],
+                                    [], [])
+            pkg.loaders[self] = {"offset": i}
+            if self._first is None:
+                self._first = pkg
+
+
+class LoadPoolTest(unittest.TestCase):
+
+    def setUp(self):
+        sysconf.set("load-processes", 2, soft=True)
+
+    def tearDown(self):
+        sysconf.remove("load-processes", soft=True)
+
+    def test_load(self):
+        cache = Cache()
+        loaders = [LoadPoolLoader("a"), LoadPoolLoader("b")]
+        for loader in loaders:
+            cache.addLoader(loader)
+        cache.load()
+        self.assertEquals(sorted([str(pkg) for pkg in cache.getPackages()]),
+                          ["a0_1.0", "a1_1.0", "a2_1.0",
+                           "b0_1.0", "b1_1.0", "b2_1.0"])
+        for loader in loaders:
+            packages = loader.getPackages()
+            self.assertEquals(len(packages), 3)
+            self.assertTrue(loader._first in packages)
+            for pkg in packages:
+                self.assertEquals(pkg.loaders.keys(), [loader])
+            self.assertEquals(sorted([pkg.loaders[loader]["offset"]
+                                      for pkg in packages]), [0, 1, 2])
+        requires = cache.getRequires()
+        self.assertEquals(len(requires), 1)
+        self.assertEquals(len(requires[0].packages), 6)
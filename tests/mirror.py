@@ -0,0 +1,106 @@
+import unittest
+import time
+
+from smart.mirror import MirrorSystem, FAILUREHALFLIFE, PROBEDELAY
+
+
+ORIGIN = "http://origin/"
+FAST = "http://fast/"
+SLOW = "http://slow/"
+
+
+class MirrorSystemTest(unittest.TestCase):
+
+    def setUp(self):
+        self.msys = MirrorSystem()
+        self.msys.setMirrors({ORIGIN: [FAST, SLOW]})
+
+    def get_order(self, origin=True):
+        item = self.msys.get(ORIGIN+"file")
+        urls = []
+        url = item.getNext()
+        while url:
+            url = url[:-len("file")]
+            if origin or url != ORIGIN:
+                urls.append(url)
+            url = item.getNext()
+        return urls
+
+    def test_faster_mirrors_are_preferred(self):
+        for i in range(3):
+            self.msys.addInfo(FAST, size=1000000, time=1)
+            self.msys.addInfo(SLOW, size=100000, time=1)
+            self.msys.addInfo(ORIGIN, size=10000, time=1)
+        self.assertEquals(self.get_order(), [FAST, SLOW, ORIGIN])
+
+    def test_recent_downloads_matter_most(self):
+        for i in range(20):
+            self.msys.addInfo(FAST, size=1000000, time=1)
+            self.msys.addInfo(SLOW, size=100000, time=1)
+        for i in range(10):
+            self.msys.addInfo(FAST, size=10000, time=1)
+        penalities = self.msys.getPenalities()
+        self.assertTrue(penalities[FAST] > penalities[SLOW])
+
+    def test_failures_decay(self):
+        self.msys.addInfo(FAST, size=1000000, time=1)
+        self.msys.addInfo(SLOW, size=100000, time=1)
+        for i in range(30):
+            self.msys.addInfo(FAST, failed=1)
+        self.assertEquals(self.get_order(False), [SLOW, FAST])
+        scores = self.msys.getScores()
+        for mirror in scores:
+            throughput, latency, failures, updated, probed = scores[mirror]
+            scores[mirror] = (throughput, latency, failures,
+                              updated-FAILUREHALFLIFE*10, probed)
+        self.msys.setScores(scores)
+        self.assertEquals(self.get_order(False), [FAST, SLOW])
+
+    def test_close_mirrors_share_the_load(self):
+        self.msys.addInfo(FAST, size=1000000, time=1)
+        self.msys.addInfo(SLOW, size=1010000, time=1)
+        self.msys.addInfo(ORIGIN, size=10000, time=1)
+        first = {}
+        for i in range(100):
+            first[self.get_order()[0]] = True
+        self.assertEquals(sorted(first), [FAST, SLOW])
+
+    def test_latency(self):
+        self.msys.addInfo(FAST, size=1000000, time=1, latency=1)
+        self.msys.addInfo(SLOW, size=500000, time=1, latency=0.01)
+        self.assertEquals(self.get_order(False), [SLOW, FAST])
+
+    def test_needs_probe(self):
+        self.assertTrue(self.msys.needsProbe(FAST))
+        self.msys.addInfo(FAST, size=1000000, time=1)
+        self.assertTrue(self.msys.needsProbe(FAST))
+        self.msys.addInfo(FAST, latency=0.1)
+        self.assertFalse(self.msys.needsProbe(FAST))
+        throughput, latency, failures, updated, probed = \
+            self.msys.getScores()[FAST]
+        self.msys.setScores({FAST: (throughput, latency, failures, updated,
+                                    time.time()-PROBEDELAY-1)})
+        self.assertTrue(self.msys.needsProbe(FAST))
+        # Downloads and failures don't measure the latency again.
+        self.msys.addInfo(FAST, failed=1)
+        self.msys.addInfo(FAST, size=1000000, time=1)
+        self.assertTrue(self.msys.needsProbe(FAST))
+        self.msys.addInfo(FAST, latency=0.1)
+        self.assertFalse(self.msys.needsProbe(FAST))
+
+    def test_rewind(self):
+        item = self.msys.get(ORIGIN+"file")
+        first = item.getNext()
+        self.assertEquals(len(item.getCandidates()), 3)
+        for i in range(3):
+            self.msys.addInfo(first[:-len("file")], failed=1)
+        self.assertNotEquals(item.rewind(), first)
+        self.assertEquals(len(item.getCandidates()), 3)
+
+    def test_history(self):
+        self.msys.addHistory([(SLOW, {"size": 100000, "time": 1}),
+                              (FAST, {"failed": 1}),
+                              (FAST, {"size": 1000000, "time": 1})])
+        self.assertTrue(self.msys.getScoresChanged())
+        self.assertEquals(sorted(self.msys.getScores()), [FAST, SLOW])
+        self.assertEquals(self.msys.getScores()[FAST][2], 1)
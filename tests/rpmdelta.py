@@ -0,0 +1,170 @@
+import SimpleHTTPServer
+import BaseHTTPServer
+import threading
+import glob
+import os
+
+from smart.backends.rpm.metadata import RPMMetaDataLoader
+from smart.backends.rpm.base import RPMPackage, RPMNameProvides
+from smart.backends.rpm import metadata
+from smart.channel import createChannel, PackageChannel
+from smart.control import getBestDelta
+from smart.cache import Cache, Loader
+
+from tests.mocker import MockerTestCase
+from tests import TESTDATADIR, ctrl
+
+
+PORT = 43544
+
+
+class InstalledLoader(Loader):
+
+    def __init__(self, packages):
+        Loader.__init__(self)
+        self._pkgargs = packages
+        self._installed = True
+
+    def getChannel(self):
+        return PackageChannel("rpm-sys", "installed")
+
+    def load(self):
+        for name, version in self._pkgargs:
+            version += "@noarch"
+            self.buildPackage((RPMPackage, name, version),
+                              [(RPMNameProvides, name, version)],
+                              [], [], [])
+
+
+class YumRpmDeltaTest(MockerTestCase):
+
+    def setUp(self):
+        self.datadir = os.path.join(TESTDATADIR, "yumrpm")
+        self.set_base_url("http://127.0.0.1:%d" % PORT)
+
+        # Pretend that applydeltarpm is available, and fails.
+        self.applylog = self.makeFile()
+        applydeltarpm = self.makeFile("#!/bin/sh\necho \"$@\" >> %s\n"
+                                      "exit 1\n" % self.applylog)
+        os.chmod(applydeltarpm, 0755)
+        self.applydeltarpm = metadata.APPLYDELTARPM
+        metadata.APPLYDELTARPM = applydeltarpm
+
+    def tearDown(self):
+        metadata.APPLYDELTARPM = self.applydeltarpm
+
+    def set_base_url(self, baseurl):
+        self.baseurl = baseurl
+        repodata = os.path.join(self.datadir, "repodata")
+        primary, = glob.glob(os.path.join(repodata, "*-primary.xml.gz"))
+        filelists, = glob.glob(os.path.join(repodata, "*-filelists.xml.gz"))
+        self.channel = createChannel("alias", {"type": "rpm-md",
+                                               "baseurl": baseurl})
+        self.loader = RPMMetaDataLoader(primary, filelists, baseurl,
+                                        os.path.join(self.datadir,
+                                                     "prestodelta.xml"))
+        self.loader.setChannel(self.channel)
+        self.cache = Cache()
+        self.cache.addLoader(self.loader)
+
+    def fetch(self, pkg):
+        ctrl._achanset.setChannels([self.channel])
+        try:
+            return ctrl.fetchPackages([pkg])
+        finally:
+            ctrl._achanset.setChannels([])
+
+    def load(self, installed):
+        self.cache.addLoader(InstalledLoader(installed))
+        self.cache.load()
+        return dict([(pkg.name, pkg) for pkg in self.loader.getPackages()])
+
+    def get_best_delta(self, pkg):
+        info = self.loader.getInfo(pkg)
+        return getBestDelta(info, info.getURLs()[0])
+
+    def test_deltas(self):
+        pkg = self.load([])["name2"]
+        info = self.loader.getInfo(pkg)
+        deltas = info.getDeltas(info.getURLs()[0])
+        self.assertEquals([(delta.getURL(), delta.getSize())
+                           for delta in deltas],
+                          [(self.baseurl+"/name2-version1-release1_"
+                                         "version2-release2.noarch.drpm", 31),
+                           (self.baseurl+"/name2-version0-release0_"
+                                         "version2-release2.noarch.drpm", 20)])
+        self.assertEquals(deltas[0].getSHA256(), "d5b255aea68a9fafe3b7431d"
+                          "b9ef62fe0ddcca64e0b4079cb12fdcc67d3efd58")
+
+    def test_best_delta_is_applicable(self):
+        pkgs = self.load([("name2", "version1-release1")])
+        delta = self.get_best_delta(pkgs["name2"])
+        self.assertEquals(delta.getSize(), 31)
+        self.assertTrue(delta.isApplicable())
+
+    def test_no_delta_without_old_version(self):
+        pkgs = self.load([("name2", "version3-release3")])
+        self.assertEquals(self.get_best_delta(pkgs["name2"]), None)
+
+    def test_no_delta_larger_than_package(self):
+        pkgs = self.load([("name1", "version0-release0")])
+        self.assertEquals(self.get_best_delta(pkgs["name1"]), None)
+
+    def test_no_delta_without_applydeltarpm(self):
+        pkgs = self.load([("name2", "version1-release1")])
+        metadata.APPLYDELTARPM = self.makeFile()
+        self.assertEquals(self.get_best_delta(pkgs["name2"]), None)
+
+    def test_apply_does_not_use_a_shell(self):
+        pkg = self.load([("name2", "version1-release1")])["name2"]
+        delta = self.get_best_delta(pkg)
+        argslog = self.makeFile()
+        metadata.APPLYDELTARPM = self.makeFile(
+            "#!/bin/sh\nfor arg in \"$@\"; do echo \"$arg\"; done > %s\n"
+            % argslog)
+        os.chmod(metadata.APPLYDELTARPM, 0755)
+        dir = self.makeDir()
+        marker = os.path.join(dir, "marker")
+        localpath = os.path.join(dir, "name 2;touch %s;.drpm" % marker)
+        targetpath = os.path.join(dir, "name2.rpm")
+        delta.apply(localpath, targetpath)
+        self.assertEquals(open(argslog).read().splitlines(),
+                          ["-a", "noarch", localpath, targetpath])
+        self.assertFalse(os.path.exists(marker))
+
+    def test_package_is_fetched_when_delta_fails(self):
+        pkg = self.load([("name2", "version1-release1")])["name2"]
+        datadir = self.datadir
+        class Handler(SimpleHTTPServer.SimpleHTTPRequestHandler):
+            def translate_path(self, path):
+                return os.path.join(datadir, path.lstrip("/"))
+            def log_message(self, format, *args):
+                pass
+        httpd = BaseHTTPServer.HTTPServer(("127.0.0.1", PORT), Handler)
+        thread = threading.Thread(target=httpd.serve_forever)
+        thread.start()
+        try:
+            pkgpaths = self.fetch(pkg)
+        finally:
+            httpd.shutdown()
+            httpd.server_close()
+            thread.join()
+        self.assertEquals(len(open(self.applylog).readlines()), 1)
+        path, = pkgpaths[pkg]
+        self.assertEquals(open(path).read(),
+                          open(os.path.join(self.datadir,
+                                            os.path.basename(path))).read())
+        self.assertFalse(os.path.exists(os.path.join(os.path.dirname(path),
+                         "name2-version1-release1_version2-release2"
+                         ".noarch.drpm")))
+
+    def test_local_packages_are_used_without_deltas(self):
+        self.set_base_url("file://"+self.datadir)
+        pkg = self.load([("name2", "version1-release1")])["name2"]
+        deltapath = os.path.join(self.datadir, "name2-version1-release1_"
+                                               "version2-release2.noarch.drpm")
+        self.assertEquals(self.fetch(pkg)[pkg],
+                          [os.path.join(self.datadir,
+                                        "name2-version2-release2.noarch.rpm")])
+        self.assertFalse(os.path.exists(self.applylog))
+        self.assertTrue(os.path.isfile(deltapath))
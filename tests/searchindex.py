@@ -0,0 +1,183 @@
+import tempfile
+import unittest
+import shutil
+import os
+
+from smart.searchindex import SearchIndex, NameIndex
+from smart.searchindex import getPatternWords, getMaxDistance
+from smart.backends.deb.loader import DebTagFileLoader, DEBARCH
+from smart.searcher import Searcher
+from smart.control import Control
+from smart.cache import Cache
+from smart import sysconf
+
+
+SECTION = """\
+Package: %(name)s
+Section: %(section)s
+Architecture: %(arch)s
+Version: 1.0
+Description: %(summary)s
+ %(description)s
+
+"""
+
+PACKAGES = [
+    ("editor", "editors", "Text editor", "Edits text files."),
+    ("browser", "web", "Web browser", "Browses the web, with tabs."),
+    ("libfoo", "libs", "Foo library", "Shared library for foo-bar."),
+]
+
+
+class SearchIndexTest(unittest.TestCase):
+
+    def setUp(self):
+        self.tempdir = tempfile.mkdtemp()
+        filename = os.path.join(self.tempdir, "Packages")
+        file = open(filename, "w")
+        for name, section, summary, description in PACKAGES:
+            file.write(SECTION % {"name": name, "section": section,
+                                  "arch": DEBARCH, "summary": summary,
+                                  "description": description})
+        file.close()
+        sysconf.set("search-index", True, soft=True)
+        self.cache = Cache()
+        self.loader = DebTagFileLoader(filename)
+        self.cache.addLoader(self.loader)
+        self.cache.load()
+
+    def tearDown(self):
+        sysconf.remove("search-index", soft=True)
+        shutil.rmtree(self.tempdir)
+
+    def search(self, query, cutoff=1.0):
+        searcher = Searcher()
+        searcher.addAuto(query, cutoff)
+        self.cache.search(searcher)
+        return sorted([pkg.name for ratio, pkg in searcher.getResults()])
+
+    def test_pattern_words(self):
+        self.assertEquals(getPatternWords("*Foo-bar?baz[xy]*"),
+                          ["foo", "bar", "baz"])
+        self.assertEquals(getPatternWords("*"), [])
+
+    def test_index_is_built(self):
+        index = self.loader._searchindex
+        self.assertTrue(index.isValid(self.loader.getPackages()))
+        candidates = index.getCandidates([["web"]])
+        self.assertEquals([pkg.name for pkg in candidates], ["browser"])
+        self.assertEquals(index.getCandidates([["web"], []]), None)
+
+    def test_candidates_after_pickling(self):
+        import cPickle
+        # Packages are pickled only along with their cache.
+        built = self.loader._searchindex
+        index = SearchIndex([pkg.name for pkg in built._packages])
+        index._words = built._words
+        queries = [[["web"]], [["ib"]], [["e"], ["tabs", "web"]],
+                   [["missing"]]]
+        results = [index.getCandidates(query) for query in queries]
+        self.assertEquals(results[1], ["libfoo"])
+        # The vocabulary is built again when needed, not pickled.
+        index = cPickle.loads(cPickle.dumps(index, 2))
+        self.assertEquals(index._vocabulary, None)
+        self.assertEquals([index.getCandidates(query) for query in queries],
+                          results)
+
+    def test_search(self):
+        self.assertEquals(self.search("summary:*brow*"), ["browser"])
+        self.assertEquals(self.search("description:*foo-bar*"), ["libfoo"])
+        self.assertEquals(self.search("description:*TEXT files*"),
+                          ["editor"])
+        self.assertEquals(self.search("group:lib?"), ["libfoo"])
+        self.assertEquals(self.search("summary:*e*"),
+                          ["browser", "editor"])
+        self.assertEquals(self.search("summary:*missing*"), [])
+
+    def test_search_matches_unindexed_search(self):
+        queries = ["summary:*brow*", "description:*with tabs*",
+                   "group:*s", "description:*", "summary:foo*"]
+        results = [self.search(query) for query in queries]
+        del self.loader._searchindex
+        self.assertEquals([self.search(query) for query in queries], results)
+
+    def test_stale_index_is_not_used(self):
+        self.loader._searchindex = SearchIndex()
+        self.assertEquals(self.search("summary:*brow*"), ["browser"])
+
+    def test_max_distance(self):
+        self.assertEquals(getMaxDistance("editor", 1.0), 0)
+        self.assertEquals(getMaxDistance("editor", 0.7), 2)
+        self.assertEquals(getMaxDistance("editor", 3), 3)
+        self.assertEquals(getMaxDistance("edit*", 0.7), None)
+        self.assertEquals(getMaxDistance("edit?r", 0.7), None)
+
+    def test_name_candidates(self):
+        index = self.loader._nameindex
+        self.assertEquals(sorted(index.getCandidates("brwser", 2)),
+                          ["browser"])
+        self.assertEquals(index.getCandidates("brwser", 0), [])
+
+    def test_search_names(self):
+        self.assertEquals(self.search("libfoo"), ["libfoo"])
+        self.assertEquals(self.search("brwser", 0.7), ["browser"])
+        self.assertEquals(self.search("EDITR", 0.7), ["editor"])
+        self.assertEquals(self.search("editor_1.0"), ["editor"])
+        self.assertEquals(self.search("edit*"), ["editor"])
+
+    def test_search_names_matches_unindexed_search(self):
+        queries = ["brwser", "libf", "editor-1.0", "editor_1.0", "xyz",
+                   "lib-foo", "ed"]
+        results = [self.search(query, 0.7) for query in queries]
+        del self.loader._nameindex
+        self.assertEquals([self.search(query, 0.7) for query in queries],
+                          results)
+
+    def test_stale_name_index_is_not_used(self):
+        self.loader._nameindex = NameIndex()
+        self.assertEquals(self.search("brwser", 0.7), ["browser"])
+
+    def test_index_is_saved_with_the_cache(self):
+        admindir = os.path.join(self.tempdir, "dpkg")
+        os.mkdir(admindir)
+        file = open(os.path.join(admindir, "status"), "w")
+        for name, section, summary, description in PACKAGES:
+            file.write(("Status: install ok installed\n"+SECTION) %
+                       {"name": name, "section": section, "arch": DEBARCH,
+                        "summary": summary, "description": description})
+        file.close()
+        olddatadir = sysconf.get("data-dir")
+        sysconf.set("data-dir", os.path.join(self.tempdir, "data"), soft=True)
+        sysconf.set("deb-admindir", admindir, soft=True)
+        sysconf.set("channels", {"index": {"type": "deb-sys"}}, soft=True)
+
+        built = []
+        originalbuild = SearchIndex.build
+        def build(index, loader):
+            built.append(loader)
+            originalbuild(index, loader)
+        SearchIndex.build = build
+
+        def run():
+            del built[:]
+            ctrl = Control(None, True)
+            ctrl.reloadChannels()
+            ctrl.saveSysConf()
+            return ctrl.getCache().getLoaders()[0], len(built)
+
+        try:
+            # The cache is saved without an index first, and the index
+            # built on the next run must be saved with it.
+            sysconf.set("search-index", False, soft=True)
+            run()
+            sysconf.set("search-index", True, soft=True)
+            self.assertEquals(run()[1], 1)
+            loader, count = run()
+            self.assertEquals(count, 0)
+            self.assertTrue(loader._searchindex.isValid(loader._packages))
+        finally:
+            SearchIndex.build = originalbuild
+            sysconf.remove("channels", soft=True)
+            sysconf.remove("deb-admindir", soft=True)
+            sysconf.set("data-dir", olddatadir, soft=True)
+            sysconf.setReadOnly(False)
@@ -2,6 +2,7 @@ import unittest
 import sys
 
 from smart.sorter import ElementSorter, DisableError
+from smart.sorter import getStronglyConnected, findLoops, isReachable
 
 
 if sys.version_info < (2, 4):
@@ -175,6 +176,30 @@ class ElementSorterTest(unittest.TestCase):
         loops = self.sorter.getLoops()
         self.assertEquals(len(loops), 1)
 
+    def test_countRelationsInLoop(self):
+        sorter = self.sorter
+        relations = [(0, 2), (1, 2), (2, 1), (2, 3), (3, 0)]
+        for pred, succ in relations:
+            sorter.addSuccessor(pred, succ)
+        # (1, 2) is in two loops, but is only counted once.
+        self.assertEquals(sorter.countRelationsInLoop(range(4), relations),
+                          5)
+        # Without (0, 2), only the loop between 1 and 2 is left.
+        self.assertEquals(sorter.countRelationsInLoop([1], relations[1:]),
+                          2)
+        self.assertEquals(sorter.countRelationsInLoop([0], relations[1:]),
+                          0)
+
+    def test_countRelationsInLoop_with_relations_out_of_path(self):
+        sorter = self.sorter
+        relations = [(0, 3), (1, 2), (2, 1), (2, 3), (3, 0), (3, 1)]
+        for pred, succ in relations:
+            sorter.addSuccessor(pred, succ)
+        # Every relation is in a loop, even though no single path
+        # from one element back to it goes through all of them.
+        self.assertEquals(sorter.countRelationsInLoop(range(4), relations),
+                          6)
+
     def test_sorting(self):
         sorter = self.sorter
         sorter.addSuccessor(0, 1)
@@ -239,3 +264,69 @@ class ElementSorterTest(unittest.TestCase):
             sorter.addSuccessor(i+1, i)
         sorter.addSuccessor(0, 5)
         self.assertEquals(sorter.getSorted(), [0, 1, 2, 3, 4, 5])
+
+
+class GraphTest(unittest.TestCase):
+
+    def test_getStronglyConnected(self):
+        successors = {0: [1], 1: [2, 3], 2: [0], 3: [4], 4: [3], 5: []}
+        components = [set(x) for x in getStronglyConnected(successors)]
+        self.assertEquals(sorted([sorted(x) for x in components]),
+                          [[0, 1, 2], [3, 4], [5]])
+        # Successors come before their predecessors.
+        self.assertTrue(components.index(set([3, 4])) <
+                        components.index(set([0, 1, 2])))
+
+    def test_getStronglyConnected_with_ignore(self):
+        successors = {0: [1], 1: [2], 2: [0, 1]}
+        components = [set(x) for x in
+                      getStronglyConnected(successors, ignore=(2, 0))]
+        self.assertEquals(components, [set([1, 2]), set([0])])
+
+    def test_getStronglyConnected_with_deep_graph(self):
+        successors = dict([(i, [i+1]) for i in range(10000)])
+        successors[10000] = [0]
+        components = getStronglyConnected(successors)
+        self.assertEquals(len(components), 1)
+        self.assertEquals(len(components[0]), 10001)
+
+    def test_findLoops(self):
+        successors = {0: [1], 1: [0, 2], 2: [3], 3: []}
+        self.assertEquals(findLoops(successors),
+                          [(set([0, 1]), set([(0, 1), (1, 0)]))])
+
+    def test_findLoops_without_loops(self):
+        self.assertEquals(findLoops({0: [1], 1: [2], 3: [2]}), [])
+
+    def test_findLoops_with_self_loop(self):
+        successors = {0: [0, 1], 1: [2]}
+        self.assertEquals(findLoops(successors),
+                          [(set([0]), set([(0, 0)]))])
+        self.assertEquals(findLoops(successors, ignore=(0, 0)), [])
+
+    def test_findLoops_with_ignore(self):
+        # Ignoring (0, 1) leaves the loop between 0 and 2 only.
+        successors = {0: [1, 2], 1: [0], 2: [0]}
+        self.assertEquals(findLoops(successors, ignore=(0, 1)),
+                          [(set([0, 2]), set([(0, 2), (2, 0)]))])
+        # The ignored relation is left out even when its elements are
+        # still in the same loop through other relations.
+        successors = {0: [1, 2], 1: [2], 2: [0]}
+        self.assertEquals(findLoops(successors, ignore=(0, 2)),
+                          [(set([0, 1, 2]), set([(0, 1), (1, 2), (2, 0)]))])
+
+    def test_isReachable(self):
+        successors = {0: [1], 1: [2], 2: [1], 3: [0]}
+        self.assertTrue(isReachable(0, 2, successors))
+        self.assertTrue(isReachable(3, 2, successors))
+        self.assertTrue(isReachable(2, 2, successors))
+        self.assertFalse(isReachable(2, 0, successors))
+        self.assertFalse(isReachable(0, 4, successors))
+
+    def test_isReachable_with_ignore(self):
+        successors = {0: [1, 2], 1: [3], 2: [3]}
+        self.assertTrue(isReachable(0, 3, successors, ignore=(0, 1)))
+        self.assertTrue(isReachable(0, 3, successors, ignore=(1, 3)))
+        self.assertFalse(isReachable(0, 1, successors, ignore=(0, 1)))
+        successors = {0: [1], 1: [3]}
+        self.assertFalse(isReachable(0, 3, successors, ignore=(1, 3)))
@@ -0,0 +1,241 @@
+import unittest
+import random
+
+from smart.backends.deb.base import DebPackage, DebNameProvides, DebProvides
+from smart.backends.deb.base import DebRequires, DebUpgrades
+from smart.transaction import Transaction, ChangeSet, PolicyInstall
+from smart.transaction import PolicyRemove, PolicyUpgrade
+from smart.transaction import JournalDict, Failed, INSTALL, REMOVE
+from smart.channel import PackageChannel
+from smart.cache import Cache, Loader
+from smart import sysconf
+
+
+class TransactionLoader(Loader):
+
+    def getChannel(self):
+        return PackageChannel("transaction", "available")
+
+    def load(self):
+        # "a" requires "service", provided by "b1", and by "b2", which
+        # also needs "c". "d" can't be installed at all.
+        for name, prvargs, reqargs in [
+            ("a", [], [(DebRequires, "service", None, None)]),
+            ("b1", [(DebProvides, "service", None)], []),
+            ("b2", [(DebProvides, "service", None)],
+             [(DebRequires, "c", None, None)]),
+            ("c", [], []),
+            ("d", [], [(DebRequires, "missing", None, None)])]:
+            self.buildPackage((DebPackage, name, "1.0"),
+                              [(DebNameProvides, name, "1.0")]+prvargs,
+                              reqargs, [], [])
+
+
+class UpgradeLoader(Loader):
+
+    def __init__(self, versions, installed):
+        Loader.__init__(self)
+        self._versions = versions
+        self._installed = installed
+
+    def getChannel(self):
+        return PackageChannel("transaction", str(self._installed))
+
+    def load(self):
+        for name in ("x", "y", "z"):
+            for version in self._versions:
+                self.buildPackage((DebPackage, name, version),
+                                  [(DebNameProvides, name, version)], [],
+                                  [(DebUpgrades, name, "<<", version)], [])
+
+
+class TransactionTest(unittest.TestCase):
+
+    def setUp(self):
+        self.cache = Cache()
+        self.cache.addLoader(TransactionLoader())
+        self.cache.load()
+        self.pkgs = dict([(pkg.name, pkg) for pkg in
+                          self.cache.getPackages()])
+        self.trans = Transaction(self.cache, PolicyInstall)
+
+    def tearDown(self):
+        sysconf.remove("solver-budget", soft=True)
+
+    def start(self):
+        self.trans.getPolicy().runStarting()
+
+    def install(self, name):
+        self.trans.enqueue(self.pkgs[name], INSTALL)
+        self.trans.run()
+        return sorted([pkg.name for pkg in self.trans.getChangeSet()])
+
+    def test_journal_rollback(self):
+        d = JournalDict({1: 1, 2: 2})
+        mark = d.fork()
+        d[2] = 3
+        d[4] = 4
+        del d[1]
+        inner = d.fork()
+        d[5] = 5
+        self.assertEquals(d.getChanges(inner), {5: 5})
+        d.rollback(inner)
+        self.assertEquals(d.getChanges(mark), {1: None, 2: 3, 4: 4})
+        d.rollback(mark)
+        self.assertEquals(d, {1: 1, 2: 2})
+        self.assertEquals(d._journal, None)
+
+    def test_journal_nested_rollback(self):
+        # Both forks get mark 0, but rolling back the inner one must
+        # keep journaling for the outer one.
+        d = JournalDict({1: 1})
+        mark = d.fork()
+        inner = d.fork()
+        self.assertEquals((mark, inner), (0, 0))
+        d.rollback(inner)
+        d[1] = 2
+        d[2] = 2
+        self.assertEquals(d.getChanges(mark), {1: 2, 2: 2})
+        d.rollback(mark)
+        self.assertEquals(d, {1: 1})
+        self.assertEquals(d._journal, None)
+
+    def test_journal_set_changes(self):
+        d = JournalDict({1: 1, 2: 2})
+        d.setChanges({1: None, 2: 3, 4: 4})
+        self.assertEquals(d, {2: 3, 4: 4})
+
+    def test_journal_version(self):
+        d = JournalDict({1: 1, 2: 2})
+        version = d.getVersion()
+        self.assertEquals(d.getVersion(), version)
+        mark = d.fork()
+        d[3] = 3
+        inner = d.getVersion()
+        self.assertNotEquals(inner, version)
+        innermark = d.fork()
+        del d[1]
+        self.assertNotEquals(d.getVersion(), inner)
+        d.rollback(innermark)
+        self.assertEquals(d.getVersion(), inner)
+        d.rollback(mark)
+        self.assertEquals(d.getVersion(), version)
+        self.assertNotEquals(d.copy().getVersion(), version)
+
+    def test_changeset_rollback_keeps_requested(self):
+        a = self.pkgs["a"]
+        changeset = ChangeSet(self.cache)
+        changeset.set(a, INSTALL)
+        changeset.setRequested(a, True)
+        mark = changeset.fork()
+        changeset.set(a, REMOVE)
+        self.assertFalse(changeset.getRequested(a))
+        self.assertEquals(changeset.getChanges(mark), {a: None})
+        changeset.rollback(mark)
+        self.assertEquals(changeset, {a: INSTALL})
+        self.assertTrue(changeset.getRequested(a))
+
+    def test_changeset_version(self):
+        a, b1 = self.pkgs["a"], self.pkgs["b1"]
+        changeset = ChangeSet(self.cache, {a: INSTALL, b1: REMOVE})
+        version = changeset.getVersion()
+        changeset.setRequested(a, True)
+        self.assertNotEquals(changeset.getVersion(), version)
+        version = changeset.getVersion()
+        changeset.setState(ChangeSet(self.cache, {a: INSTALL}))
+        self.assertNotEquals(changeset.getVersion(), version)
+
+    def test_try_is_remembered(self):
+        trans = self.trans
+        self.start()
+        changeset = ChangeSet(self.cache)
+        locked = JournalDict()
+        a, b1 = self.pkgs["a"], self.pkgs["b1"]
+        weight, cs, lk = trans._try(INSTALL, a, changeset, locked)
+        self.assertEquals(cs, {a: INSTALL, b1: INSTALL})
+        self.assertEquals(changeset, {})
+        self.assertEquals(locked, {})
+        explored = trans._explored
+        self.assertEquals(trans._try(INSTALL, a, changeset, locked),
+                          (weight, cs, lk))
+        self.assertEquals(trans._explored, explored)
+
+    def test_try_on_changed_state(self):
+        trans = self.trans
+        self.start()
+        a, b2, c = [self.pkgs[x] for x in ("a", "b2", "c")]
+        locked = JournalDict()
+        changeset = ChangeSet(self.cache, {c: INSTALL})
+        self.assertEquals(trans._try(INSTALL, a, changeset, locked)[1],
+                          {a: INSTALL, b2: INSTALL})
+        del changeset[c]
+        changeset[b2] = INSTALL
+        self.assertEquals(trans._try(INSTALL, a, changeset, locked)[1],
+                          {a: INSTALL})
+
+    def test_try_failure_is_remembered(self):
+        trans = self.trans
+        self.start()
+        changeset = ChangeSet(self.cache)
+        locked = JournalDict()
+        d = self.pkgs["d"]
+        self.assertRaises(Failed, trans._try, INSTALL, d, changeset, locked)
+        self.assertRaises(Failed, trans._try, INSTALL, d, changeset, locked)
+        self.assertEquals(trans._explored, 1)
+        self.assertEquals(changeset, {})
+        self.assertEquals(locked, {})
+
+    def test_install_picks_best_alternative(self):
+        self.assertEquals(self.install("a"), ["a", "b1"])
+
+    def test_install_with_exhausted_budget(self):
+        sysconf.set("solver-budget", 1, soft=True)
+        self.assertEquals(self.install("a"), ["a", "b2", "c"])
+
+    def test_run_forgets_outcomes(self):
+        self.install("a")
+        self.assertEquals(self.trans._memo, {})
+        self.assertEquals(self.trans._explored, 0)
+
+    def test_incremental_weight(self):
+        cache = Cache()
+        cache.addLoader(UpgradeLoader(["1.0"], True))
+        cache.addLoader(UpgradeLoader(["2.0", "3.0"], False))
+        cache.load()
+        pkgs = cache.getPackages()
+        rand = random.Random(0)
+        for policy in (PolicyInstall, PolicyRemove, PolicyUpgrade):
+            trans = Transaction(cache, policy)
+            policy = trans.getPolicy()
+            policy.runStarting()
+            changeset = ChangeSet(cache, {pkgs[0]: INSTALL})
+            changeset.setIncrementalWeight(policy.getIncrementalWeight())
+            marks = []
+            for i in range(300):
+                choice = rand.random()
+                if choice < 0.1:
+                    marks.append(changeset.fork())
+                elif choice < 0.2 and marks:
+                    changeset.rollback(marks.pop())
+                else:
+                    changeset.set(rand.choice(pkgs),
+                                  rand.choice((INSTALL, REMOVE)))
+                self.assertAlmostEquals(trans._getWeight(changeset),
+                                        policy.getWeight(changeset))
+            changeset.clear()
+            self.assertEquals(trans._getWeight(changeset), 0)
+            policy.runFinished()
+
+    def test_incremental_weight_with_own_get_weight(self):
+        for policy in (PolicyInstall, PolicyRemove, PolicyUpgrade):
+            class OwnWeightPolicy(policy):
+                def getWeight(self, changeset):
+                    return -len(changeset)
+            trans = Transaction(self.cache, OwnWeightPolicy)
+            weight = trans.getPolicy().getIncrementalWeight()
+            self.assertEquals(weight, None)
+            changeset = ChangeSet(self.cache, {self.pkgs["a"]: INSTALL})
+            changeset.setIncrementalWeight(weight)
+            self.assertEquals(trans._getWeight(changeset), -1)
+            trans = Transaction(self.cache, policy)
+            self.assertTrue(trans.getPolicy().getIncrementalWeight())
@@ -44,3 +44,59 @@ class UncompressorTest(unittest.TestCase):
     def test_7zip(self):
         self.uncompress_file("%s/uncompress/test.7z" % TESTDATADIR)
 
+
+    def open_file(self, file):
+        uncompressed = Uncompressor().open(file)
+        data = ""
+        chunk = uncompressed.read(7)
+        while chunk:
+            self.assertTrue(len(chunk) <= 7)
+            data += chunk
+            chunk = uncompressed.read(7)
+        uncompressed.close()
+        orig = "%s/uncompress/test.txt" % TESTDATADIR
+        self.assertEquals(data, open(orig).read())
+
+    def test_open_gzip(self):
+        self.open_file("%s/uncompress/test.gz" % TESTDATADIR)
+
+    def test_open_bzip2(self):
+        self.open_file("%s/uncompress/test.bz2" % TESTDATADIR)
+
+    def test_open_concatenated_gzip(self):
+        import tempfile
+        import shutil
+        import gzip
+        orig = "%s/uncompress/test.txt" % TESTDATADIR
+        data = open(orig).read()
+        tempdir = tempfile.mkdtemp()
+        try:
+            path = os.path.join(tempdir, "test.gz")
+            # Each write goes to a gzip member of its own.
+            for part in data[:10], data[10:]:
+                file = gzip.GzipFile(path, "a")
+                file.write(part)
+                file.close()
+            uncompressed = Uncompressor().open(path)
+            self.assertEquals(uncompressed.read(), data)
+            uncompressed.close()
+        finally:
+            shutil.rmtree(tempdir)
+
+    def test_open_uncompressed(self):
+        self.open_file("%s/uncompress/test.txt" % TESTDATADIR)
+
+    def test_open_corrupted(self):
+        from smart import Error
+        import tempfile
+        import shutil
+        tempdir = tempfile.mkdtemp()
+        try:
+            path = os.path.join(tempdir, "test.bz2")
+            file = open(path, "w")
+            file.write("garbage")
+            file.close()
+            uncompressed = Uncompressor().open(path)
+            self.assertRaises(Error, uncompressed.read)
+        finally:
+            shutil.rmtree(tempdir)
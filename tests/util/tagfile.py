@@ -0,0 +1,79 @@
+import tempfile
+import shutil
+import os
+
+from tests.mocker import MockerTestCase
+
+from smart.util.tagfile import TagFile, TagFileIndex
+
+
+TAGFILE = """\
+Package: name1
+Version: 1.0
+Description: Summary 1
+ First line.
+ .
+   Indented line.\t
+ Last line.  
+
+Package: name2
+description  :   Summary 2   
+Version: 2.0
+
+
+Package: name3
+Version: 3.0
+"""
+
+
+class TagFileIndexTest(MockerTestCase):
+
+    def setUp(self):
+        self.tempdir = tempfile.mkdtemp()
+        self.filename = os.path.join(self.tempdir, "Packages")
+        file = open(self.filename, "w")
+        file.write(TAGFILE)
+        file.close()
+        self.index = TagFileIndex(self.filename, ("Description", "version"))
+        self.index.build()
+
+    def tearDown(self):
+        shutil.rmtree(self.tempdir)
+
+    def get_sections(self):
+        tagfile = TagFile(self.filename)
+        sections = []
+        offset = 0
+        while tagfile.advanceSection():
+            sections.append((offset, tagfile.copy()))
+            offset = tagfile.getOffset()
+        return sections
+
+    def test_values_match_tagfile(self):
+        sections = self.get_sections()
+        self.assertEquals(len(sections), 3)
+        for offset, section in sections:
+            for field in ("description", "version"):
+                self.assertEquals(self.index.getValue(offset, field),
+                                  section.get(field))
+
+    def test_missing_field(self):
+        offset = self.get_sections()[2][0]
+        self.assertEquals(self.index.getSpan(offset, "description"), None)
+        self.assertEquals(self.index.getValue(offset, "description", ""), "")
+
+    def test_unknown_offset(self):
+        self.assertEquals(self.index.getValue(1, "version"), None)
+
+    def test_is_valid(self):
+        self.assertTrue(self.index.isValid())
+        file = open(self.filename, "a")
+        file.write("\nPackage: name4\n")
+        file.close()
+        self.assertFalse(self.index.isValid())
+
+    def test_pickle(self):
+        import cPickle
+        index = cPickle.loads(cPickle.dumps(self.index, 2))
+        offset = self.get_sections()[1][0]
+        self.assertEquals(index.getValue(offset, "description"), "Summary 2")